@@ -0,0 +1,157 @@
+import logging
+import time
+
+import numpy as np
+
+from embedding_store import EmbeddingStore, write_embedding_store
+
+logger = logging.getLogger(__name__)
+
+
+class ExactIndex:
+    """Default backend: no candidate pruning, every document is scored."""
+
+    name = "exact"
+
+    def candidates(self, query_vector, nprobe=None):
+        return None
+
+    def stats(self):
+        return {"backend": self.name}
+
+
+class IVFIndex:
+    """Inverted file index for approximate nearest neighbour search.
+
+    A spherical k-means coarse quantizer partitions the text and about vectors
+    of every document into n_lists clusters. A query only visits the documents
+    in the nprobe clusters whose centroids are closest to it, trading recall
+    for latency; nprobe=n_lists is an exact scan.
+    """
+
+    name = "ivf"
+
+    def __init__(self, centroids, list_offsets, list_ids, nprobe=8, kb_hash=None):
+        self.centroids = centroids
+        self.list_offsets = list_offsets
+        self.list_ids = list_ids
+        self.nprobe = nprobe
+        self.kb_hash = kb_hash
+
+    @property
+    def n_lists(self):
+        return self.centroids.shape[0]
+
+    @classmethod
+    def build(
+        cls,
+        matrices,
+        n_lists=None,
+        iterations=20,
+        nprobe=8,
+        kb_hash=None,
+        seed=0,
+        chunk_size=65536,
+    ):
+        """Cluster the rows of the given L2-normalized (N, d) matrices.
+
+        Row i of every matrix belongs to document i, so a document is listed in
+        the clusters of each of its vectors.
+        """
+        start_time = time.monotonic()
+        vectors = np.concatenate(matrices).astype(np.float32, copy=False)
+        doc_count = matrices[0].shape[0]
+        doc_ids = np.tile(np.arange(doc_count, dtype=np.int32), len(matrices))
+        if n_lists is None:
+            n_lists = int(np.sqrt(len(vectors)))
+        n_lists = max(1, min(n_lists, len(vectors)))
+
+        rng = np.random.default_rng(seed)
+        centroids = vectors[rng.choice(len(vectors), n_lists, replace=False)].copy()
+        for _ in range(iterations):
+            assignments = cls._assign(vectors, centroids, chunk_size)
+            sums = cls._cluster_sums(vectors, assignments, n_lists)
+            norms = np.linalg.norm(sums, axis=1, keepdims=True)
+            # Empty clusters keep their previous centroid
+            non_empty = norms[:, 0] > 0
+            centroids[non_empty] = sums[non_empty] / norms[non_empty]
+        assignments = cls._assign(vectors, centroids, chunk_size)
+
+        # Inverted lists in CSR form, with each document listed once per cluster
+        pairs = np.unique(np.stack([assignments, doc_ids], axis=1), axis=0)
+        list_offsets = np.zeros(n_lists + 1, dtype=np.int64)
+        list_offsets[1:] = np.cumsum(np.bincount(pairs[:, 0], minlength=n_lists))
+        list_ids = pairs[:, 1].astype(np.int32)
+
+        logger.info(
+            f"Built IVF index with {n_lists} lists over {len(vectors)} vectors in {time.monotonic() - start_time:.2f}s"
+        )
+        return cls(centroids, list_offsets, list_ids, nprobe=nprobe, kb_hash=kb_hash)
+
+    @staticmethod
+    def _cluster_sums(vectors, assignments, n_lists):
+        """Sum of the vectors of each cluster.
+
+        Sorting by cluster makes each cluster's rows one contiguous block, summed
+        with a vectorized reduction; np.add.at would add them row by row.
+        """
+        order = np.argsort(assignments, kind="stable")
+        ends = np.cumsum(np.bincount(assignments, minlength=n_lists))
+        sorted_vectors = vectors[order]
+        sums = np.zeros((n_lists, vectors.shape[1]), dtype=np.float32)
+        start = 0
+        for cluster, end in enumerate(ends):
+            if end > start:
+                sums[cluster] = sorted_vectors[start:end].sum(axis=0)
+            start = end
+        return sums
+
+    @staticmethod
+    def _assign(vectors, centroids, chunk_size):
+        assignments = np.empty(len(vectors), dtype=np.int64)
+        for start in range(0, len(vectors), chunk_size):
+            chunk = vectors[start : start + chunk_size]
+            assignments[start : start + chunk_size] = np.argmax(
+                chunk @ centroids.T, axis=1
+            )
+        return assignments
+
+    def candidates(self, query_vector, nprobe=None):
+        """Sorted ids of the documents listed in the nprobe closest clusters."""
+        nprobe = min(nprobe or self.nprobe, self.n_lists)
+        centroid_similarities = self.centroids @ query_vector
+        if nprobe < self.n_lists:
+            probed = np.argpartition(-centroid_similarities, nprobe - 1)[:nprobe]
+        else:
+            probed = np.arange(self.n_lists)
+        lists = [
+            self.list_ids[self.list_offsets[i] : self.list_offsets[i + 1]]
+            for i in probed
+        ]
+        return np.unique(np.concatenate(lists))
+
+    def save(self, path):
+        write_embedding_store(
+            path,
+            {
+                "centroids": self.centroids,
+                "list_offsets": self.list_offsets,
+                "list_ids": self.list_ids,
+            },
+            self.kb_hash,
+            meta={"type": self.name},
+        )
+
+    @classmethod
+    def load(cls, path, nprobe=8):
+        store = EmbeddingStore(path)
+        return cls(
+            store["centroids"],
+            store["list_offsets"],
+            store["list_ids"],
+            nprobe=nprobe,
+            kb_hash=store.kb_hash,
+        )
+
+    def stats(self):
+        return {"backend": self.name, "n_lists": self.n_lists, "nprobe": self.nprobe}
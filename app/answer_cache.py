@@ -0,0 +1,117 @@
+import base64
+import hashlib
+import json
+import logging
+import threading
+
+import numpy as np
+import redis
+
+logger = logging.getLogger(__name__)
+
+
+class AnswerCache:
+    """Redis-backed cache of LLM answers to near-duplicate first-turn questions.
+
+    Answers are bucketed by the knowledge base hash and the set of retrieved
+    documents, so a hit needs the same documents as the cached question, and a
+    rebuild of the knowledge base leaves old buckets unreachable until their TTL
+    expires them. Within a bucket a question matches when the cosine similarity
+    of its embedding to a cached question's is at least threshold.
+    """
+
+    REDIS_KEY_PREFIX = "answer_cache:"
+
+    def __init__(
+        self, redis_client=None, threshold=0.9, ttl=24 * 60 * 60, max_per_key=16
+    ):
+        self.redis_client = redis_client
+        self.threshold = threshold
+        self.ttl = ttl
+        self.max_per_key = max_per_key
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.stores = 0
+
+    @property
+    def enabled(self):
+        return self.redis_client is not None
+
+    def _key(self, namespace, doc_ids):
+        doc_set = ",".join(str(doc_id) for doc_id in sorted(doc_ids))
+        digest = hashlib.sha256(f"{namespace}\0{doc_set}".encode("utf-8")).hexdigest()
+        return self.REDIS_KEY_PREFIX + digest
+
+    @staticmethod
+    def _unit(query_embedding):
+        vector = np.asarray(query_embedding, dtype=np.float32).reshape(-1)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm > 0 else vector
+
+    def get(self, namespace, doc_ids, query_embedding):
+        """The cached answer of the most similar matching question, or None."""
+        if not self.enabled:
+            return None
+        try:
+            entries = self.redis_client.lrange(self._key(namespace, doc_ids), 0, -1)
+        except redis.RedisError as e:
+            logger.warning(f"Error reading answer cache from Redis: {e}")
+            return None
+
+        query = self._unit(query_embedding)
+        best_answer, best_similarity = None, -1.0
+        for encoded in entries:
+            entry = json.loads(encoded)
+            embedding = np.frombuffer(
+                base64.b64decode(entry["embedding"]), dtype=np.float32
+            )
+            similarity = float(embedding @ query)
+            # Entries are newest first, so the newest wins a tie
+            if similarity >= self.threshold and similarity > best_similarity:
+                best_answer, best_similarity = entry["answer"], similarity
+
+        with self._lock:
+            if best_answer is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return best_answer
+
+    def put(self, namespace, doc_ids, query, query_embedding, answer):
+        if not self.enabled:
+            return
+        key = self._key(namespace, doc_ids)
+        entry = json.dumps(
+            {
+                "query": query,
+                "embedding": base64.b64encode(
+                    self._unit(query_embedding).tobytes()
+                ).decode("ascii"),
+                "answer": answer,
+            }
+        )
+        try:
+            # Newest first; the bucket's TTL is refreshed with every new answer
+            pipeline = self.redis_client.pipeline()
+            pipeline.lpush(key, entry)
+            pipeline.ltrim(key, 0, self.max_per_key - 1)
+            pipeline.expire(key, self.ttl)
+            pipeline.execute()
+        except redis.RedisError as e:
+            logger.warning(f"Error writing answer cache to Redis: {e}")
+            return
+        with self._lock:
+            self.stores += 1
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "enabled": self.enabled,
+                "threshold": self.threshold,
+                "hits": self.hits,
+                "misses": self.misses,
+                "stores": self.stores,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
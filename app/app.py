@@ -23,9 +23,11 @@ from intercom import (
     parse_html_to_text,
     set_conversation_human_replied,
     is_conversation_human_replied,
-    answer_intercom_conversation,
+    answer_intercom_job,
     check_intercom_ip,
+    get_intercom_client,
 )
+from job_queue import JobQueue
 from utils import generate
 
 # Configure logging
@@ -43,12 +45,32 @@ app.config["SECRET_KEY"] = os.getenv("SECRET_KEY")
 app.config["SESSION_COOKIE_HTTPONLY"] = True
 app.config["SESSION_COOKIE_SECURE"] = bool(os.getenv("SESSION_COOKIE_SECURE"))
 
-app.rag_system = RAGSystem()
+# Initialize Redis connection
+r = redis.from_url(os.getenv("REDIS_URL"), decode_responses=True)
+
+# Query embeddings are cached in Redis so that all workers share them
+app.rag_system = RAGSystem(redis_client=r)
 
 csrf = CSRFProtect(app)
 
-# Initialize Redis connection
-r = redis.from_url(os.getenv("REDIS_URL"), decode_responses=True)
+
+def run_intercom_job(payload):
+    # answer_intercom_conversation builds its error responses with jsonify
+    with app.app_context():
+        answer_intercom_job(app.rag_system, payload)
+
+
+# Intercom webhooks are answered by background workers, so the webhook returns at once
+intercom_jobs = JobQueue(
+    r,
+    "intercom",
+    run_intercom_job,
+    workers=int(os.getenv("INTERCOM_JOB_WORKERS", "2")),
+)
+intercom_jobs.start()
+
+# WSGI environ key set by the async server on /ask and /v1/ask requests
+DEFERRED_ASK_KEY = "ask.deferred"
 
 
 # Global error handler for unhandled exceptions
@@ -87,6 +109,11 @@ def handle_ask_request(request, session):
         else "Ask Defang Website"
     )
 
+    # The async server (async_app.py) streams the answer itself once the checks pass
+    if request.environ.get(DEFERRED_ASK_KEY):
+        request.environ[DEFERRED_ASK_KEY] = (query, source, anonymous_id)
+        return Response(content_type="text/markdown")
+
     # Use the shared generate function directly
     return Response(
         stream_with_context(generate(app.rag_system, query, source, anonymous_id)),
@@ -177,6 +204,24 @@ def trigger_rebuild():
     return jsonify({"status": "Rebuild started successfully"}), 202
 
 
+@app.route("/stats", methods=["GET"])
+@csrf.exempt
+def stats():
+    token = request.args.get("token")
+    if token != os.getenv("REBUILD_TOKEN"):
+        return jsonify({"error": "Unauthorized"}), 401
+
+    # Counters are per worker process
+    return jsonify(
+        {
+            "pid": os.getpid(),
+            **app.rag_system.get_stats(),
+            "intercom_jobs": intercom_jobs.stats(),
+            "intercom_client": get_intercom_client().stats(),
+        }
+    )
+
+
 @app.route("/data/<path:name>")
 @csrf.exempt
 def download_file(name):
@@ -252,11 +297,19 @@ def handle_webhook():
                 )
                 return "OK"
 
-        # Fetch the conversation and generate an LLM answer for the user
+        # Queue fetching the conversation and generating an LLM answer for the user
         logger.info(
-            f"Detected a user reply in conversation {conversation_id}; fetching an answer from LLM..."
+            f"Detected a user reply in conversation {conversation_id}; queueing an answer from LLM..."
         )
-        answer_intercom_conversation(app.rag_system, conversation_id, topic)
+        # Intercom redelivers a notification with the same id, which must not be answered twice
+        job_id = data.get("id") or hashlib.sha256(request.get_data()).hexdigest()
+        try:
+            intercom_jobs.enqueue(
+                job_id, {"conversation_id": conversation_id, "topic": topic}
+            )
+        except redis.RedisError as e:
+            logger.error(f"Error queueing Intercom job {job_id}: {e}")
+            return jsonify({"error": "Could not queue the webhook"}), 503
 
     else:
         logger.info(
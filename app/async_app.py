@@ -0,0 +1,143 @@
+import asyncio
+import io
+import logging
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import unquote
+
+from aiohttp import web
+from multidict import CIMultiDict
+
+from utils import generate_async
+
+logger = logging.getLogger(__name__)
+
+ASK_ROUTES = ("/ask", "/v1/ask")
+# Set by aiohttp on every response it sends
+HOP_BY_HOP_HEADERS = {"content-length", "transfer-encoding", "connection"}
+
+
+def wsgi_environ(request, body):
+    """WSGI environ for an aiohttp request whose body has already been read."""
+    environ = {
+        "REQUEST_METHOD": request.method,
+        "SCRIPT_NAME": "",
+        "PATH_INFO": unquote(request.raw_path.split("?", 1)[0], encoding="latin-1"),
+        "QUERY_STRING": request.query_string,
+        "SERVER_NAME": request.url.host or "localhost",
+        "SERVER_PORT": str(request.url.port or 80),
+        "SERVER_PROTOCOL": f"HTTP/{request.version.major}.{request.version.minor}",
+        "REMOTE_ADDR": request.remote or "",
+        "CONTENT_LENGTH": str(len(body)),
+        "wsgi.version": (1, 0),
+        "wsgi.url_scheme": request.scheme,
+        "wsgi.input": io.BytesIO(body),
+        "wsgi.errors": sys.stderr,
+        "wsgi.multithread": True,
+        "wsgi.multiprocess": False,
+        "wsgi.run_once": False,
+    }
+    if "Content-Type" in request.headers:
+        environ["CONTENT_TYPE"] = request.headers["Content-Type"]
+    for name, value in request.headers.items():
+        key = "HTTP_" + name.upper().replace("-", "_")
+        if key in ("HTTP_CONTENT_TYPE", "HTTP_CONTENT_LENGTH"):
+            continue
+        environ[key] = f"{environ[key]},{value}" if key in environ else value
+    return environ
+
+
+def call_wsgi(wsgi_app, environ):
+    """Run a WSGI app to completion and return (status, headers, body)."""
+    started = {}
+    chunks = []
+
+    def start_response(status, headers, exc_info=None):
+        started["status"] = int(status.split(" ", 1)[0])
+        started["headers"] = headers
+        return chunks.append
+
+    iterable = wsgi_app(environ, start_response)
+    try:
+        chunks.extend(iterable)
+    finally:
+        if hasattr(iterable, "close"):
+            iterable.close()
+    headers = CIMultiDict(
+        (name, value)
+        for name, value in started["headers"]
+        if name.lower() not in HOP_BY_HOP_HEADERS
+    )
+    return started["status"], headers, b"".join(chunks)
+
+
+def create_app(flask_app, rag_system, deferred_ask_key, executor=None):
+    """aiohttp application serving flask_app with asynchronous /ask streaming.
+
+    Every request is first dispatched to the Flask app in a worker thread, so
+    routing, CSRF, the PoW and Ask Token checks and the session cookie all work
+    exactly as under uWSGI. For /ask and /v1/ask the Flask view only records the
+    checked query in the environ under deferred_ask_key; the answer is then
+    streamed here on the event loop, holding no thread while the LLM generates.
+    """
+    executor = executor or ThreadPoolExecutor(
+        max_workers=int(os.getenv("ASYNC_WORKER_THREADS", "8")),
+        thread_name_prefix="async-app",
+    )
+
+    async def dispatch(request):
+        body = await request.read()
+        environ = wsgi_environ(request, body)
+        if request.method == "POST" and request.path in ASK_ROUTES:
+            environ[deferred_ask_key] = True
+
+        loop = asyncio.get_running_loop()
+        status, headers, body = await loop.run_in_executor(
+            executor, call_wsgi, flask_app, environ
+        )
+        ask = environ.get(deferred_ask_key)
+        if not isinstance(ask, tuple):
+            return web.Response(status=status, headers=headers, body=body)
+
+        # The checks passed: stream the answer with the headers (and session cookie) Flask set
+        query, source, anonymous_id = ask
+        response = web.StreamResponse(status=status, headers=headers)
+        await response.prepare(request)
+        answer = generate_async(rag_system, query, source, anonymous_id)
+        try:
+            async for token in answer:
+                await response.write(token.encode("utf-8"))
+            await response.write_eof()
+        except ConnectionResetError:
+            logger.warning("Client disconnected during streaming")
+        finally:
+            await answer.aclose()
+        return response
+
+    async def on_startup(app):
+        # Retrieval and Redis calls made by the RAG system share the same pool
+        asyncio.get_running_loop().set_default_executor(executor)
+
+    app = web.Application(
+        client_max_size=flask_app.config.get("MAX_CONTENT_LENGTH") or 1024**2
+    )
+    app.router.add_route("*", "/{path:.*}", dispatch)
+
+    async def on_cleanup(app):
+        # Close the keep-alive connections to the LLM gateway made on this loop
+        await rag_system.llm_client.aclose()
+
+    app.on_startup.append(on_startup)
+    app.on_cleanup.append(on_cleanup)
+    return app
+
+
+if __name__ == "__main__":
+    from app import DEFERRED_ASK_KEY, app as flask_app
+
+    web.run_app(
+        create_app(flask_app, flask_app.rag_system, DEFERRED_ASK_KEY),
+        host="0.0.0.0",
+        port=int(os.getenv("PORT", "5050")),
+    )
@@ -0,0 +1,100 @@
+import logging
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+from scoring import to_numpy
+
+logger = logging.getLogger(__name__)
+
+
+class BatchingEncoder:
+    """Coalesces concurrent single-text encode requests into batched encode calls.
+
+    Callers block in encode() while a background thread collects the requests
+    that arrive within max_wait seconds (up to max_batch_size of them), runs one
+    encode call for the whole batch, and hands each caller its own row. With
+    max_batch_size=1 texts are encoded directly on the calling thread.
+    """
+
+    def __init__(self, encode, max_batch_size=16, max_wait=0.005):
+        self._encode = encode
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self._queue = queue.Queue()
+        self._thread = None
+        self._thread_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self.batches = 0
+        self.texts = 0
+        self.largest_batch = 0
+
+    def encode(self, text):
+        if self.max_batch_size <= 1:
+            vector = to_numpy(self._encode([text]))[0]
+            self._record_batch(1)
+            return vector
+
+        future = Future()
+        self._ensure_worker()
+        self._queue.put((text, future))
+        return future.result()
+
+    def _ensure_worker(self):
+        # Started lazily so that no thread exists before uWSGI forks its workers
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._thread_lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(
+                    target=self._run, name="batching-encoder", daemon=True
+                )
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self.max_wait
+            while len(batch) < self.max_batch_size:
+                remaining = deadline - time.monotonic()
+                try:
+                    if remaining > 0:
+                        batch.append(self._queue.get(timeout=remaining))
+                    else:
+                        # Past the deadline, only take what is already queued
+                        batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            self._process(batch)
+
+    def _process(self, batch):
+        texts = [text for text, _ in batch]
+        try:
+            vectors = to_numpy(self._encode(texts))
+        except Exception as e:
+            logger.error(f"Error encoding batch of {len(texts)} queries: {e}")
+            for _, future in batch:
+                future.set_exception(e)
+            return
+
+        self._record_batch(len(batch))
+        for (_, future), vector in zip(batch, vectors):
+            future.set_result(vector)
+
+    def _record_batch(self, size):
+        with self._stats_lock:
+            self.batches += 1
+            self.texts += size
+            self.largest_batch = max(self.largest_batch, size)
+
+    def stats(self):
+        with self._stats_lock:
+            return {
+                "max_batch_size": self.max_batch_size,
+                "max_wait_ms": self.max_wait * 1000,
+                "batches": self.batches,
+                "texts": self.texts,
+                "largest_batch": self.largest_batch,
+                "mean_batch_size": self.texts / self.batches if self.batches else 0.0,
+            }
@@ -0,0 +1,358 @@
+import argparse
+import json
+import logging
+import os
+import platform
+import random
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+from embedding_store import EmbeddingStore, knowledge_base_hash, write_embedding_store
+from encoders import create_encoder, embedding_agreement
+from rag_system import RAGSystem
+from scoring import QuantizedMatrix, ScoringEngine, quantized_arrays, stack_embeddings
+
+logger = logging.getLogger(__name__)
+
+STAGES = ("get_query_embedding", "compute_document_scores", "get_top_docs", "retrieve")
+
+
+def percentiles(samples):
+    """p50/p95/p99 and mean of latency samples given in seconds, in milliseconds."""
+    samples_ms = np.asarray(samples, dtype=np.float64) * 1000
+    if len(samples_ms) == 0:
+        return {"count": 0}
+    p50, p95, p99 = np.percentile(samples_ms, [50, 95, 99])
+    return {
+        "count": len(samples_ms),
+        "mean_ms": float(samples_ms.mean()),
+        "p50_ms": float(p50),
+        "p95_ms": float(p95),
+        "p99_ms": float(p99),
+    }
+
+
+def peak_rss_mb():
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def replicate(knowledge_base, doc_embeddings, doc_about_embeddings, size, seed=0):
+    """Grow a knowledge base and its embeddings to size entries.
+
+    Entries are reused round-robin (the same dicts, so the copy is cheap) and
+    every replica's vectors get a little Gaussian noise, so that scores are not
+    tied and the ranking work is representative of a real corpus of that size.
+    """
+    rng = np.random.default_rng(seed)
+    rows = np.arange(size) % len(knowledge_base)
+    matrices = []
+    for embeddings in (doc_embeddings, doc_about_embeddings):
+        matrix = embeddings[rows]
+        noise = rng.standard_normal(matrix.shape, dtype=np.float32)
+        noise[: len(knowledge_base)] = 0  # the original entries are kept exact
+        matrix += 0.01 * noise
+        matrices.append(matrix)
+        del noise
+    matrix = stack_embeddings(*matrices)
+    return [knowledge_base[i] for i in rows], matrix
+
+
+def load_queries(path, knowledge_base, count, seed=0):
+    """Queries from a file (one per line), or a sample of knowledge base titles."""
+    if path:
+        with open(path, "r") as f:
+            return [line.strip() for line in f if line.strip()][:count]
+    abouts = sorted({doc["about"] for doc in knowledge_base})
+    return random.Random(seed).sample(abouts, min(count, len(abouts)))
+
+
+def benchmark_size(rag_system, queries, iterations, skip_full_scoring=False):
+    timings = {stage: [] for stage in STAGES}
+    for _ in range(iterations):
+        for query in queries:
+            # Measure the encoder, not the query embedding cache
+            rag_system.query_cache.clear()
+            start = time.perf_counter()
+            query_embedding = rag_system.get_query_embedding(query)
+            timings["get_query_embedding"].append(time.perf_counter() - start)
+
+            if not skip_full_scoring:
+                start = time.perf_counter()
+                doc_scores = rag_system.compute_document_scores(
+                    query_embedding,
+                    rag_system.get_doc_embeddings(),
+                    rag_system.get_doc_about_embeddings(),
+                    high_match_threshold=0.8,
+                )
+                timings["compute_document_scores"].append(time.perf_counter() - start)
+
+                start = time.perf_counter()
+                rag_system.get_top_docs(
+                    doc_scores, similarity_threshold=0.4, max_docs=5
+                )
+                timings["get_top_docs"].append(time.perf_counter() - start)
+
+            # The query embedding is cached by now, so this times retrieval itself
+            start = time.perf_counter()
+            rag_system.retrieve(query)
+            timings["retrieve"].append(time.perf_counter() - start)
+    return {stage: percentiles(samples) for stage, samples in timings.items()}
+
+
+def benchmark_search(store, query_embeddings, iterations, rerank_factor, max_docs=5):
+    """Latency of the dense scan of every quantization mode, and its recall of the float32 top max_docs."""
+    matrix = store["doc_matrix"]
+    exact = ScoringEngine(matrix)
+    expected = [
+        set(exact.search(query_embedding, -np.inf, 0.8, max_docs)[0])
+        for query_embedding in query_embeddings
+    ]
+    results = {}
+    for mode in (None, *QuantizedMatrix.MODES):
+        engine = ScoringEngine(
+            matrix,
+            quantization=mode,
+            rerank_factor=rerank_factor,
+            quantized_matrix=QuantizedMatrix.from_store(store, "doc_matrix", mode)
+            if mode
+            else None,
+        )
+        engine.search(query_embeddings[0], -np.inf, 0.8, max_docs)  # fault pages in
+        timings, found = [], 0
+        for _ in range(iterations):
+            for query_embedding, top in zip(query_embeddings, expected):
+                start = time.perf_counter()
+                indices = engine.search(query_embedding, -np.inf, 0.8, max_docs)[0]
+                timings.append(time.perf_counter() - start)
+                found += len(top & set(indices))
+        results[mode or "float32"] = {
+            **percentiles(timings),
+            "recall": found / (iterations * sum(len(top) for top in expected)),
+            "scanned_mb": (
+                matrix.nbytes if mode is None else engine.quantized_matrix.nbytes
+            )
+            / (1024 * 1024),
+        }
+    return results
+
+
+def benchmark_encoders(
+    backends, model_name, onnx_dir, queries, iterations, batch_size=16
+):
+    """Load time, encode latency and agreement with torch of each encoder backend."""
+    encoders = {}
+    results = {}
+    for backend in backends:
+        start = time.perf_counter()
+        encoder = create_encoder(backend, model_name, onnx_dir)
+        load_seconds = time.perf_counter() - start
+        encoder.encode(queries[:1])  # warm up
+
+        single, batched = [], []
+        for _ in range(iterations):
+            for query in queries:
+                start = time.perf_counter()
+                encoder.encode([query])
+                single.append(time.perf_counter() - start)
+            for i in range(0, len(queries), batch_size):
+                start = time.perf_counter()
+                encoder.encode(queries[i : i + batch_size])
+                batched.append(time.perf_counter() - start)
+        encoders[backend] = encoder
+        results[backend] = {
+            "load_seconds": load_seconds,
+            "single": percentiles(single),
+            "batch_size": batch_size,
+            "batch": percentiles(batched),
+        }
+        logger.info(
+            f"{backend} encoder: single p50={results[backend]['single']['p50_ms']:.2f}ms, batch of {batch_size} p50={results[backend]['batch']['p50_ms']:.2f}ms"
+        )
+
+    if "torch" in encoders:
+        for backend, encoder in encoders.items():
+            agreement = embedding_agreement(encoders["torch"], encoder, queries)
+            results[backend]["min_cosine_similarity_to_torch"] = float(agreement.min())
+    return results
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(args):
+    with tempfile.TemporaryDirectory(prefix="rag-benchmark-") as work_dir:
+        return run_in(args, work_dir)
+
+
+def run_in(args, work_dir):
+    # Keep every index file out of ./data so a benchmark never touches the real index
+    class BenchmarkRAGSystem(RAGSystem):
+        EMBEDDINGS_INDEX_PATH = os.path.join(work_dir, "embeddings.index")
+        EMBEDDING_CACHE_PATH = os.path.join(work_dir, "embedding_cache.index")
+        INDEX_GENERATION_PATH = os.path.join(work_dir, "embeddings.generation")
+        ANN_INDEX_PATH = os.path.join(work_dir, "ann.index")
+        BM25_INDEX_PATH = os.path.join(work_dir, "bm25.index")
+        SAMPLE_INDEX_PATH = os.path.join(work_dir, "samples.index")
+
+    start = time.perf_counter()
+    rag_system = BenchmarkRAGSystem(knowledge_base_path=args.knowledge_base)
+    startup_seconds = time.perf_counter() - start
+
+    knowledge_base = rag_system.knowledge_base
+    doc_embeddings = np.array(rag_system.doc_embeddings)
+    doc_about_embeddings = np.array(rag_system.doc_about_embeddings)
+    queries = load_queries(args.queries, knowledge_base, args.query_count)
+    logger.info(f"Benchmarking {len(queries)} queries x {args.iterations} iterations")
+
+    results = []
+    for size in args.sizes or [len(knowledge_base)]:
+        if size != len(knowledge_base):
+            logger.info(f"Replicating knowledge base to {size} entries...")
+            replicated_kb, matrix = replicate(
+                knowledge_base, doc_embeddings, doc_about_embeddings, size
+            )
+            # Hash the small original plus the size rather than a million entries
+            kb_hash = f"{knowledge_base_hash(knowledge_base)}x{size}"
+            write_embedding_store(
+                BenchmarkRAGSystem.EMBEDDINGS_INDEX_PATH,
+                quantized_arrays("doc_matrix", matrix),
+                kb_hash,
+            )
+            del matrix
+            store = EmbeddingStore(BenchmarkRAGSystem.EMBEDDINGS_INDEX_PATH)
+            ann_index = rag_system._load_ann_index(store, rebuild=True)
+            bm25_index = rag_system._load_bm25_index(
+                replicated_kb, kb_hash, rebuild=True
+            )
+            rag_system._swap_snapshot(
+                rag_system._new_snapshot(
+                    replicated_kb,
+                    store,
+                    rag_system.index_generation.value,
+                    ann_index,
+                    bm25_index,
+                )
+            )
+
+        # Warm up the encoder and fault the mapped pages in before timing
+        rag_system.retrieve(queries[0])
+        logger.info(f"Running benchmark at {size} entries...")
+        stages = benchmark_size(
+            rag_system, queries, args.iterations, args.skip_full_scoring
+        )
+        search = benchmark_search(
+            rag_system._snapshot.store,
+            [rag_system.get_query_embedding(query) for query in queries],
+            args.iterations,
+            rag_system.rerank_factor,
+        )
+        results.append(
+            {
+                "size": size,
+                "stages": stages,
+                "search": search,
+                "peak_rss_mb": peak_rss_mb(),
+            }
+        )
+        logger.info(
+            f"{size} entries: retrieve p50={stages['retrieve']['p50_ms']:.2f}ms p99={stages['retrieve']['p99_ms']:.2f}ms, "
+            + ", ".join(
+                f"{mode} scan p50={timings['p50_ms']:.2f}ms"
+                for mode, timings in search.items()
+            )
+        )
+
+    report = {
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "index_backend": rag_system.index_backend,
+        "embedding_quantization": rag_system.embedding_quantization,
+        "bm25_weight": rag_system.fusion_bm25_weight,
+        "queries": len(queries),
+        "iterations": args.iterations,
+        "startup_seconds": startup_seconds,
+        "results": results,
+    }
+    if args.encoder_backends:
+        report["encoders"] = benchmark_encoders(
+            args.encoder_backends,
+            rag_system.MODEL_NAME,
+            rag_system.onnx_model_dir,
+            queries,
+            args.iterations,
+        )
+    return report
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Measure RAGSystem retrieval latency and memory."
+    )
+    parser.add_argument(
+        "--knowledge-base",
+        default="./data/knowledge_base.json",
+        help="knowledge base to load and replicate",
+    )
+    parser.add_argument(
+        "--sizes",
+        type=int,
+        nargs="*",
+        default=[],
+        help="synthetic knowledge base sizes, e.g. 10000 100000 1000000 (default: as loaded)",
+    )
+    parser.add_argument(
+        "--queries", help="file with one query per line (default: sampled titles)"
+    )
+    parser.add_argument("--query-count", type=int, default=50)
+    parser.add_argument("--iterations", type=int, default=3)
+    parser.add_argument(
+        "--skip-full-scoring",
+        action="store_true",
+        help="skip compute_document_scores/get_top_docs, which build one dict per entry",
+    )
+    parser.add_argument(
+        "--encoder-backends",
+        nargs="*",
+        default=[],
+        help="also time query encoding with these backends, e.g. torch onnx onnx-int8",
+    )
+    parser.add_argument("--output", help="write the JSON report here instead of stdout")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    logging.basicConfig(
+        level=logging.INFO,
+        format="%(asctime)s %(levelname)s %(message)s",
+        datefmt="%Y-%m-%d %H:%M:%S",
+    )
+    args = parse_args(argv)
+    report = run(args)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+        logger.info(f"Wrote benchmark report to {args.output}")
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+
+
+if __name__ == "__main__":
+    main()
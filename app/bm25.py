@@ -0,0 +1,177 @@
+import logging
+import re
+import time
+from collections import Counter
+
+import numpy as np
+
+from context_builder import STOPWORDS
+from embedding_store import EmbeddingStore, write_embedding_store
+from scoring import ScoringEngine
+
+logger = logging.getLogger(__name__)
+
+# Identifiers such as compose.yaml, DEFANG_PROVIDER or --provider=aws stay whole
+# tokens, and are also split into their parts
+TOKEN = re.compile(r"\w+(?:[-./:]\w+)*")
+TOKEN_SEPARATOR = re.compile(r"[-./:_]")
+
+
+def tokenize(text):
+    tokens = []
+    for token in TOKEN.findall(text.lower()):
+        if token not in STOPWORDS:
+            tokens.append(token)
+        parts = [part for part in TOKEN_SEPARATOR.split(token) if part]
+        if len(parts) > 1:
+            tokens.extend(part for part in parts if part not in STOPWORDS)
+    return tokens
+
+
+def reciprocal_rank_fusion(rankings, weights, k=60):
+    """Fuse ranked lists of document ids by the sum of weight / (k + rank).
+
+    Returns (ids, scores), best first; ties keep the order of the first ranking.
+    """
+    fused = {}
+    for ranking, weight in zip(rankings, weights):
+        for rank, doc_id in enumerate(ranking, start=1):
+            doc_id = int(doc_id)
+            fused[doc_id] = fused.get(doc_id, 0.0) + weight / (k + rank)
+    ids = sorted(fused, key=lambda doc_id: -fused[doc_id])
+    return np.array(ids, dtype=np.intp), np.array([fused[i] for i in ids])
+
+
+class BM25Index:
+    """Okapi BM25 over the about and text fields of the knowledge base.
+
+    Postings are kept in CSR form: the (doc id, term frequency) pairs of term t
+    are rows offsets[t]:offsets[t + 1] of postings. A query only reads the
+    postings of its own terms, so scoring cost follows the number of matching
+    documents rather than the size of the knowledge base. Title terms count
+    about_weight times, since a title match says more than a body match.
+    """
+
+    name = "bm25"
+
+    def __init__(
+        self, terms, offsets, postings, doc_lengths, k1=1.2, b=0.75, kb_hash=None
+    ):
+        self.terms = terms
+        self.term_ids = {term: i for i, term in enumerate(terms)}
+        self.offsets = offsets
+        self.postings = postings
+        self.doc_lengths = doc_lengths
+        self.average_length = float(doc_lengths.mean()) if len(doc_lengths) else 0.0
+        self.k1 = k1
+        self.b = b
+        self.kb_hash = kb_hash
+
+    @classmethod
+    def build(cls, knowledge_base, about_weight=2, k1=1.2, b=0.75, kb_hash=None):
+        start_time = time.monotonic()
+        vocabulary = {}
+        term_ids, doc_ids, frequencies = [], [], []
+        doc_lengths = np.zeros(len(knowledge_base), dtype=np.float32)
+        for doc_id, doc in enumerate(knowledge_base):
+            counts = Counter(tokenize(doc["text"]))
+            for term in tokenize(doc["about"]):
+                counts[term] += about_weight
+            doc_lengths[doc_id] = sum(counts.values())
+            for term, frequency in counts.items():
+                term_ids.append(vocabulary.setdefault(term, len(vocabulary)))
+                doc_ids.append(doc_id)
+                frequencies.append(frequency)
+
+        # Number the terms alphabetically and group the postings by term
+        terms = sorted(vocabulary)
+        renumbered = np.empty(len(vocabulary), dtype=np.int64)
+        for new_id, term in enumerate(terms):
+            renumbered[vocabulary[term]] = new_id
+        term_ids = renumbered[np.array(term_ids, dtype=np.int64)]
+        doc_ids = np.array(doc_ids, dtype=np.int32)
+        order = np.lexsort((doc_ids, term_ids))
+        postings = np.stack(
+            [doc_ids[order], np.array(frequencies, dtype=np.int32)[order]], axis=1
+        ).reshape(-1, 2)
+        offsets = np.zeros(len(terms) + 1, dtype=np.int64)
+        np.add.at(offsets, term_ids + 1, 1)
+        offsets = np.cumsum(offsets)
+
+        logger.info(
+            f"Built BM25 index with {len(terms)} terms and {len(postings)} postings in {time.monotonic() - start_time:.2f}s"
+        )
+        return cls(terms, offsets, postings, doc_lengths, k1=k1, b=b, kb_hash=kb_hash)
+
+    def scores(self, query):
+        """(doc ids, BM25 scores) of the documents containing any query term."""
+        term_ids = [
+            self.term_ids[term]
+            for term in set(tokenize(query))
+            if term in self.term_ids
+        ]
+        if not term_ids:
+            return np.empty(0, dtype=np.intp), np.empty(0, dtype=np.float64)
+
+        doc_count = len(self.doc_lengths)
+        doc_parts, score_parts = [], []
+        for term_id in term_ids:
+            postings = self.postings[self.offsets[term_id] : self.offsets[term_id + 1]]
+            docs = postings[:, 0]
+            frequencies = postings[:, 1].astype(np.float64)
+            idf = np.log(1 + (doc_count - len(docs) + 0.5) / (len(docs) + 0.5))
+            length_norm = self.k1 * (
+                1 - self.b + self.b * self.doc_lengths[docs] / self.average_length
+            )
+            doc_parts.append(docs)
+            score_parts.append(
+                idf * frequencies * (self.k1 + 1) / (frequencies + length_norm)
+            )
+
+        docs, inverse = np.unique(np.concatenate(doc_parts), return_inverse=True)
+        return docs.astype(np.intp), np.bincount(
+            inverse, weights=np.concatenate(score_parts)
+        )
+
+    def search(self, query, k):
+        """The ids and scores of the k best matching documents, best first."""
+        docs, scores = self.scores(query)
+        top = ScoringEngine.top_k(scores, -np.inf, k)
+        return docs[top], scores[top]
+
+    def save(self, path):
+        write_embedding_store(
+            path,
+            {
+                # The first array must be 2D; see write_embedding_store
+                "postings": self.postings,
+                "offsets": self.offsets,
+                "doc_lengths": self.doc_lengths,
+                "terms": np.array(
+                    [term.encode("utf-8") for term in self.terms], dtype=bytes
+                ),
+            },
+            self.kb_hash,
+            meta={"type": self.name, "k1": self.k1, "b": self.b},
+        )
+
+    @classmethod
+    def load(cls, path):
+        store = EmbeddingStore(path)
+        return cls(
+            [term.decode("utf-8") for term in store["terms"]],
+            store["offsets"],
+            store["postings"],
+            store["doc_lengths"],
+            k1=store.meta["k1"],
+            b=store.meta["b"],
+            kb_hash=store.kb_hash,
+        )
+
+    def stats(self):
+        return {
+            "terms": len(self.terms),
+            "postings": len(self.postings),
+            "k1": self.k1,
+            "b": self.b,
+        }
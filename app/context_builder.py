@@ -0,0 +1,108 @@
+import re
+
+from utils import estimate_tokens
+
+SENTENCE_BOUNDARY = re.compile(r"(?<=[.!?])\s+")
+WORD = re.compile(r"\w+")
+# Section separator and "..." markers around a windowed section
+SEPARATOR_TOKENS = 3
+STOPWORDS = frozenset(
+    "a an and are be can do does for how i in is it my of on or the to what with".split()
+)
+
+
+def split_passages(text, max_tokens):
+    """Split text into sentences, breaking up any sentence longer than max_tokens."""
+    passages = []
+    for sentence in SENTENCE_BOUNDARY.split(text.strip()):
+        if estimate_tokens(sentence) <= max_tokens:
+            if sentence:
+                passages.append(sentence)
+            continue
+        # Reference pages have long runs without sentence punctuation
+        chunk, chunk_tokens = [], 0
+        for word in sentence.split():
+            word_tokens = estimate_tokens(word + " ")
+            if chunk and chunk_tokens + word_tokens > max_tokens:
+                passages.append(" ".join(chunk))
+                chunk, chunk_tokens = [], 0
+            chunk.append(word)
+            chunk_tokens += word_tokens
+        if chunk:
+            passages.append(" ".join(chunk))
+    return passages
+
+
+def query_terms(query):
+    return set(WORD.findall(query.lower())) - STOPWORDS
+
+
+def passage_score(passage, terms):
+    """Number of distinct query terms in the passage."""
+    return len(terms.intersection(WORD.findall(passage.lower())))
+
+
+def window(tokens, best, max_tokens):
+    """[start, end) of the longest run of passages around best that fits in max_tokens."""
+    start, end = best, best + 1
+    used = tokens[best]
+    grown = True
+    while grown:
+        grown = False
+        # Grow forwards first: the text following a match usually explains it
+        if end < len(tokens) and used + tokens[end] <= max_tokens:
+            used += tokens[end]
+            end += 1
+            grown = True
+        if start > 0 and used + tokens[start - 1] <= max_tokens:
+            start -= 1
+            used += tokens[start]
+            grown = True
+    return start, end
+
+
+def build_context(docs, query, max_tokens=2000, doc_max_tokens=600):
+    """Assemble the LLM context from retrieved docs within a token budget.
+
+    Docs are taken in the given (best first) order until max_tokens is spent.
+    A doc longer than doc_max_tokens, or than what is left of the budget, is cut
+    down to a window of sentences around the passage that best matches the
+    query. Sentences already included from another section of the same page
+    (same path) are skipped.
+    """
+    terms = query_terms(query or "")
+    seen = {}
+    sections = []
+    remaining = max_tokens
+    for doc in docs:
+        header = f"{doc['about']}. "
+        header_tokens = estimate_tokens(header) + SEPARATOR_TOKENS
+        budget = min(doc_max_tokens, remaining) - header_tokens
+        if budget <= 0:
+            break
+
+        seen_passages = seen.setdefault(doc.get("path"), set())
+        passages = [
+            passage
+            for passage in split_passages(doc["text"], budget)
+            if passage not in seen_passages
+        ]
+        if not passages:
+            continue
+        # Counted with the space that joins it to the next passage
+        tokens = [estimate_tokens(passage + " ") for passage in passages]
+        scores = [passage_score(passage, terms) for passage in passages]
+        # Ties go to the earliest passage, which for a page is its introduction
+        best = scores.index(max(scores))
+        start, end = window(tokens, best, budget)
+
+        selected = passages[start:end]
+        seen_passages.update(selected)
+        text = " ".join(selected)
+        if start > 0:
+            text = "... " + text
+        if end < len(passages):
+            text += " ..."
+        sections.append(header + text)
+        remaining -= header_tokens + sum(tokens[start:end])
+    return "\n\n".join(sections)
@@ -0,0 +1,153 @@
+import json
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+import redis
+
+from utils import estimate_tokens
+
+logger = logging.getLogger(__name__)
+
+
+class ConversationStore:
+    """Per-conversation chat history with bounded length and TTL expiry.
+
+    Each conversation (a web session's anonymous_id or an Intercom conversation)
+    keeps at most max_turns user/assistant exchanges and expires ttl seconds
+    after its last message. history() returns the most recent turns that fit
+    in max_tokens, so the prompt sent to the LLM stays bounded.
+
+    When a Redis client is given the history lives in Redis, so any uWSGI worker
+    can serve any turn; otherwise it is kept in process, for up to max_conversations
+    conversations.
+    """
+
+    REDIS_KEY_PREFIX = "conversation:"
+
+    def __init__(
+        self,
+        max_turns=10,
+        max_tokens=2000,
+        ttl=60 * 60,
+        max_conversations=10000,
+        redis_client=None,
+    ):
+        self.max_turns = max_turns
+        self.max_tokens = max_tokens
+        self.ttl = ttl
+        self.max_conversations = max_conversations
+        self.redis_client = redis_client
+        self._conversations = OrderedDict()
+        self._lock = threading.Lock()
+
+    @property
+    def max_messages(self):
+        return 2 * self.max_turns
+
+    def history(self, conversation_id):
+        """The latest whole turns of a conversation that fit in the token budget.
+
+        A turn is a user message and the replies to it, so the history never
+        starts with an answer whose question was cut off.
+        """
+        if not conversation_id:
+            return []
+        messages = self._load(conversation_id)
+
+        budget = self.max_tokens
+        start = end = len(messages)
+        for i in range(len(messages) - 1, -1, -1):
+            budget -= estimate_tokens(messages[i]["content"])
+            if budget < 0:
+                break
+            if messages[i]["role"] == "user":
+                start = i
+        return messages[start:end]
+
+    def append(self, conversation_id, *messages):
+        if not conversation_id:
+            return
+        if self.redis_client is not None:
+            self._redis_append(conversation_id, messages)
+            return
+
+        with self._lock:
+            _, history = self._conversations.pop(conversation_id, (None, []))
+            history = (history + list(messages))[-self.max_messages :]
+            self._conversations[conversation_id] = (
+                time.monotonic() + self.ttl,
+                history,
+            )
+            while len(self._conversations) > self.max_conversations:
+                self._conversations.popitem(last=False)
+
+    def clear(self, conversation_id):
+        if self.redis_client is not None:
+            try:
+                self.redis_client.delete(self.REDIS_KEY_PREFIX + conversation_id)
+            except redis.RedisError as e:
+                logger.warning(f"Error clearing conversation in Redis: {e}")
+            return
+        with self._lock:
+            self._conversations.pop(conversation_id, None)
+
+    def _load(self, conversation_id):
+        if self.redis_client is not None:
+            try:
+                encoded = self.redis_client.lrange(
+                    self.REDIS_KEY_PREFIX + conversation_id, 0, -1
+                )
+            except redis.RedisError as e:
+                logger.warning(f"Error reading conversation from Redis: {e}")
+                return []
+            return [json.loads(message) for message in encoded]
+
+        with self._lock:
+            entry = self._conversations.get(conversation_id)
+            if entry is None:
+                return []
+            expires_at, history = entry
+            if expires_at <= time.monotonic():
+                del self._conversations[conversation_id]
+                return []
+            return list(history)
+
+    def _redis_append(self, conversation_id, messages):
+        key = self.REDIS_KEY_PREFIX + conversation_id
+        try:
+            # One round trip; the list is trimmed and its TTL refreshed atomically
+            pipeline = self.redis_client.pipeline()
+            pipeline.rpush(key, *[json.dumps(message) for message in messages])
+            pipeline.ltrim(key, -self.max_messages, -1)
+            pipeline.expire(key, self.ttl)
+            pipeline.execute()
+        except redis.RedisError as e:
+            logger.warning(f"Error writing conversation to Redis: {e}")
+
+    def count(self):
+        """Number of stored conversations, or None if Redis cannot be read."""
+        if self.redis_client is None:
+            with self._lock:
+                return len(self._conversations)
+        try:
+            # Shared by all worker processes; SCAN does not block Redis like KEYS
+            return sum(
+                1
+                for _ in self.redis_client.scan_iter(
+                    match=self.REDIS_KEY_PREFIX + "*", count=1000
+                )
+            )
+        except redis.RedisError as e:
+            logger.warning(f"Error counting conversations in Redis: {e}")
+            return None
+
+    def stats(self):
+        return {
+            "backend": "redis" if self.redis_client is not None else "memory",
+            "conversations": self.count(),
+            "max_turns": self.max_turns,
+            "max_tokens": self.max_tokens,
+            "ttl": self.ttl,
+        }
@@ -0,0 +1,263 @@
+import fcntl
+import hashlib
+import json
+import mmap
+import os
+import struct
+
+import numpy as np
+from atomicwrites import atomic_write
+
+from scoring import to_numpy
+
+# On-disk layout of an embedding store file:
+#
+#   MAGIC | uint32 format version | uint32 header length | JSON header | arrays
+#
+# The JSON header holds the knowledge base content hash, the embedding dimension
+# and dtype, the offset/shape/dtype of every array and a SHA-256 checksum of the
+# array data. Each array starts on an
+# ALIGNMENT boundary so it can be viewed straight out of a read-only mmap; all
+# uWSGI workers mapping the same file share the same page-cache pages.
+MAGIC = b"DFEMBIDX"
+FORMAT_VERSION = 1
+ALIGNMENT = 64
+_PREAMBLE = struct.Struct("<8sII")
+
+
+class EmbeddingStoreError(Exception):
+    pass
+
+
+def knowledge_base_hash(knowledge_base):
+    """Content hash of the knowledge base the embeddings were computed from."""
+    serialized = json.dumps(knowledge_base, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(serialized.encode("utf-8")).hexdigest()
+
+
+def _align(offset):
+    return (offset + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
+
+
+def _checksum(arrays):
+    digest = hashlib.sha256()
+    for array in arrays:
+        digest.update(memoryview(np.ascontiguousarray(array)).cast("B"))
+    return digest.hexdigest()
+
+
+def write_embedding_store(path, arrays, kb_hash, meta=None):
+    """Atomically write named arrays and their header to a single file.
+
+    The first array is the embedding matrix; its dimension and dtype are
+    recorded in the header.
+    """
+    arrays = {name: np.ascontiguousarray(array) for name, array in arrays.items()}
+    if not arrays:
+        raise EmbeddingStoreError("An embedding store needs at least one array")
+    embeddings = next(iter(arrays.values()))
+    if embeddings.ndim != 2:
+        raise EmbeddingStoreError(
+            f"Expected a 2D embedding matrix, got shape {embeddings.shape}"
+        )
+
+    # Lay out the arrays first so the header can record their offsets. The
+    # offsets are relative to the start of the data section, which itself is
+    # aligned, so they do not depend on the header length.
+    layout = {}
+    offset = 0
+    for name, array in arrays.items():
+        offset = _align(offset)
+        layout[name] = {
+            "offset": offset,
+            "shape": list(array.shape),
+            "dtype": array.dtype.str,
+        }
+        offset += array.nbytes
+
+    header = json.dumps(
+        {
+            "kb_hash": kb_hash,
+            "dim": embeddings.shape[1],
+            "dtype": embeddings.dtype.str,
+            "arrays": layout,
+            "checksum": _checksum(arrays.values()),
+            "meta": meta or {},
+        }
+    ).encode("utf-8")
+    data_start = _align(_PREAMBLE.size + len(header))
+
+    with atomic_write(path, mode="wb", overwrite=True) as f:
+        f.write(_PREAMBLE.pack(MAGIC, FORMAT_VERSION, len(header)))
+        f.write(header)
+        position = _PREAMBLE.size + len(header)
+        for name, array in arrays.items():
+            start = data_start + layout[name]["offset"]
+            f.write(b"\0" * (start - position))
+            f.write(array.tobytes())
+            position = start + array.nbytes
+
+
+class EmbeddingStore:
+    """Read-only, memory-mapped view of an embedding store file.
+
+    Opening a store only parses the header and maps the file; pages are faulted
+    in lazily on first access, so re-opening after a rebuild is O(1).
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, "rb") as f:
+            preamble = f.read(_PREAMBLE.size)
+            if len(preamble) != _PREAMBLE.size:
+                raise EmbeddingStoreError(
+                    f"{path} is too short to be an embedding store"
+                )
+            magic, version, header_length = _PREAMBLE.unpack(preamble)
+            if magic != MAGIC:
+                raise EmbeddingStoreError(f"{path} is not an embedding store")
+            if version != FORMAT_VERSION:
+                raise EmbeddingStoreError(
+                    f"{path} has format version {version}, expected {FORMAT_VERSION}"
+                )
+            header = json.loads(f.read(header_length).decode("utf-8"))
+            # The mapping stays valid after the file is closed or atomically replaced
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        self.kb_hash = header["kb_hash"]
+        self.dim = header["dim"]
+        self.dtype = np.dtype(header["dtype"])
+        self.meta = header["meta"]
+        self.checksum = header.get("checksum")
+
+        data_start = _align(_PREAMBLE.size + header_length)
+        self.arrays = {}
+        for name, spec in header["arrays"].items():
+            shape = tuple(spec["shape"])
+            dtype = np.dtype(spec["dtype"])
+            count = int(np.prod(shape))
+            start = data_start + spec["offset"]
+            if start + count * dtype.itemsize > len(self._mmap):
+                raise EmbeddingStoreError(f"{path} is truncated at array {name}")
+            self.arrays[name] = np.frombuffer(
+                self._mmap, dtype=dtype, count=count, offset=start
+            ).reshape(shape)
+
+    def verify(self):
+        """Raise EmbeddingStoreError unless the array data matches its checksum.
+
+        Reads the whole file, so it is meant for a store copied in from
+        elsewhere (e.g. built into the image), not for every re-open.
+        """
+        if self.checksum is None:
+            raise EmbeddingStoreError(f"{self.path} has no checksum")
+        if _checksum(self.arrays.values()) != self.checksum:
+            raise EmbeddingStoreError(f"{self.path} is corrupt: checksum mismatch")
+
+    def __getitem__(self, name):
+        return self.arrays[name]
+
+    def __contains__(self, name):
+        return name in self.arrays
+
+
+class EmbeddingCache:
+    """Persistent text -> embedding cache keyed by a hash of (model name, text).
+
+    Lets a rebuild encode only the knowledge base entries that are new or have
+    changed; vectors for everything else are reused from the previous rebuild.
+    """
+
+    def __init__(self, path, model_name):
+        self.path = path
+        self.model_name = model_name
+        self.hits = 0
+        self.misses = 0
+        self._vectors = {}
+        self._used = set()
+
+        try:
+            store = EmbeddingStore(path)
+        except FileNotFoundError:
+            return
+        except (OSError, ValueError, EmbeddingStoreError):
+            return  # start over with an empty cache
+        if store.meta.get("model") != model_name:
+            return
+        for key, vector in zip(store["keys"], store["vectors"]):
+            self._vectors[key.decode("ascii")] = vector
+
+    def __len__(self):
+        return len(self._vectors)
+
+    def key(self, text):
+        return hashlib.sha256(f"{self.model_name}\0{text}".encode("utf-8")).hexdigest()
+
+    def embed(self, texts, encode):
+        """Embed texts, calling encode(list_of_texts) only for cache misses."""
+        keys = [self.key(text) for text in texts]
+        missing = {}
+        for key, text in zip(keys, texts):
+            if key in self._vectors or key in missing:
+                self.hits += 1
+            else:
+                self.misses += 1
+                missing[key] = text
+
+        if missing:
+            vectors = to_numpy(encode(list(missing.values())))
+            for key, vector in zip(missing, vectors):
+                self._vectors[key] = vector
+
+        self._used.update(keys)
+        if not keys:
+            return np.empty((0, 0), dtype=np.float32)
+        return np.stack([self._vectors[key] for key in keys])
+
+    def save(self):
+        """Persist the vectors used since the cache was opened, dropping stale ones."""
+        keys = sorted(self._used)
+        if not keys:
+            return
+        write_embedding_store(
+            self.path,
+            {
+                "vectors": np.stack([self._vectors[key] for key in keys]),
+                "keys": np.array(keys, dtype="S64"),
+            },
+            None,
+            meta={"model": self.model_name},
+        )
+
+
+class IndexGeneration:
+    """Cross-process index generation number kept in a small memory-mapped file.
+
+    Every worker maps the same file, so reading the current generation is a
+    plain memory access with no syscall and can be done on every request. The
+    writer bumps it after atomically replacing the embedding store.
+    """
+
+    _COUNTER = struct.Struct("<Q")
+
+    def __init__(self, path):
+        self.path = path
+        fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            if os.fstat(fd).st_size < self._COUNTER.size:
+                os.ftruncate(fd, self._COUNTER.size)
+            self._mmap = mmap.mmap(fd, self._COUNTER.size)
+        finally:
+            os.close(fd)
+
+    @property
+    def value(self):
+        return self._COUNTER.unpack_from(self._mmap)[0]
+
+    def bump(self):
+        # Serialize writers across processes; readers never take the lock
+        with open(self.path, "rb") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            value = self.value + 1
+            self._COUNTER.pack_into(self._mmap, 0, value)
+        return value
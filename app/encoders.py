@@ -0,0 +1,227 @@
+import argparse
+import json
+import logging
+import os
+import sys
+
+import numpy as np
+
+from scoring import normalize_rows, to_numpy
+
+logger = logging.getLogger(__name__)
+
+# torch:      SentenceTransformer as is
+# torch-int8: the same model with its Linear layers dynamically quantized to int8
+# onnx:       the transformer exported to ONNX, run with ONNX Runtime (no torch import)
+# onnx-int8:  the ONNX export with int8 weights
+BACKENDS = ("torch", "torch-int8", "onnx", "onnx-int8")
+
+ONNX_MODEL_FILE = "model.onnx"
+ONNX_INT8_MODEL_FILE = "model_int8.onnx"
+TOKENIZER_FILE = "tokenizer.json"
+# Cosine similarity to the torch embeddings below which an export is rejected
+DEFAULT_TOLERANCES = {"torch-int8": 0.05, "onnx": 1e-4, "onnx-int8": 0.05}
+
+
+class EncoderMismatchError(Exception):
+    pass
+
+
+def mean_pooling(token_embeddings, attention_mask):
+    """Average of the token embeddings over the unmasked tokens, as in sentence-transformers."""
+    mask = attention_mask[..., np.newaxis].astype(np.float32)
+    summed = (token_embeddings * mask).sum(axis=1)
+    return summed / np.clip(mask.sum(axis=1), 1e-9, None)
+
+
+class TorchEncoder:
+    """The reference PyTorch SentenceTransformer, optionally with int8 Linear layers."""
+
+    def __init__(self, model_name, quantize=False):
+        from sentence_transformers import SentenceTransformer
+
+        self.model = SentenceTransformer(model_name, device="cpu")
+        if quantize:
+            import torch
+
+            self.model = torch.quantization.quantize_dynamic(
+                self.model, {torch.nn.Linear}, dtype=torch.qint8
+            )
+
+    def encode(self, texts):
+        return to_numpy(self.model.encode(list(texts), convert_to_tensor=True))
+
+
+class OnnxEncoder:
+    """all-MiniLM-L6-v2 exported by export_onnx(), run with ONNX Runtime.
+
+    Tokenization uses the tokenizers library and pooling is done in numpy, so
+    neither torch nor transformers is imported.
+    """
+
+    def __init__(self, model_dir, model_file=ONNX_MODEL_FILE, max_length=256):
+        import onnxruntime
+        from tokenizers import Tokenizer
+
+        self.tokenizer = Tokenizer.from_file(os.path.join(model_dir, TOKENIZER_FILE))
+        self.tokenizer.enable_truncation(max_length)
+        self.tokenizer.enable_padding()  # to the longest text in the batch
+
+        options = onnxruntime.SessionOptions()
+        options.graph_optimization_level = (
+            onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+        )
+        self.session = onnxruntime.InferenceSession(
+            os.path.join(model_dir, model_file),
+            options,
+            providers=["CPUExecutionProvider"],
+        )
+        self.input_names = {
+            model_input.name for model_input in self.session.get_inputs()
+        }
+
+    def encode(self, texts):
+        encodings = self.tokenizer.encode_batch(list(texts))
+        attention_mask = np.array([e.attention_mask for e in encodings], dtype=np.int64)
+        feeds = {
+            "input_ids": np.array([e.ids for e in encodings], dtype=np.int64),
+            "attention_mask": attention_mask,
+        }
+        if "token_type_ids" in self.input_names:
+            feeds["token_type_ids"] = np.array(
+                [e.type_ids for e in encodings], dtype=np.int64
+            )
+        token_embeddings = self.session.run(None, feeds)[0]
+        return normalize_rows(mean_pooling(token_embeddings, attention_mask))
+
+
+def create_encoder(backend, model_name, onnx_dir=None):
+    """An object with encode(list_of_texts) -> float32 array for the given backend."""
+    if backend == "torch":
+        return TorchEncoder(model_name)
+    if backend == "torch-int8":
+        return TorchEncoder(model_name, quantize=True)
+    if backend in ("onnx", "onnx-int8"):
+        if onnx_dir is None:
+            raise ValueError(
+                f"The {backend} encoder needs the exported model directory"
+            )
+        model_file = ONNX_MODEL_FILE if backend == "onnx" else ONNX_INT8_MODEL_FILE
+        return OnnxEncoder(onnx_dir, model_file)
+    raise ValueError(f"Unknown encoder backend {backend!r}, expected one of {BACKENDS}")
+
+
+def embedding_agreement(reference, candidate, texts):
+    """Per-text cosine similarity of candidate's embeddings to reference's."""
+    expected = normalize_rows(reference.encode(texts))
+    actual = normalize_rows(candidate.encode(texts))
+    return np.sum(expected * actual, axis=1)
+
+
+def check_encoder(reference, candidate, texts, tolerance):
+    """Raise EncoderMismatchError if any embedding is off by more than tolerance.
+
+    Returns the lowest cosine similarity to the reference embeddings.
+    """
+    lowest = float(embedding_agreement(reference, candidate, texts).min())
+    if lowest < 1 - tolerance:
+        raise EncoderMismatchError(
+            f"Embeddings differ from the reference: cosine similarity {lowest:.6f} < {1 - tolerance:.6f}"
+        )
+    return lowest
+
+
+def export_onnx(model_name, model_dir, quantize=True, opset=14):
+    """Export the model's transformer and tokenizer to model_dir for OnnxEncoder."""
+    import torch
+    from sentence_transformers import SentenceTransformer
+
+    model = SentenceTransformer(model_name, device="cpu")
+    transformer = model[0].auto_model.eval()
+    os.makedirs(model_dir, exist_ok=True)
+    model.tokenizer.save_pretrained(model_dir)
+
+    sample = model.tokenizer(["An example query"], return_tensors="pt")
+    input_names = [
+        name
+        for name in ("input_ids", "attention_mask", "token_type_ids")
+        if name in sample
+    ]
+    dynamic_axes = {name: {0: "batch", 1: "sequence"} for name in input_names}
+    dynamic_axes["last_hidden_state"] = {0: "batch", 1: "sequence"}
+    model_path = os.path.join(model_dir, ONNX_MODEL_FILE)
+    with torch.no_grad():
+        torch.onnx.export(
+            transformer,
+            tuple(sample[name] for name in input_names),
+            model_path,
+            input_names=input_names,
+            output_names=["last_hidden_state"],
+            dynamic_axes=dynamic_axes,
+            opset_version=opset,
+        )
+    logger.info(f"Exported {model_name} to {model_path}")
+
+    if quantize:
+        from onnxruntime.quantization import QuantType, quantize_dynamic
+
+        int8_path = os.path.join(model_dir, ONNX_INT8_MODEL_FILE)
+        quantize_dynamic(model_path, int8_path, weight_type=QuantType.QInt8)
+        logger.info(f"Quantized {model_path} to {int8_path}")
+
+
+def validation_texts(knowledge_base_path, count=64):
+    with open(knowledge_base_path, "r") as kb_file:
+        knowledge_base = json.load(kb_file)
+    texts = []
+    for doc in knowledge_base[:count]:
+        texts.append(doc["about"])
+        texts.append(f"{doc['about']}. {doc['text']}")
+    return texts
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Export the embedding model to ONNX and check it against torch."
+    )
+    parser.add_argument("--model", default="all-MiniLM-L6-v2")
+    parser.add_argument("--model-dir", default="./data/onnx")
+    parser.add_argument(
+        "--knowledge-base",
+        default="./data/knowledge_base.json",
+        help="entries whose titles and texts are used to compare embeddings",
+    )
+    parser.add_argument(
+        "--no-quantize", action="store_true", help="skip the int8 ONNX model"
+    )
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    logging.basicConfig(
+        level=logging.INFO,
+        format="%(asctime)s %(levelname)s %(message)s",
+        datefmt="%Y-%m-%d %H:%M:%S",
+    )
+    args = parse_args(argv)
+    export_onnx(args.model, args.model_dir, quantize=not args.no_quantize)
+
+    texts = validation_texts(args.knowledge_base)
+    reference = create_encoder("torch", args.model)
+    backends = ["onnx"] if args.no_quantize else ["onnx", "onnx-int8"]
+    report = {}
+    for backend in backends:
+        encoder = create_encoder(backend, args.model, args.model_dir)
+        # Raises, failing the build, if the export does not match torch
+        report[backend] = check_encoder(
+            reference, encoder, texts, DEFAULT_TOLERANCES[backend]
+        )
+        logger.info(
+            f"{backend}: lowest cosine similarity to torch {report[backend]:.6f}"
+        )
+    json.dump({"texts": len(texts), "min_cosine_similarity": report}, sys.stdout)
+    print()
+
+
+if __name__ == "__main__":
+    main()
@@ -2,10 +2,32 @@ import os
 import subprocess
 import re
 import json
+import hashlib
+import itertools
+import time
+from concurrent.futures import ProcessPoolExecutor
+from atomicwrites import atomic_write
 from git import Repo
+from git.exc import GitCommandError, InvalidGitRepositoryError, NoSuchPathError
 import logging
+from context_builder import split_passages
+from utils import estimate_tokens
 
 kb_file_path = "./data/knowledge_base.json"
+# Last indexed commit and parsed sections of each docs file, for incremental rebuilds
+ingest_state_path = "./data/ingest_state.json"
+# Bump when parsing changes, so the next run parses every file again
+INGEST_STATE_VERSION = 1
+# Fewer changed files than this are parsed in-process
+INLINE_PARSE_FILES = 8
+
+# all-MiniLM-L6-v2 only embeds the first 256 word pieces of "about. text"
+CHUNK_MAX_TOKENS = 200
+CHUNK_OVERLAP_TOKENS = 40
+
+# Match `#`, `##`, ..., `######` and `**`
+HEADER = re.compile(r"^(#{1,6}|\*\*+)\s+(.*)")
+DATE_PREFIX = re.compile(r"\/(\d{4})-(\d{2})-(\d{2})-")
 
 
 def clone_repository(repo_url, local_dir):
@@ -68,7 +90,13 @@ def parse_markdown():
     print("Markdown parsing completed successfully.")
 
 
-def parse_markdown_file_to_json(json_output, current_id, file_path):
+def entry_id(path, about, text):
+    """Stable id of a section, derived from its content."""
+    digest = hashlib.sha256(f"{path}\n{about}\n{text}".encode("utf-8"))
+    return digest.hexdigest()[:16]
+
+
+def parse_markdown_file_to_json(json_output, file_path):
     """Parses individual markdown file and adds its content to JSON"""
     with open(file_path, "r", encoding="utf-8") as file:
         lines = file.readlines()
@@ -82,9 +110,7 @@ def parse_markdown_file_to_json(json_output, current_id, file_path):
     has_main_header = False
 
     for line in markdown_content.split("\n"):
-        header_match = re.match(
-            r"^(#{1,6}|\*\*+)\s+(.*)", line
-        )  # Match `#`, `##`, ..., `######` and `**`
+        header_match = HEADER.match(line)
         if header_match:
             header_level = len(header_match.group(1).strip())
             header_text = header_match.group(2).strip()
@@ -118,23 +144,20 @@ def parse_markdown_file_to_json(json_output, current_id, file_path):
         text = " ".join(line for line in section["text"] if line)
 
         if about and text:  # Only insert if both 'about' and 'text' are not empty
+            path = adjust_knowledge_base_entry_path(file_path)  # Adjust path format
             json_output.append(
                 {
-                    "id": current_id,
+                    "id": entry_id(path, about, text),
                     "about": about,
                     "text": text,
-                    "path": adjust_knowledge_base_entry_path(
-                        file_path
-                    ),  # Adjust path format
+                    "path": path,
                 }
             )
 
 
 def adjust_knowledge_base_entry_path(file_path):
     """Adjusts the file path format for storage."""
-    return re.sub(
-        r"\/(\d{4})-(\d{2})-(\d{2})-", r"/\1/\2/\3/", normalize_docs_path(file_path)
-    )
+    return DATE_PREFIX.sub(r"/\1/\2/\3/", normalize_docs_path(file_path))
 
 
 def normalize_docs_path(path):
@@ -142,7 +165,7 @@ def normalize_docs_path(path):
     return path.replace("./.tmp/defang-docs", "").replace(".mdx", "").replace(".md", "")
 
 
-def parse_cli_markdown(json_output, current_id, file_path):
+def parse_cli_markdown(json_output, file_path):
     """Parses CLI-specific markdown files"""
     with open(file_path, "r", encoding="utf-8") as file:
         lines = file.readlines()
@@ -160,39 +183,285 @@ def parse_cli_markdown(json_output, current_id, file_path):
 
     # Only append if both 'about' and 'text' are not empty
     if about and text:
+        path = normalize_docs_path(file_path)
         json_output.append(
             {
-                "id": current_id,
+                "id": entry_id(path, about, text),
                 "about": about,
                 "text": text,
-                "path": normalize_docs_path(file_path),
+                "path": path,
             }
         )
 
 
-def recursive_parse_directory(root_dir):
-    """Recursively parses all markdown files in the directory."""
+def chunk_text(text, max_tokens, overlap_tokens):
+    """Split text into passages of whole sentences of up to max_tokens each.
+
+    Each passage after the first starts with the last sentences (up to
+    overlap_tokens) of the one before it, so no sentence loses its context.
+    """
+    sentences = split_passages(text, max_tokens)
+    tokens = [estimate_tokens(sentence + " ") for sentence in sentences]
+    chunks = []
+    start = 0
+    while start < len(sentences):
+        end, used = start + 1, tokens[start]
+        while end < len(sentences) and used + tokens[end] <= max_tokens:
+            used += tokens[end]
+            end += 1
+        chunks.append(" ".join(sentences[start:end]))
+        if end == len(sentences):
+            break
+        # Step back over the overlap, but always move forward by at least one sentence
+        next_start, overlap = end, 0
+        while (
+            next_start - 1 > start
+            and overlap + tokens[next_start - 1] <= overlap_tokens
+        ):
+            next_start -= 1
+            overlap += tokens[next_start]
+        start = next_start
+    return chunks
+
+
+def chunk_knowledge_base(
+    entries, max_tokens=CHUNK_MAX_TOKENS, overlap_tokens=CHUNK_OVERLAP_TOKENS
+):
+    """Split section entries into overlapping passages for retrieval.
+
+    Every passage keeps the about and path of its section, gets the section's
+    id as "parent_id", the section's number and its own position in it
+    ("section", "chunk"), and a unique id "<parent_id>:<chunk>". Entries that
+    are already passages are kept as they are.
+    """
+    next_section = 1 + max(
+        (entry["section"] for entry in entries if "section" in entry), default=-1
+    )
+    passages = []
+    for entry in entries:
+        if "section" in entry:
+            passages.append(entry)
+            continue
+        # The about line is embedded together with every passage
+        budget = max(
+            max_tokens - estimate_tokens(entry["about"] + ". "), max_tokens // 2
+        )
+        for chunk, text in enumerate(chunk_text(entry["text"], budget, overlap_tokens)):
+            passages.append(
+                {
+                    **entry,
+                    "id": f"{entry['id']}:{chunk}",
+                    "parent_id": entry["id"],
+                    "text": text,
+                    "section": next_section,
+                    "chunk": chunk,
+                }
+            )
+        next_section += 1
+    return passages
+
+
+def is_markdown_file(path):
+    lower_path = path.lower()
+    return lower_path.endswith(".md") or lower_path.endswith(".mdx")
+
+
+def list_markdown_files(root_dir):
+    """All markdown files under root_dir, relative to it, in a stable order."""
     paths = []
     for dirpath, _dirnames, filenames in os.walk(root_dir):
         for filename in filenames:
-            lower_filename = filename.lower()
-            if lower_filename.endswith(".md") or lower_filename.endswith(".mdx"):
-                paths.append(os.path.join(dirpath, filename))
+            if is_markdown_file(filename):
+                relative_path = os.path.relpath(
+                    os.path.join(dirpath, filename), root_dir
+                )
+                paths.append(relative_path.replace(os.sep, "/"))
+    return sorted(paths)
+
+
+def parse_file(relative_path, root_dir):
+    """Parses one markdown file into its sections; runs in a worker process."""
+    entries = []
+    file_path = os.path.join(root_dir, relative_path)
+    if "cli" in relative_path.lower():
+        parse_cli_markdown(entries, file_path)
+    else:
+        parse_markdown_file_to_json(entries, file_path)
+    return entries
 
-    with open(kb_file_path, "r") as kb_file:
-        kb_data = json.load(kb_file)
 
-    for id, file_path in enumerate(paths, start=1):
-        if "cli" in dirpath.lower() or "cli" in filename.lower():
-            parse_cli_markdown(kb_data, id, file_path)
-        else:
-            parse_markdown_file_to_json(kb_data, id, file_path)
+def parse_files(paths, root_dir, workers=None):
+    """Sections of each file, by path; a handful of files is not worth a process pool."""
+    if len(paths) < INLINE_PARSE_FILES:
+        return {path: parse_file(path, root_dir) for path in paths}
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        parsed = pool.map(parse_file, paths, itertools.repeat(root_dir), chunksize=8)
+        return dict(zip(paths, parsed))
+
+
+def git_changes(repo, since):
+    """Markdown files added or modified, and deleted, from commit since to the working tree.
+
+    Untracked files count as added. Raises GitCommandError if since is unknown.
+    """
+    changed, deleted = set(), set()
+    fields = repo.git.diff("--name-status", "--no-renames", "-z", since, "--").split(
+        "\0"
+    )
+    for status, path in zip(fields[::2], fields[1::2]):
+        (deleted if status == "D" else changed).add(path)
+    changed.update(
+        repo.git.ls_files("--others", "--exclude-standard", "-z").split("\0")
+    )
+    return (
+        {path for path in changed if is_markdown_file(path)},
+        {path for path in deleted if is_markdown_file(path)},
+    )
+
+
+def git_markdown_files(repo):
+    """Markdown files git reports changes to: tracked, or untracked and not ignored."""
+    paths = repo.git.ls_files("--cached", "--others", "--exclude-standard", "-z")
+    return {path for path in paths.split("\0") if is_markdown_file(path)}
+
+
+def head_commit(root_dir):
+    """The repository and HEAD commit of root_dir, or (None, None) if it is not a git checkout."""
+    try:
+        repo = Repo(root_dir)
+        return repo, repo.head.commit.hexsha
+    except (InvalidGitRepositoryError, NoSuchPathError, ValueError):
+        return None, None
+
+
+def ingest(root_dir, state=None, workers=None):
+    """Parses the markdown files of root_dir into sections, returning the new ingest state.
+
+    The state records the commit that was indexed and the sections of every
+    file. Given the state of a previous run, only the files that git reports
+    as added or modified since that commit (or that differed from it in the
+    working tree) are parsed again; files that were deleted are dropped and
+    tombstoned with the commit that removed them. Gitignored files, such as
+    prebuild output, are indexed too; git cannot tell whether they changed,
+    so they are parsed on every run. Without a usable state, every file is
+    parsed.
+    """
+    start_time = time.monotonic()
+    repo, commit = head_commit(root_dir)
+    changes = None
+    if (
+        repo is not None
+        and state
+        and state.get("version") == INGEST_STATE_VERSION
+        and state.get("commit")
+    ):
+        try:
+            changes = git_changes(repo, state["commit"])
+        except GitCommandError as e:
+            logging.warning(
+                f"Cannot diff {root_dir} against {state['commit']}, parsing every file: {e}"
+            )
+
+    if changes is None:
+        paths = list_markdown_files(root_dir)
+        files = parse_files(paths, root_dir, workers)
+        tombstones = {}
+    else:
+        changed, deleted = changes
+        on_disk = set(list_markdown_files(root_dir))
+        changed |= on_disk - git_markdown_files(repo)
+        deleted |= state["files"].keys() - on_disk
+        # Files that differed from the indexed commit may since have been reverted
+        for path in state.get("dirty", []):
+            if os.path.exists(os.path.join(root_dir, path)):
+                changed.add(path)
+            else:
+                deleted.add(path)
+        paths = sorted(changed)
+        files = dict(state["files"])
+        files.update(parse_files(paths, root_dir, workers))
+        tombstones = {
+            path: removed_in
+            for path, removed_in in state.get("tombstones", {}).items()
+            if path not in files
+        }
+        for path in sorted(deleted - changed):
+            if files.pop(path, None) is not None:
+                tombstones[path] = commit
+
+    dirty = []
+    if repo is not None:
+        modified, removed = git_changes(repo, commit)
+        dirty = sorted(modified | removed)
+
+    elapsed = time.monotonic() - start_time
+    mode = "all" if changes is None else "changed"
+    logging.info(
+        f"Parsed {len(paths)} {mode} files of {len(files)} in {elapsed:.3f}s ({len(paths) / max(elapsed, 1e-9):.1f} files/s), {len(tombstones)} deleted"
+    )
+    return {
+        "version": INGEST_STATE_VERSION,
+        "commit": commit,
+        "dirty": dirty,
+        "files": {path: files[path] for path in sorted(files)},
+        "tombstones": tombstones,
+    }
+
+
+def knowledge_base_from_state(state):
+    """The knowledge base passages of the files recorded in an ingest state."""
+    sections = [
+        entry for path in sorted(state["files"]) for entry in state["files"][path]
+    ]
+    return chunk_knowledge_base(sections)
 
-    with open(kb_file_path, "w") as kb_file:
-        json.dump(kb_data, kb_file, indent=2)
+
+def build_knowledge_base(root_dir, workers=None):
+    """Parses every markdown file under root_dir into passages, from scratch.
+
+    Files are parsed on a process pool; the result only depends on the files,
+    not on the number of workers or the previous knowledge base.
+    """
+    return knowledge_base_from_state(ingest(root_dir, workers=workers))
+
+
+def write_json(data, path):
+    """Replaces the file atomically, so readers never see a partial file."""
+    with atomic_write(path, overwrite=True, encoding="utf-8") as f:
+        json.dump(data, f, indent=2, ensure_ascii=False)
+
+
+def write_knowledge_base(kb_data, path=None):
+    write_json(kb_data, path or kb_file_path)
+
+
+def load_ingest_state(path):
+    try:
+        with open(path, "r", encoding="utf-8") as state_file:
+            return json.load(state_file)
+    except (OSError, ValueError):
+        return {}
+
+
+def recursive_parse_directory(root_dir, workers=None, state_path=None):
+    """Recursively parses the markdown files in the directory that changed since the last run."""
+    state_path = state_path or ingest_state_path
+    if workers is None and os.getenv("INGEST_WORKERS"):
+        workers = int(os.getenv("INGEST_WORKERS"))
+    states = load_ingest_state(state_path)
+    repo_name = os.path.basename(os.path.normpath(root_dir))
+    state = ingest(root_dir, states.get(repo_name), workers)
+    write_knowledge_base(knowledge_base_from_state(state))
+    # Written last: if the knowledge base write fails, the next run redoes this one
+    write_json({**states, repo_name: state}, state_path)
 
 
 if __name__ == "__main__":
+    logging.basicConfig(
+        level=logging.INFO,
+        format="%(asctime)s %(levelname)s %(message)s",
+        datefmt="%Y-%m-%d %H:%M:%S",
+    )
     setup_repositories()
     run_prebuild_script()
     parse_markdown()  # Start parsing logic after all setups
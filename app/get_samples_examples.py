@@ -1,59 +1,122 @@
 #!/usr/bin/env python
+import argparse
 import os
 import json
+import re
 import tempfile
 import subprocess
-
-
-def clone_repo(repo_url, target_dir):
-    """Clone the repository to a temporary directory."""
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from atomicwrites import atomic_write
+
+SAMPLES_REPO_URL = "https://github.com/DefangLabs/samples"
+# Cloned by get_knowledge_base.py, which runs first in a rebuild
+LOCAL_SAMPLES_CHECKOUT = "./.tmp/samples"
+OUTPUT_FILE = "./data/samples_examples.json"
+
+COMPOSE_FILES = [
+    "compose.yaml",
+    "compose.yml",
+    "docker-compose.yaml",
+    "docker-compose.yml",
+]
+
+# One pass over a lowercased Dockerfile or compose file finds the image of
+# each FROM line and image: field (by base name: "bitnami/redis:7" -> redis,
+# "node:20-alpine" -> node), package manager runs, and all other words
+TECHNOLOGY_RULES = re.compile(
+    r"^[ \t]*(?:from(?:[ \t]+--\S+)*|-?[ \t]*image:)[ \t]+[\"']?(?:\S*/)?(?P<image>[a-z0-9][a-z0-9_.]*)"
+    r"|\b(?P<installer>pip3?|npm|yarn|pnpm)[ \t]+(?:install|add|ci)\b"
+    r"|(?P<word>[a-z]+)",
+    re.MULTILINE,
+)
+IMAGE_TECHNOLOGIES = {
+    "python": "Python",
+    "node": "Node.js",
+    "typescript": "Node.js",
+    "golang": "Go",
+    "php": "PHP",
+    "ruby": "Ruby",
+    "rust": "Rust",
+    "openjdk": "Java",
+    "maven": "Java",
+    "postgres": "PostgreSQL",
+    "mysql": "MySQL",
+    "mariadb": "MySQL",
+    "redis": "Redis",
+    "mongo": "MongoDB",
+    "mongodb": "MongoDB",
+}
+INSTALLERS = {"pip": "pip", "pip3": "pip", "npm": "npm", "yarn": "npm", "pnpm": "npm"}
+# Frameworks named in a Dockerfile that runs their package manager
+FRAMEWORK_TECHNOLOGIES = {
+    "pip": {"flask": "Flask", "django": "Django", "fastapi": "FastAPI"},
+    "npm": {"react": "React", "express": "Express.js", "next": "Next.js"},
+}
+# Services named anywhere in a compose file, e.g. in a connection string
+SERVICE_TECHNOLOGIES = {
+    "postgres": "PostgreSQL",
+    "mysql": "MySQL",
+    "redis": "Redis",
+    "mongodb": "MongoDB",
+}
+
+
+def sparse_clone(repo_url, target_dir):
+    """Shallow clone of the repository with only samples/ checked out."""
     print(f"Cloning {repo_url} to {target_dir}...")
-    subprocess.run(["git", "clone", repo_url, target_dir], check=True)
+    subprocess.run(
+        [
+            "git",
+            "clone",
+            "--depth=1",
+            "--filter=blob:none",
+            "--sparse",
+            repo_url,
+            target_dir,
+        ],
+        check=True,
+    )
+    # Fetches the blobs under samples/ only
+    subprocess.run(
+        ["git", "-C", target_dir, "sparse-checkout", "set", "samples"], check=True
+    )
     print("Repository cloned successfully.")
 
 
+def scan(content):
+    """(images, installers, words) of a Dockerfile or compose file."""
+    images, installers, words = set(), set(), set()
+    for match in TECHNOLOGY_RULES.finditer(content.lower()):
+        if match["image"]:
+            images.add(match["image"])
+        elif match["installer"]:
+            installers.add(INSTALLERS[match["installer"]])
+        else:
+            words.add(match["word"])
+    return images, installers, words
+
+
 def get_technologies(dockerfile_content, compose_content):
     """Extract technologies used in the project based on Dockerfile and compose file."""
-    technologies = []
-
-    # Check for common base images in Dockerfile
-    if "FROM python" in dockerfile_content:
-        technologies.append("Python")
-    if "FROM node" in dockerfile_content:
-        technologies.append("Node.js")
-    if "FROM golang" in dockerfile_content or "FROM golang:" in dockerfile_content:
-        technologies.append("Go")
-    if "FROM php" in dockerfile_content:
-        technologies.append("PHP")
-    if "FROM ruby" in dockerfile_content:
-        technologies.append("Ruby")
-    if "FROM rust" in dockerfile_content:
-        technologies.append("Rust")
-
-    # Check for frameworks and libraries in Dockerfile
-    if "pip install" in dockerfile_content and "flask" in dockerfile_content.lower():
-        technologies.append("Flask")
-    if "pip install" in dockerfile_content and "django" in dockerfile_content.lower():
-        technologies.append("Django")
-    if "npm install" in dockerfile_content and "react" in dockerfile_content.lower():
-        technologies.append("React")
-    if "npm install" in dockerfile_content and "express" in dockerfile_content.lower():
-        technologies.append("Express.js")
-    if "npm install" in dockerfile_content and "next" in dockerfile_content.lower():
-        technologies.append("Next.js")
-
-    # Check compose file for services
-    if compose_content:
-        if "postgres" in compose_content.lower():
-            technologies.append("PostgreSQL")
-        if "mysql" in compose_content.lower():
-            technologies.append("MySQL")
-        if "redis" in compose_content.lower():
-            technologies.append("Redis")
-        if "mongodb" in compose_content.lower():
-            technologies.append("MongoDB")
-
-    return list(set(technologies))  # Remove duplicates
+    technologies = set()
+
+    images, installers, words = scan(dockerfile_content)
+    for installer in installers:
+        frameworks = FRAMEWORK_TECHNOLOGIES[installer]
+        technologies.update(frameworks[word] for word in words & frameworks.keys())
+
+    compose_images, _, compose_words = scan(compose_content or "")
+    images |= compose_images
+    technologies.update(
+        SERVICE_TECHNOLOGIES[word]
+        for word in compose_words & SERVICE_TECHNOLOGIES.keys()
+    )
+    technologies.update(
+        IMAGE_TECHNOLOGIES[image] for image in images if image in IMAGE_TECHNOLOGIES
+    )
+    return sorted(technologies)
 
 
 def generate_description(project_name, technologies):
@@ -65,29 +128,21 @@ def generate_description(project_name, technologies):
 def process_sample_directory(sample_dir):
     """Process a sample directory and extract relevant information."""
     project_name = os.path.basename(sample_dir)
-    print(f"Processing sample: {project_name}")
 
     # Find compose file
     compose_file = None
-    for filename in [
-        "compose.yaml",
-        "compose.yml",
-        "docker-compose.yaml",
-        "docker-compose.yml",
-    ]:
+    for filename in COMPOSE_FILES:
         potential_file = os.path.join(sample_dir, filename)
         if os.path.exists(potential_file):
             compose_file = potential_file
             break
 
-    # Find Dockerfile
+    # Find Dockerfile, the same one on every run
     dockerfile = None
-    for root, _, files in os.walk(sample_dir):
-        for file in files:
-            if file == "Dockerfile":
-                dockerfile = os.path.join(root, file)
-                break
-        if dockerfile:
+    for root, dirs, files in os.walk(sample_dir):
+        dirs.sort()
+        if "Dockerfile" in files:
+            dockerfile = os.path.join(root, "Dockerfile")
             break
 
     if not compose_file and not dockerfile:
@@ -122,40 +177,61 @@ def process_sample_directory(sample_dir):
     return result
 
 
-def main():
-    repo_url = "https://github.com/DefangLabs/samples"
-    output_file = "./data/samples_examples.json"
+def extract_samples(repo_dir, workers=None):
+    """Sample data of every directory under samples/ in repo_dir, in name order."""
+    samples_dir = os.path.join(repo_dir, "samples")
+    sample_dirs = sorted(
+        os.path.join(samples_dir, d)
+        for d in os.listdir(samples_dir)
+        if os.path.isdir(os.path.join(samples_dir, d))
+    )
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        results = pool.map(process_sample_directory, sample_dirs, chunksize=4)
+        return [sample_data for sample_data in results if sample_data]
 
-    with tempfile.TemporaryDirectory() as temp_dir:
-        # Clone the repository
-        clone_repo(repo_url, temp_dir)
 
-        # Process only the /samples directory
-        samples_dir = os.path.join(temp_dir, "samples")
-        if not os.path.exists(samples_dir):
-            print(f"Error: samples directory not found in {temp_dir}")
-            return
+def write_samples(results, output_file):
+    with atomic_write(output_file, overwrite=True) as f:
+        json.dump(results, f, indent=2)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Extract the compose files and Dockerfiles of the Defang samples."
+    )
+    parser.add_argument(
+        "--repo-dir",
+        help=f"existing samples checkout to read (default: {LOCAL_SAMPLES_CHECKOUT} if present, else a fresh sparse clone)",
+    )
+    parser.add_argument("--repo-url", default=SAMPLES_REPO_URL)
+    parser.add_argument("--output", default=OUTPUT_FILE)
+    parser.add_argument("--workers", type=int, help="default: one per CPU")
+    return parser.parse_args(argv)
+
 
-        # Get all subdirectories in the samples directory
-        sample_dirs = [
-            os.path.join(samples_dir, d)
-            for d in os.listdir(samples_dir)
-            if os.path.isdir(os.path.join(samples_dir, d))
-        ]
+def main(argv=None):
+    args = parse_args(argv)
+    repo_dir = args.repo_dir
+    if repo_dir is None and os.path.isdir(
+        os.path.join(LOCAL_SAMPLES_CHECKOUT, "samples")
+    ):
+        repo_dir = LOCAL_SAMPLES_CHECKOUT
 
-        # Process each sample directory
-        results = []
-        for sample_dir in sample_dirs:
-            sample_data = process_sample_directory(sample_dir)
-            if sample_data:
-                results.append(sample_data)
+    with tempfile.TemporaryDirectory() as temp_dir:
+        if repo_dir is None:
+            repo_dir = temp_dir
+            sparse_clone(args.repo_url, repo_dir)
 
-        # Write results to JSON file
-        with open(output_file, "w") as f:
-            json.dump(results, f, indent=2)
+        # Process only the /samples directory
+        if not os.path.exists(os.path.join(repo_dir, "samples")):
+            print(f"Error: samples directory not found in {repo_dir}")
+            return
 
+        start_time = time.monotonic()
+        results = extract_samples(repo_dir, args.workers)
+        write_samples(results, args.output)
         print(
-            f"Successfully processed {len(results)} samples. Results saved to {output_file}"
+            f"Successfully processed {len(results)} samples from {repo_dir} in {time.monotonic() - start_time:.2f}s. Results saved to {args.output}"
         )
 
 
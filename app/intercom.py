@@ -1,14 +1,27 @@
 # Intercom API helper functions for handling conversations and replies
 import os
-import requests
 import hashlib
+import threading
 from flask import jsonify
 from html.parser import HTMLParser
+from intercom_client import IntercomClient, IntercomError
 from utils import generate
 import logging
 
 logger = logging.getLogger(__name__)
 
+_client = None
+_client_lock = threading.Lock()
+
+
+# Returns the worker's Intercom client, so that all calls share its connection pool and rate limit
+def get_intercom_client():
+    global _client
+    with _client_lock:
+        if _client is None:
+            _client = IntercomClient.from_env()
+        return _client
+
 
 class BodyHTMLParser(HTMLParser):
     def __init__(self):
@@ -29,18 +42,15 @@ def fetch_intercom_conversation(conversation_id):
         logger.error(f"Invalid conversation_id: {conversation_id}")
         return jsonify({"error": f"Invalid conversation_id: {conversation_id}"}), 400
 
-    url = "https://api.intercom.io/conversations/" + conversation_id
     token = os.getenv("INTERCOM_TOKEN")
     if not token:
         return jsonify({"error": "Intercom token not set"}), 500
 
-    headers = {
-        "Content-Type": "application/json",
-        "Intercom-Version": "2.13",
-        "Authorization": "Bearer " + token,
-    }
-
-    response = requests.get(url, headers=headers)
+    try:
+        response = get_intercom_client().get_conversation(conversation_id)
+    except IntercomError as e:
+        logger.error(f"Failed to fetch conversation {conversation_id}: {e}")
+        return jsonify({"error": "Failed to reach Intercom"}), 502
     if response.status_code != 200:
         logger.error(
             f"Failed to fetch conversation {conversation_id} from Intercom; status code: {response.status_code}, response: {response.text}"
@@ -172,21 +182,17 @@ def is_conversation_human_replied(conversation_id, redis_client):
 
 # Post a reply to a conversation through Intercom API
 def post_intercom_reply(conversation_id, response_text):
-    url = f"https://api.intercom.io/conversations/{conversation_id}/reply"
     token = os.getenv("INTERCOM_TOKEN")
     if not token:
         return jsonify({"error": "Intercom token not set"}), 500
 
-    headers = {"Content-Type": "application/json", "Authorization": "Bearer " + token}
-
-    payload = {
-        "message_type": "comment",
-        "type": "admin",
-        "admin_id": int(os.getenv("INTERCOM_ADMIN_ID")),
-        "body": response_text,
-    }
-
-    response = requests.post(url, json=payload, headers=headers)
+    try:
+        response = get_intercom_client().reply(
+            conversation_id, int(os.getenv("INTERCOM_ADMIN_ID")), response_text
+        )
+    except IntercomError as e:
+        logger.error(f"Failed to post reply to conversation {conversation_id}: {e}")
+        return jsonify({"error": "Failed to reach Intercom"}), 502
     logger.info(
         f"Posted reply to Intercom; response status code: {response.status_code}"
     )
@@ -225,6 +231,18 @@ def answer_intercom_conversation(rag, conversation_id, topic):
     return post_intercom_reply(conversation_id, llm_response)
 
 
+# Answers a queued Intercom webhook, raising on failure so the job queue counts the job as failed
+def answer_intercom_job(rag, payload):
+    conversation_id = payload["conversation_id"]
+    _, status_code = answer_intercom_conversation(
+        rag, conversation_id, payload["topic"]
+    )
+    if status_code >= 400:
+        raise IntercomError(
+            f"Failed to answer conversation {conversation_id}; status code: {status_code}"
+        )
+
+
 def check_intercom_ip(request):
     # Restrict webhook access to a list of allowed IP addresses
     INTERCOM_ALLOWED_IPS = [
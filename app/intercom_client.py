@@ -0,0 +1,217 @@
+import logging
+import os
+import random
+import threading
+import time
+from email.utils import parsedate_to_datetime
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import NewConnectionError
+
+logger = logging.getLogger(__name__)
+
+
+class IntercomError(Exception):
+    pass
+
+
+def failed_to_connect(error):
+    """Whether a requests.ConnectionError happened before the request was sent."""
+    if isinstance(error, requests.ConnectTimeout):
+        return True
+    # requests wraps urllib3's MaxRetryError, whose reason is the underlying error
+    reason = getattr(error.args[0], "reason", None) if error.args else None
+    return isinstance(reason, NewConnectionError)
+
+
+class RateLimiter:
+    """Thread-safe token bucket: rate requests per second, bursts of up to burst."""
+
+    def __init__(self, rate, burst=1):
+        self.rate = rate
+        self.burst = burst
+        self._tokens = float(burst)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """Take a token, sleeping until one is available; returns the wait in seconds."""
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(
+                self.burst, self._tokens + (now - self._updated) * self.rate
+            )
+            self._updated = now
+            # Reserve the token now; the bucket goes negative while callers wait
+            self._tokens -= 1
+            wait = -self._tokens / self.rate if self._tokens < 0 else 0.0
+        if wait > 0:
+            time.sleep(wait)
+        return wait
+
+
+def retry_after_seconds(value):
+    """Seconds to wait from a Retry-After header (delta seconds or HTTP date)."""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+class IntercomClient:
+    """Intercom REST API client with a pooled keep-alive session.
+
+    Every call has connect and read timeouts and goes through a client-side
+    rate limiter. 429 and 5xx responses are retried with jittered exponential
+    backoff, waiting at least as long as the Retry-After header asks. Non-GET
+    requests are only retried on 429 and 503, and on failures to connect,
+    where Intercom cannot have acted on them, so a reply is never posted twice.
+    """
+
+    BASE_URL = "https://api.intercom.io"
+    RETRY_STATUSES = frozenset({429, 500, 502, 503, 504})
+    # Statuses that mean the request was rejected without being processed
+    UNPROCESSED_STATUSES = frozenset({429, 503})
+
+    def __init__(
+        self,
+        token,
+        base_url=BASE_URL,
+        connect_timeout=5.0,
+        read_timeout=30.0,
+        max_retries=3,
+        backoff=0.5,
+        max_retry_after=30.0,
+        rate_limit=10.0,
+        pool_size=4,
+    ):
+        self.base_url = base_url.rstrip("/")
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_retry_after = max_retry_after
+        self.rate_limiter = RateLimiter(rate_limit, burst=max(1, int(rate_limit)))
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.session.headers.update(
+            {"Content-Type": "application/json", "Authorization": "Bearer " + token}
+        )
+
+        self._stats_lock = threading.Lock()
+        self.requests = 0
+        self.retries = 0
+        self.errors = 0
+        self.throttled_seconds = 0.0
+
+    @classmethod
+    def from_env(cls):
+        return cls(
+            os.getenv("INTERCOM_TOKEN", ""),
+            connect_timeout=float(os.getenv("INTERCOM_CONNECT_TIMEOUT", "5")),
+            read_timeout=float(os.getenv("INTERCOM_READ_TIMEOUT", "30")),
+            max_retries=int(os.getenv("INTERCOM_MAX_RETRIES", "3")),
+            rate_limit=float(os.getenv("INTERCOM_RATE_LIMIT", "10")),
+        )
+
+    def _count(self, name, delta=1):
+        with self._stats_lock:
+            setattr(self, name, getattr(self, name) + delta)
+
+    def _delay(self, attempt, response=None):
+        delay = random.uniform(0, self.backoff * 2**attempt)
+        if response is not None:
+            retry_after = retry_after_seconds(response.headers.get("Retry-After"))
+            if retry_after is not None:
+                delay = max(delay, retry_after)
+        return delay
+
+    def request(self, method, path, **kwargs):
+        """Send a request and return the final response, whatever its status.
+
+        Raises IntercomError when Intercom could not be reached.
+        """
+        url = self.base_url + path
+        idempotent = method.upper() == "GET"
+        for attempt in range(self.max_retries + 1):
+            waited = self.rate_limiter.acquire()
+            if waited:
+                self._count("throttled_seconds", waited)
+            self._count("requests")
+            response = None
+            try:
+                response = self.session.request(
+                    method,
+                    url,
+                    timeout=(self.connect_timeout, self.read_timeout),
+                    **kwargs,
+                )
+            except requests.ConnectionError as e:
+                # Failing to connect is safe to retry for any method; a dropped
+                # connection (or a read timeout) may have been acted on
+                retryable = idempotent or failed_to_connect(e)
+                error = IntercomError(f"Intercom {method} {path} failed: {e}")
+            except requests.Timeout as e:
+                retryable = idempotent
+                error = IntercomError(f"Intercom {method} {path} timed out: {e}")
+            else:
+                retryable = response.status_code in (
+                    self.RETRY_STATUSES if idempotent else self.UNPROCESSED_STATUSES
+                )
+                if not retryable or attempt == self.max_retries:
+                    return response
+
+            if not retryable or attempt == self.max_retries:
+                break
+            delay = self._delay(attempt, response)
+            if delay > self.max_retry_after:
+                if response is not None:
+                    return response
+                break
+            self._count("retries")
+            reason = error if response is None else f"status {response.status_code}"
+            logger.warning(
+                f"Intercom {method} {path} got {reason}; retrying in {delay:.2f}s ({attempt + 1}/{self.max_retries})"
+            )
+            if response is not None:
+                response.close()
+            time.sleep(delay)
+        self._count("errors")
+        raise error
+
+    def get_conversation(self, conversation_id):
+        return self.request(
+            "GET",
+            f"/conversations/{conversation_id}",
+            headers={"Intercom-Version": "2.13"},
+        )
+
+    def reply(self, conversation_id, admin_id, body):
+        payload = {
+            "message_type": "comment",
+            "type": "admin",
+            "admin_id": admin_id,
+            "body": body,
+        }
+        return self.request(
+            "POST", f"/conversations/{conversation_id}/reply", json=payload
+        )
+
+    def stats(self):
+        with self._stats_lock:
+            return {
+                "requests": self.requests,
+                "retries": self.retries,
+                "errors": self.errors,
+                "throttled_seconds": self.throttled_seconds,
+            }
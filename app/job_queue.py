@@ -0,0 +1,162 @@
+import json
+import logging
+import threading
+import time
+from collections import deque
+
+import redis
+
+logger = logging.getLogger(__name__)
+
+
+class JobQueue:
+    """Redis list of jobs processed by a pool of background worker threads.
+
+    enqueue() claims the job's idempotency key with SET NX before pushing it, so
+    a job delivered twice (e.g. a redelivered webhook) is only ever queued once,
+    by whichever worker process sees it first. Jobs are popped before they run
+    and are not retried, so a job that fails is logged rather than run twice.
+    """
+
+    REDIS_KEY_PREFIX = "jobs:"
+
+    def __init__(
+        self,
+        redis_client,
+        name,
+        handler,
+        workers=2,
+        dedupe_ttl=24 * 60 * 60,
+        poll_timeout=1,
+        latency_window=1000,
+    ):
+        self.redis_client = redis_client
+        self.name = name
+        self.handler = handler
+        self.workers = workers
+        self.dedupe_ttl = dedupe_ttl
+        self.poll_timeout = poll_timeout
+        self.queue_key = f"{self.REDIS_KEY_PREFIX}{name}:queue"
+        self._threads = []
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+        # (seconds waiting in the queue, seconds from enqueue to done) of recent jobs
+        self._latencies = deque(maxlen=latency_window)
+        self.enqueued = 0
+        self.duplicates = 0
+        self.processed = 0
+        self.failed = 0
+
+    def _seen_key(self, job_id):
+        return f"{self.REDIS_KEY_PREFIX}{self.name}:seen:{job_id}"
+
+    def enqueue(self, job_id, payload):
+        """Queue payload unless job_id was queued before; False for a duplicate.
+
+        Redis errors are raised, so the caller can ask for a redelivery.
+        """
+        seen_key = self._seen_key(job_id)
+        if not self.redis_client.set(seen_key, "1", nx=True, ex=self.dedupe_ttl):
+            with self._lock:
+                self.duplicates += 1
+            logger.info(f"Skipping duplicate {self.name} job {job_id}")
+            return False
+
+        job = json.dumps({"id": job_id, "payload": payload, "enqueued_at": time.time()})
+        try:
+            self.redis_client.lpush(self.queue_key, job)
+        except redis.RedisError:
+            # Let a redelivery of the same job through
+            self.redis_client.delete(seen_key)
+            raise
+        with self._lock:
+            self.enqueued += 1
+        return True
+
+    def process_next(self, timeout=None):
+        """Pop and run one job, waiting up to timeout seconds; False if none came."""
+        popped = self.redis_client.brpop(
+            self.queue_key, timeout=self.poll_timeout if timeout is None else timeout
+        )
+        if popped is None:
+            return False
+
+        job = json.loads(popped[1])
+        started = time.time()
+        try:
+            self.handler(job["payload"])
+        except Exception as e:
+            logger.error(f"{self.name} job {job['id']} failed: {e}", exc_info=True)
+            with self._lock:
+                self.failed += 1
+        else:
+            with self._lock:
+                self.processed += 1
+        finished = time.time()
+        with self._lock:
+            self._latencies.append(
+                (started - job["enqueued_at"], finished - job["enqueued_at"])
+            )
+        return True
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                self.process_next()
+            except redis.RedisError as e:
+                logger.warning(f"Error reading {self.name} jobs from Redis: {e}")
+                self._stop.wait(self.poll_timeout)
+
+    def start(self):
+        if self._threads:
+            return
+        self._stop.clear()
+        for i in range(self.workers):
+            thread = threading.Thread(
+                target=self._run, name=f"{self.name}-worker-{i}", daemon=True
+            )
+            thread.start()
+            self._threads.append(thread)
+        logger.info(f"Started {self.workers} {self.name} job workers")
+
+    def stop(self):
+        self._stop.set()
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+
+    def depth(self):
+        try:
+            return self.redis_client.llen(self.queue_key)
+        except redis.RedisError as e:
+            logger.warning(f"Error reading {self.name} queue depth from Redis: {e}")
+            return None
+
+    @staticmethod
+    def _percentile_ms(values, percentile):
+        if not values:
+            return 0.0
+        values = sorted(values)
+        index = min(len(values) - 1, int(round(percentile / 100 * (len(values) - 1))))
+        return values[index] * 1000
+
+    def stats(self):
+        with self._lock:
+            waits = [wait for wait, _ in self._latencies]
+            totals = [total for _, total in self._latencies]
+            counters = {
+                "workers": len(self._threads),
+                "enqueued": self.enqueued,
+                "duplicates": self.duplicates,
+                "processed": self.processed,
+                "failed": self.failed,
+            }
+        return {
+            # Shared by all worker processes
+            "depth": self.depth(),
+            **counters,
+            "wait_ms_p50": self._percentile_ms(waits, 50),
+            "wait_ms_p95": self._percentile_ms(waits, 95),
+            "latency_ms_p50": self._percentile_ms(totals, 50),
+            "latency_ms_p95": self._percentile_ms(totals, 95),
+        }
@@ -0,0 +1,242 @@
+import asyncio
+import json
+import logging
+import os
+import random
+import threading
+import time
+
+import aiohttp
+import requests
+from requests.adapters import HTTPAdapter
+
+logger = logging.getLogger(__name__)
+
+
+class LLMError(Exception):
+    pass
+
+
+# Returned by parse_sse_line for the terminating "data: [DONE]" event
+DONE = object()
+
+
+def parse_sse_line(line):
+    """The JSON payload of a server-sent event line, None for other lines."""
+    if isinstance(line, bytes):
+        line = line.decode("utf-8")
+    line = line.strip()
+    if not line.startswith("data:"):
+        return None
+    data = line[len("data:") :].strip()
+    if data == "[DONE]":
+        return DONE
+    return json.loads(data)
+
+
+class LLMClient:
+    """Streaming client for an OpenAI-compatible chat completions endpoint.
+
+    A single requests session (and, for the async server, a single aiohttp
+    session) per worker keeps a pool of keep-alive connections to the gateway,
+    so requests do not pay for a new TCP connection each time. At most
+    max_concurrency completions stream at once per worker; further requests
+    wait up to queue_timeout for a slot. Connection errors, timeouts and
+    retryable statuses are retried with jittered exponential backoff, but only
+    before the response starts streaming, so a caller never sees tokens twice.
+    """
+
+    RETRY_STATUSES = frozenset({408, 429, 500, 502, 503, 504})
+
+    def __init__(
+        self,
+        base_url,
+        api_key=None,
+        connect_timeout=5.0,
+        read_timeout=60.0,
+        pool_size=16,
+        max_concurrency=64,
+        queue_timeout=30.0,
+        max_retries=2,
+        backoff=0.5,
+    ):
+        self.url = base_url.rstrip("/") + "/chat/completions"
+        self.headers = {"Content-Type": "application/json"}
+        if api_key:
+            self.headers["Authorization"] = f"Bearer {api_key}"
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.pool_size = pool_size
+        self.max_concurrency = max_concurrency
+        self.queue_timeout = queue_timeout
+        self.max_retries = max_retries
+        self.backoff = backoff
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self._slots = threading.BoundedSemaphore(max_concurrency)
+        # aiohttp sessions and asyncio semaphores belong to the loop they were made on
+        self._async_loop = None
+        self._async_session = None
+        self._async_slots = None
+
+        self._stats_lock = threading.Lock()
+        self.requests = 0
+        self.retries = 0
+        self.errors = 0
+        self.active = 0
+
+    @classmethod
+    def from_env(cls):
+        return cls(
+            os.getenv("OPENAI_BASE_URL") or "https://api.openai.com/v1",
+            api_key=os.getenv("OPENAI_API_KEY"),
+            connect_timeout=float(os.getenv("LLM_CONNECT_TIMEOUT", "5")),
+            read_timeout=float(os.getenv("LLM_READ_TIMEOUT", "60")),
+            pool_size=int(os.getenv("LLM_POOL_SIZE", "16")),
+            max_concurrency=int(os.getenv("LLM_MAX_CONCURRENCY", "64")),
+            max_retries=int(os.getenv("LLM_MAX_RETRIES", "2")),
+        )
+
+    def _delay(self, attempt):
+        # Full jitter, so that workers retrying together do not stampede the gateway
+        return random.uniform(0, self.backoff * 2**attempt)
+
+    def _count(self, name, delta=1):
+        with self._stats_lock:
+            setattr(self, name, getattr(self, name) + delta)
+
+    def _status_error(self, status, body):
+        return LLMError(f"LLM gateway returned {status}: {body[:500]}")
+
+    def stream_chat(self, **params):
+        """Yield the chunks of a streamed chat completion as dicts."""
+        if not self._slots.acquire(timeout=self.queue_timeout):
+            self._count("errors")
+            raise LLMError(f"No LLM slot free after {self.queue_timeout}s")
+        self._count("active")
+        try:
+            response = self._post(params)
+            with response:
+                for line in response.iter_lines():
+                    chunk = parse_sse_line(line)
+                    if chunk is DONE:
+                        return
+                    if chunk is not None:
+                        yield chunk
+        finally:
+            self._count("active", -1)
+            self._slots.release()
+
+    def _post(self, params):
+        payload = {**params, "stream": True}
+        for attempt in range(self.max_retries + 1):
+            self._count("requests")
+            try:
+                response = self.session.post(
+                    self.url,
+                    json=payload,
+                    headers=self.headers,
+                    stream=True,
+                    timeout=(self.connect_timeout, self.read_timeout),
+                )
+            except (requests.ConnectionError, requests.Timeout) as e:
+                error = LLMError(f"LLM gateway request failed: {e}")
+            else:
+                if response.status_code == 200:
+                    return response
+                error = self._status_error(response.status_code, response.text)
+                response.close()
+                if response.status_code not in self.RETRY_STATUSES:
+                    break
+
+            if attempt < self.max_retries:
+                self._count("retries")
+                logger.warning(f"{error}; retrying ({attempt + 1}/{self.max_retries})")
+                time.sleep(self._delay(attempt))
+        self._count("errors")
+        raise error
+
+    async def _async_state(self):
+        loop = asyncio.get_running_loop()
+        if self._async_loop is not loop:
+            previous = self._async_session
+            self._async_loop = loop
+            self._async_session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=self.pool_size),
+                timeout=aiohttp.ClientTimeout(
+                    sock_connect=self.connect_timeout, sock_read=self.read_timeout
+                ),
+            )
+            self._async_slots = asyncio.Semaphore(self.max_concurrency)
+            # Made on a loop that is gone (e.g. a previous asyncio.run); close it
+            # rather than leak its connector
+            if previous is not None and not previous.closed:
+                await previous.close()
+        return self._async_session, self._async_slots
+
+    async def aclose(self):
+        """Close the aiohttp session, e.g. when the async server shuts down."""
+        session = self._async_session
+        self._async_loop = self._async_session = self._async_slots = None
+        if session is not None and not session.closed:
+            await session.close()
+
+    async def astream_chat(self, **params):
+        """Async variant of stream_chat."""
+        session, slots = await self._async_state()
+        try:
+            await asyncio.wait_for(slots.acquire(), self.queue_timeout)
+        except asyncio.TimeoutError:
+            self._count("errors")
+            raise LLMError(f"No LLM slot free after {self.queue_timeout}s")
+        self._count("active")
+        try:
+            response = await self._apost(session, params)
+            async with response:
+                async for line in response.content:
+                    chunk = parse_sse_line(line)
+                    if chunk is DONE:
+                        return
+                    if chunk is not None:
+                        yield chunk
+        finally:
+            self._count("active", -1)
+            slots.release()
+
+    async def _apost(self, session, params):
+        payload = {**params, "stream": True}
+        for attempt in range(self.max_retries + 1):
+            self._count("requests")
+            try:
+                response = await session.post(
+                    self.url, json=payload, headers=self.headers
+                )
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                error = LLMError(f"LLM gateway request failed: {e!r}")
+            else:
+                if response.status == 200:
+                    return response
+                error = self._status_error(response.status, await response.text())
+                response.release()
+                if response.status not in self.RETRY_STATUSES:
+                    break
+
+            if attempt < self.max_retries:
+                self._count("retries")
+                logger.warning(f"{error}; retrying ({attempt + 1}/{self.max_retries})")
+                await asyncio.sleep(self._delay(attempt))
+        self._count("errors")
+        raise error
+
+    def stats(self):
+        with self._stats_lock:
+            return {
+                "max_concurrency": self.max_concurrency,
+                "active": self.active,
+                "requests": self.requests,
+                "retries": self.retries,
+                "errors": self.errors,
+            }
@@ -0,0 +1,112 @@
+import base64
+import hashlib
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+import redis
+
+logger = logging.getLogger(__name__)
+
+
+class QueryEmbeddingCache:
+    """Bounded, thread-safe LRU cache of normalized query -> embedding vector.
+
+    Entries expire after ttl seconds. When a Redis client is given, vectors are
+    also written to Redis so that every uWSGI worker shares them and they
+    survive restarts; the in-process LRU sits in front of Redis.
+    """
+
+    REDIS_KEY_PREFIX = "query_embedding:"
+
+    def __init__(self, namespace, maxsize=1024, ttl=24 * 60 * 60, redis_client=None):
+        self.namespace = namespace
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.redis_client = redis_client
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.redis_hits = 0
+        self.misses = 0
+
+    def _key(self, query):
+        # Namespaced by model so a model change never serves stale vectors
+        return hashlib.sha256(f"{self.namespace}\0{query}".encode("utf-8")).hexdigest()
+
+    def get(self, query):
+        key = self._key(query)
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                expires_at, vector = entry
+                if expires_at > now:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return vector
+                del self._entries[key]
+
+        vector = self._redis_get(key)
+        with self._lock:
+            if vector is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.redis_hits += 1
+        self._store(key, vector, now)
+        return vector
+
+    def put(self, query, vector):
+        key = self._key(query)
+        vector = np.array(vector, dtype=np.float32).reshape(-1)
+        vector.setflags(write=False)  # shared between callers
+        self._store(key, vector, time.monotonic())
+        self._redis_set(key, vector)
+
+    def _store(self, key, vector, now):
+        with self._lock:
+            self._entries[key] = (now + self.ttl, vector)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def _redis_get(self, key):
+        if self.redis_client is None:
+            return None
+        try:
+            encoded = self.redis_client.get(self.REDIS_KEY_PREFIX + key)
+        except redis.RedisError as e:
+            logger.warning(f"Error reading query embedding from Redis: {e}")
+            return None
+        if encoded is None:
+            return None
+        return np.frombuffer(base64.b64decode(encoded), dtype=np.float32)
+
+    def _redis_set(self, key, vector):
+        if self.redis_client is None:
+            return
+        # base64 keeps the value safe for clients created with decode_responses=True
+        encoded = base64.b64encode(vector.tobytes()).decode("ascii")
+        try:
+            self.redis_client.set(self.REDIS_KEY_PREFIX + key, encoded, ex=self.ttl)
+        except redis.RedisError as e:
+            logger.warning(f"Error writing query embedding to Redis: {e}")
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._entries),
+                "maxsize": self.maxsize,
+                "hits": self.hits,
+                "redis_hits": self.redis_hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
@@ -1,73 +1,453 @@
-import openai
+import asyncio
 import json
 import os
 import sys
 import logging
 import threading
+import time
 from datetime import date
-from sentence_transformers import SentenceTransformer
 import numpy as np
-from sklearn.metrics.pairwise import cosine_similarity
 import traceback
-from atomicwrites import atomic_write
+from ann_index import ExactIndex, IVFIndex
+from answer_cache import AnswerCache
+from bm25 import BM25Index, reciprocal_rank_fusion
+from batching import BatchingEncoder
+from context_builder import build_context
+from conversation_store import ConversationStore
+from embedding_store import (
+    EmbeddingCache,
+    EmbeddingStore,
+    EmbeddingStoreError,
+    IndexGeneration,
+    knowledge_base_hash,
+    write_embedding_store,
+)
+from encoders import BACKENDS as ENCODER_BACKENDS, create_encoder
+from llm_client import LLMClient
+from query_cache import QueryEmbeddingCache
+from sample_index import SAMPLES_URL, SampleIndex, format_samples, load_samples
+from scoring import (
+    QuantizedMatrix,
+    ScoringEngine,
+    normalize_rows,
+    quantized_arrays,
+    stack_embeddings,
+    to_numpy,
+)
 
 
-openai.api_base = os.getenv("OPENAI_BASE_URL")
-openai.api_key = os.getenv("OPENAI_API_KEY")
+class PreparedAnswer:
+    """A question ready to be answered: the LLM messages, or a cached answer."""
+
+    def __init__(self, query, conversation_id, normalized_query, citations):
+        self.query = query
+        self.conversation_id = conversation_id
+        self.normalized_query = normalized_query
+        self.citations = citations
+        self.messages = None
+        self.cache_key = None
+        self.query_embedding = None
+        self.cached_answer = None
+
+    def references(self):
+        return "\n\nReferences:\n" + "\n".join(self.citations)
+
+
+class IndexSnapshot:
+    """Knowledge base and embeddings that are swapped in together as one object.
+
+    Request handlers read RAGSystem._snapshot once and use only that object, so
+    a concurrent swap can never pair one knowledge base with another's vectors.
+    """
+
+    def __init__(
+        self,
+        knowledge_base,
+        store,
+        generation,
+        ann_index=None,
+        quantization=None,
+        rerank_factor=4,
+        bm25_index=None,
+        sample_index=None,
+    ):
+        self.knowledge_base = knowledge_base
+        self.store = store
+        self.generation = generation
+        self.ann_index = ann_index or ExactIndex()
+        # None when hybrid retrieval is off
+        self.bm25_index = bm25_index
+        # None when there are no samples or sample context is off
+        self.sample_index = sample_index
+        # The store holds the stacked, pre-normalized matrix and its quantized
+        # copies, so the scoring engine uses the read-only mapped pages directly
+        # instead of a private copy per worker
+        self.scoring_engine = ScoringEngine(
+            store["doc_matrix"],
+            quantization=quantization,
+            rerank_factor=rerank_factor,
+            quantized_matrix=QuantizedMatrix.from_store(
+                store, "doc_matrix", quantization
+            )
+            if quantization
+            else None,
+        )
 
 
 class RAGSystem:
+    MODEL_NAME = "all-MiniLM-L6-v2"
+
     # Cache file paths
-    DOC_EMBEDDINGS_PATH = "./data/doc_embeddings.npy"
-    DOC_ABOUT_EMBEDDINGS_PATH = "./data/doc_about_embeddings.npy"
+    EMBEDDINGS_INDEX_PATH = "./data/embeddings.index"
+    EMBEDDING_CACHE_PATH = "./data/embedding_cache.index"
+    INDEX_GENERATION_PATH = "./data/embeddings.generation"
+    ANN_INDEX_PATH = "./data/ann.index"
+    BM25_INDEX_PATH = "./data/bm25.index"
+    SAMPLES_PATH = "./data/samples_examples.json"
+    SAMPLE_INDEX_PATH = "./data/samples.index"
 
-    def __init__(self, knowledge_base_path="./data/knowledge_base.json"):
+    INDEX_BACKENDS = ("exact", "ivf")
+    MODEL_LOAD_MODES = ("eager", "lazy", "background")
+
+    def __init__(
+        self, knowledge_base_path="./data/knowledge_base.json", redis_client=None
+    ):
+        started = time.monotonic()
         self._update_lock = threading.Lock()
         self.knowledge_base_path = knowledge_base_path
+        # The model is only needed to embed queries and rebuilds, so serving can
+        # start from the prebuilt index while it loads ("background") or on first use ("lazy")
+        self.model_load = os.getenv("RAG_MODEL_LOAD", "background")
+        if self.model_load not in self.MODEL_LOAD_MODES:
+            raise ValueError(
+                f"Unknown RAG_MODEL_LOAD {self.model_load!r}, expected one of {self.MODEL_LOAD_MODES}"
+            )
+        self._model = None
+        self._model_lock = threading.Lock()
+        # torch, or an ONNX Runtime / int8 export checked against it (see encoders.py)
+        self.encoder_backend = os.getenv("RAG_ENCODER_BACKEND", "torch")
+        if self.encoder_backend not in ENCODER_BACKENDS:
+            raise ValueError(
+                f"Unknown RAG_ENCODER_BACKEND {self.encoder_backend!r}, expected one of {ENCODER_BACKENDS}"
+            )
+        # Names the vectors this backend produces, for every embedding cache and
+        # store: vectors from different backends are close but not identical, and
+        # the int8 backends carry their quantization in the name. torch keeps the
+        # bare model name, so stores built before backends existed stay valid.
+        self.model_key = (
+            self.MODEL_NAME
+            if self.encoder_backend == "torch"
+            else f"{self.MODEL_NAME}:{self.encoder_backend}"
+        )
+        self.onnx_model_dir = os.getenv("RAG_ONNX_MODEL_DIR", "./data/onnx")
+        self.index_generation = IndexGeneration(self.INDEX_GENERATION_PATH)
+        self.index_backend = os.getenv("RAG_INDEX_BACKEND", "exact")
+        if self.index_backend not in self.INDEX_BACKENDS:
+            raise ValueError(
+                f"Unknown RAG_INDEX_BACKEND {self.index_backend!r}, expected one of {self.INDEX_BACKENDS}"
+            )
+        # Recall-vs-latency knob: number of IVF lists visited per query
+        self.ivf_nprobe = int(os.getenv("RAG_IVF_NPROBE", "8"))
+        self.ivf_lists = int(os.getenv("RAG_IVF_LISTS", "0")) or None
+        # Optional float16/int8 first pass with an exact float32 re-rank
+        self.embedding_quantization = os.getenv("RAG_EMBEDDING_QUANTIZATION") or None
+        if self.embedding_quantization not in (None, *QuantizedMatrix.MODES):
+            raise ValueError(
+                f"Unknown RAG_EMBEDDING_QUANTIZATION {self.embedding_quantization!r}, expected one of {QuantizedMatrix.MODES}"
+            )
+        self.rerank_factor = int(os.getenv("RAG_RERANK_FACTOR", "4"))
+        # Reciprocal rank fusion of the dense ranking with a BM25 ranking, which
+        # catches exact identifiers (CLI flags, env vars, errors); a BM25 weight of 0 disables it
+        self.fusion_dense_weight = float(os.getenv("RAG_FUSION_DENSE_WEIGHT", "1.0"))
+        self.fusion_bm25_weight = float(os.getenv("RAG_FUSION_BM25_WEIGHT", "1.0"))
+        self.fusion_k = int(os.getenv("RAG_FUSION_K", "60"))
+        # Documents taken from each ranking before fusing
+        self.fusion_depth = int(os.getenv("RAG_FUSION_DEPTH", "20"))
+        self.query_cache = QueryEmbeddingCache(
+            self.model_key,
+            maxsize=int(os.getenv("QUERY_CACHE_SIZE", "1024")),
+            ttl=int(os.getenv("QUERY_CACHE_TTL", str(24 * 60 * 60))),
+            redis_client=redis_client,
+        )
+        # Keep-alive connection pool to the LLM gateway (OPENAI_BASE_URL)
+        self.llm_client = LLMClient.from_env()
+        # Shared across workers through Redis; disabled without a Redis client
+        self.answer_cache = AnswerCache(
+            redis_client=redis_client,
+            threshold=float(os.getenv("ANSWER_CACHE_THRESHOLD", "0.9")),
+            ttl=int(os.getenv("ANSWER_CACHE_TTL", str(24 * 60 * 60))),
+        )
+        # Token budgets for the retrieved context in the prompt, overall and per document
+        self.context_max_tokens = int(os.getenv("CONTEXT_MAX_TOKENS", "2000"))
+        self.context_doc_max_tokens = int(os.getenv("CONTEXT_DOC_MAX_TOKENS", "600"))
+        # Compose files of up to RAG_MAX_SAMPLES samples matching the technologies in a question
+        self.max_samples = int(os.getenv("RAG_MAX_SAMPLES", "2"))
+        self.context_samples_max_tokens = int(
+            os.getenv("CONTEXT_SAMPLES_MAX_TOKENS", "600")
+        )
+        # Chat history per web session or Intercom conversation, shared by all workers via Redis
+        self.conversation_store = ConversationStore(
+            max_turns=int(os.getenv("CONVERSATION_MAX_TURNS", "10")),
+            max_tokens=int(os.getenv("CONVERSATION_MAX_TOKENS", "2000")),
+            ttl=int(os.getenv("CONVERSATION_TTL", str(60 * 60))),
+            redis_client=redis_client,
+        )
+        # Concurrent queries share one encode call instead of paying per-call overhead each
+        self.query_encoder = BatchingEncoder(
+            lambda texts: self.model.encode(texts),
+            max_batch_size=int(os.getenv("EMBED_BATCH_MAX_SIZE", "16")),
+            max_wait=float(os.getenv("EMBED_BATCH_MAX_WAIT_MS", "5")) / 1000,
+        )
 
         knowledge_base = self.load_knowledge_base()
-        self.model = SentenceTransformer("all-MiniLM-L6-v2")
+        if self.model_load == "eager":
+            self._load_model()
 
         # load existing embeddings if available
         logging.info("Embedding knowledge base...")
 
-        if os.path.exists(self.DOC_ABOUT_EMBEDDINGS_PATH) and os.path.exists(
-            self.DOC_EMBEDDINGS_PATH
-        ):
+        generation = self.index_generation.value
+        store = self._open_embedding_store()
+        if store is not None and self._store_matches(store, knowledge_base):
             with self._update_lock:
-                self.doc_about_embeddings = np.load(self.DOC_ABOUT_EMBEDDINGS_PATH)
+                ann_index = self._load_ann_index(store)
+                bm25_index = self._load_bm25_index(knowledge_base, store.kb_hash)
+                sample_index = self._load_sample_index()
+                self._swap_snapshot(
+                    self._new_snapshot(
+                        knowledge_base,
+                        store,
+                        generation,
+                        ann_index,
+                        bm25_index,
+                        sample_index,
+                    )
+                )
+            logging.info(
+                f"Cache loaded - mapped {len(knowledge_base)} embeddings from {self.EMBEDDINGS_INDEX_PATH}, generation: {generation}"
+            )
+        else:
+            self.rebuild_embeddings(knowledge_base)
+
+        logging.info("Knowledge base embeddings created")
+        if self.model_load == "background":
+            threading.Thread(
+                target=self._load_model, name="model-loader", daemon=True
+            ).start()
+        self.startup_seconds = time.monotonic() - started
+        logging.info(
+            f"RAG system ready in {self.startup_seconds:.2f}s (model load: {self.model_load}, model loaded: {self._model is not None})"
+        )
+
+    @property
+    def model(self):
+        if self._model is None:
+            return self._load_model()
+        return self._model
+
+    def _load_model(self):
+        with self._model_lock:
+            if self._model is None:
+                start_time = time.monotonic()
+                self._model = create_encoder(
+                    self.encoder_backend, self.MODEL_NAME, self.onnx_model_dir
+                )
                 logging.info(
-                    "Loaded existing about document about embeddings from disk."
+                    f"Loaded embedding model {self.MODEL_NAME} ({self.encoder_backend}) in {time.monotonic() - start_time:.2f}s"
                 )
-                self.doc_embeddings = np.load(self.DOC_EMBEDDINGS_PATH)
-                logging.info("Loaded existing document embeddings from disk.")
-                self.knowledge_base = knowledge_base
+            return self._model
+
+    def _store_matches(self, store, knowledge_base):
+        """Whether a store on disk, e.g. one built into the image, can be served as is."""
+        if store.kb_hash != knowledge_base_hash(knowledge_base):
+            return False
+        if store.meta.get("model") != self.model_key:
+            logging.info(
+                "Embedding store was built with another model or encoder backend, rebuilding..."
+            )
+            return False
+        if self.embedding_quantization and (
+            f"doc_matrix_{self.embedding_quantization}" not in store
+        ):
+            logging.info("Embedding store has no quantized copy, rebuilding...")
+            return False
+        try:
+            store.verify()
+        except EmbeddingStoreError as e:
+            logging.warning(f"Ignoring embedding store: {e}")
+            return False
+        return True
+
+    def _open_embedding_store(self):
+        try:
+            store = EmbeddingStore(self.EMBEDDINGS_INDEX_PATH)
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError, EmbeddingStoreError) as e:
+            logging.warning(f"Ignoring unreadable embedding store: {e}")
+            return None
+        if "doc_matrix" not in store:
+            logging.info("Embedding store predates the stacked layout, rebuilding...")
+            return None
+        return store
+
+    def _load_ann_index(self, store, rebuild=False):
+        """The IVF index of store; built only when rebuild is set.
+
+        Workers never build it: without an up-to-date index on disk they scan
+        every document until the next rebuild writes one.
+        """
+        if self.index_backend == "exact":
+            return ExactIndex()
 
-                # Save file timestamps when loading cache
-                self.doc_embeddings_timestamp = os.path.getmtime(
-                    self.DOC_EMBEDDINGS_PATH
+        if not rebuild:
+            try:
+                ann_index = IVFIndex.load(self.ANN_INDEX_PATH, nprobe=self.ivf_nprobe)
+                if ann_index.kb_hash == store.kb_hash:
+                    return ann_index
+                logging.warning(
+                    "IVF index is out of date, scanning every document until the next rebuild"
                 )
-                self.doc_about_embeddings_timestamp = os.path.getmtime(
-                    self.DOC_ABOUT_EMBEDDINGS_PATH
+            except FileNotFoundError:
+                logging.warning(
+                    "No IVF index found, scanning every document until the next rebuild"
                 )
-                logging.info(
-                    f"Cache loaded - doc_embeddings timestamp: {self.doc_embeddings_timestamp}, doc_about_embeddings timestamp: {self.doc_about_embeddings_timestamp}"
+            except (OSError, ValueError, KeyError, EmbeddingStoreError) as e:
+                logging.warning(f"Ignoring unreadable IVF index: {e}")
+            return ExactIndex()
+
+        ann_index = IVFIndex.build(
+            np.split(store["doc_matrix"], 2),
+            n_lists=self.ivf_lists,
+            nprobe=self.ivf_nprobe,
+            kb_hash=store.kb_hash,
+        )
+        ann_index.save(self.ANN_INDEX_PATH)
+        return ann_index
+
+    def _load_bm25_index(self, knowledge_base, kb_hash, rebuild=False):
+        """The BM25 index of the knowledge base; built only when rebuild is set.
+
+        Workers never build it: without an up-to-date index on disk they
+        retrieve by embeddings alone until the next rebuild writes one.
+        """
+        if not self.fusion_bm25_weight:
+            return None
+
+        if not rebuild:
+            try:
+                bm25_index = BM25Index.load(self.BM25_INDEX_PATH)
+                if bm25_index.kb_hash == kb_hash:
+                    return bm25_index
+                logging.warning(
+                    "BM25 index is out of date, retrieving by embeddings only until the next rebuild"
                 )
-        else:
-            self.rebuild_embeddings(knowledge_base)
+            except FileNotFoundError:
+                logging.warning(
+                    "No BM25 index found, retrieving by embeddings only until the next rebuild"
+                )
+            except (OSError, ValueError, KeyError, EmbeddingStoreError) as e:
+                logging.warning(f"Ignoring unreadable BM25 index: {e}")
+            return None
 
-        logging.info("Knowledge base embeddings created")
-        self.conversation_history = []
+        bm25_index = BM25Index.build(knowledge_base, kb_hash=kb_hash)
+        bm25_index.save(self.BM25_INDEX_PATH)
+        return bm25_index
 
-    def _atomic_save_numpy(self, file_path, data):
-        with atomic_write(file_path, mode="wb", overwrite=True) as f:
-            np.save(f, data)
+    def _load_sample_index(self, rebuild=False):
+        """The sample index of samples_examples.json, built if out of date only when rebuild is set.
+
+        Building embeds every sample with the model, so workers only load it
+        and answer without samples until the next rebuild writes a fresh one.
+        """
+        if not self.max_samples:
+            return None
+        try:
+            samples = load_samples(self.SAMPLES_PATH)
+        except FileNotFoundError:
+            logging.info(
+                "No samples file found, answering without sample compose files"
+            )
+            return None
+        samples_hash = knowledge_base_hash(samples)
+
+        try:
+            sample_index = SampleIndex.load(self.SAMPLE_INDEX_PATH, samples)
+            if (
+                sample_index.samples_hash == samples_hash
+                and sample_index.model == self.model_key
+            ):
+                return sample_index
+            problem = "Sample index is out of date"
+        except FileNotFoundError:
+            problem = "No sample index found"
+        except (OSError, ValueError, KeyError, EmbeddingStoreError) as e:
+            problem = f"Ignoring unreadable sample index: {e}"
+        if not rebuild:
+            logging.warning(
+                f"{problem}, answering without sample compose files until the next rebuild"
+            )
+            return None
+        logging.info(f"{problem}, building...")
+
+        sample_index = SampleIndex.build(
+            samples, self.encode_texts, samples_hash=samples_hash, model=self.model_key
+        )
+        sample_index.save(self.SAMPLE_INDEX_PATH)
+        return sample_index
+
+    def _new_snapshot(
+        self,
+        knowledge_base,
+        store,
+        generation,
+        ann_index,
+        bm25_index=None,
+        sample_index=None,
+    ):
+        return IndexSnapshot(
+            knowledge_base,
+            store,
+            generation,
+            ann_index,
+            quantization=self.embedding_quantization,
+            rerank_factor=self.rerank_factor,
+            bm25_index=bm25_index,
+            sample_index=sample_index,
+        )
+
+    def _swap_snapshot(self, snapshot):
+        # A single attribute assignment, so readers see the old or the new index, never a mix
+        self._snapshot = snapshot
+        self._checked_generation = snapshot.generation
+
+    @property
+    def knowledge_base(self):
+        return self._snapshot.knowledge_base
+
+    @property
+    def scoring_engine(self):
+        return self._snapshot.scoring_engine
+
+    @property
+    def doc_embeddings(self):
+        return self._snapshot.scoring_engine.doc_embeddings
+
+    @property
+    def doc_about_embeddings(self):
+        return self._snapshot.scoring_engine.doc_about_embeddings
 
     def rebuild_embeddings(self, knowledge_base):
         logging.info("Rebuilding document embeddings...")
+        start_time = time.monotonic()
 
-        new_doc_embeddings = self.embed_knowledge_base(knowledge_base)
-        new_about_embeddings = self.embed_knowledge_base_about(knowledge_base)
+        # Only entries whose text changed since the last rebuild are re-encoded
+        cache = EmbeddingCache(self.EMBEDDING_CACHE_PATH, self.model_key)
+        new_doc_embeddings = self.embed_knowledge_base(knowledge_base, cache)
+        new_about_embeddings = self.embed_knowledge_base_about(knowledge_base, cache)
+        logging.info(
+            f"Embedding cache: {cache.hits} hits, {cache.misses} misses, encoded in {time.monotonic() - start_time:.2f}s"
+        )
 
         # Defensive check for size mismatches
         sizes = [
@@ -81,45 +461,104 @@ class RAGSystem:
             )
             return  # Abandon update
 
-        # Atomically update files, in-memory cache, and timestamps
+        # Atomically replace the store file, then tell the other workers and swap our own index
         with self._update_lock:
-            self._atomic_save_numpy(
-                self.DOC_EMBEDDINGS_PATH, new_doc_embeddings.cpu().numpy()
+            write_embedding_store(
+                self.EMBEDDINGS_INDEX_PATH,
+                quantized_arrays(
+                    "doc_matrix",
+                    stack_embeddings(new_doc_embeddings, new_about_embeddings),
+                ),
+                knowledge_base_hash(knowledge_base),
+                meta={"model": self.model_key},
             )
-            self._atomic_save_numpy(
-                self.DOC_ABOUT_EMBEDDINGS_PATH, new_about_embeddings.cpu().numpy()
+            store = EmbeddingStore(self.EMBEDDINGS_INDEX_PATH)
+            # The ANN index is persisted next to the embeddings before other workers are told
+            ann_index = self._load_ann_index(store, rebuild=True)
+            bm25_index = self._load_bm25_index(
+                knowledge_base, store.kb_hash, rebuild=True
             )
-            self.knowledge_base = knowledge_base
-            self.doc_embeddings = new_doc_embeddings
-            self.doc_about_embeddings = new_about_embeddings
-            self.doc_embeddings_timestamp = os.path.getmtime(self.DOC_EMBEDDINGS_PATH)
-            self.doc_about_embeddings_timestamp = os.path.getmtime(
-                self.DOC_ABOUT_EMBEDDINGS_PATH
+            # Re-embedded only if samples_examples.json changed
+            sample_index = self._load_sample_index(rebuild=True)
+            generation = self.index_generation.bump()
+            self._swap_snapshot(
+                self._new_snapshot(
+                    knowledge_base,
+                    store,
+                    generation,
+                    ann_index,
+                    bm25_index,
+                    sample_index,
+                )
             )
+        cache.save()
 
         logging.info("Embeddings rebuilt successfully.")
 
+    def build_indexes(self):
+        """Build the indexes that workers found missing or out of date, and publish them.
+
+        Workers only load indexes; this fills them in from the current store
+        without re-embedding the knowledge base.
+        """
+        with self._update_lock:
+            snapshot = self._snapshot
+            ann_index = snapshot.ann_index
+            if self.index_backend != "exact" and isinstance(ann_index, ExactIndex):
+                ann_index = self._load_ann_index(snapshot.store, rebuild=True)
+            bm25_index = snapshot.bm25_index or self._load_bm25_index(
+                snapshot.knowledge_base, snapshot.store.kb_hash, rebuild=True
+            )
+            sample_index = snapshot.sample_index or self._load_sample_index(
+                rebuild=True
+            )
+            if (
+                ann_index is snapshot.ann_index
+                and bm25_index is snapshot.bm25_index
+                and sample_index is snapshot.sample_index
+            ):
+                return
+            generation = self.index_generation.bump()
+            self._swap_snapshot(
+                self._new_snapshot(
+                    snapshot.knowledge_base,
+                    snapshot.store,
+                    generation,
+                    ann_index,
+                    bm25_index,
+                    sample_index,
+                )
+            )
+
     def load_knowledge_base(self):
         with open(self.knowledge_base_path, "r") as kb_file:
             return json.load(kb_file)
 
-    def embed_knowledge_base(self, knowledge_base):
+    def embed_knowledge_base(self, knowledge_base, cache=None):
         docs = [f"{doc['about']}. {doc['text']}" for doc in knowledge_base]
-        return self.model.encode(docs, convert_to_tensor=True)
+        return self.encode_texts(docs, cache)
 
-    def embed_knowledge_base_about(self, knowledge_base):
-        return self.model.encode(
-            [doc["about"] for doc in knowledge_base], convert_to_tensor=True
-        )
+    def embed_knowledge_base_about(self, knowledge_base, cache=None):
+        return self.encode_texts([doc["about"] for doc in knowledge_base], cache)
+
+    def encode_texts(self, texts, cache=None):
+        if cache is None:
+            return to_numpy(self.model.encode(texts))
+        return cache.embed(texts, self.model.encode)
 
     def normalize_query(self, query):
-        return query.lower().strip()
+        # Collapse inner whitespace too, so trivially different repeats share a cache entry
+        return " ".join(query.lower().split())
 
     def get_query_embedding(self, query):
         normalized_query = self.normalize_query(query)
-        query_embedding = self.model.encode([normalized_query], convert_to_tensor=True)
-        query_embedding = query_embedding.cpu()
-        return query_embedding
+        cached_embedding = self.query_cache.get(normalized_query)
+        if cached_embedding is not None:
+            return cached_embedding.reshape(1, -1)
+
+        query_embedding = self.query_encoder.encode(normalized_query)
+        self.query_cache.put(normalized_query, query_embedding)
+        return query_embedding.reshape(1, -1)
 
     def get_doc_embeddings(self):
         return self.doc_embeddings
@@ -134,111 +573,186 @@ class RAGSystem:
         doc_about_embeddings,
         high_match_threshold,
     ):
-        text_similarities = cosine_similarity(query_embedding, doc_embeddings)[0]
-        about_similarities = cosine_similarity(query_embedding, doc_about_embeddings)[0]
+        """Score every document; retrieve() uses the top-k fast path instead."""
+        query = normalize_rows(query_embedding)[0]
+        text_similarities = normalize_rows(doc_embeddings) @ query
+        about_similarities = normalize_rows(doc_about_embeddings) @ query
         relevance_scores = self.compute_relevance_scores(
             text_similarities, about_similarities, high_match_threshold
         )
 
-        result = [
-            {
-                "index": i,
-                "about": doc["about"],
-                "text": doc["text"],
-                "path": doc["path"],
-                "text_similarity": text_similarities[i],
-                "about_similarity": about_similarities[i],
-                "relevance_score": relevance_scores[i],
-            }
-            for i, doc in enumerate(self.knowledge_base)
+        knowledge_base = self.knowledge_base
+        return [
+            self._build_doc_result(
+                knowledge_base,
+                i,
+                text_similarities[i],
+                about_similarities[i],
+                relevance_scores[i],
+            )
+            for i in range(len(knowledge_base))
         ]
 
-        return result
+    def _build_doc_result(
+        self, knowledge_base, index, text_similarity, about_similarity, relevance_score
+    ):
+        doc = knowledge_base[index]
+        return {
+            "index": int(index),
+            "about": doc["about"],
+            "text": doc["text"],
+            "path": doc["path"],
+            "text_similarity": float(text_similarity),
+            "about_similarity": float(about_similarity),
+            "relevance_score": float(relevance_score),
+        }
 
     def cache_check(func):
-        """Decorator to automatically check cache consistency"""
+        """Decorator to pick up an index swapped in by another worker.
 
-        def wrapper(self, *args, **kwargs):
-            try:
-                current_times = [
-                    os.path.getmtime(self.DOC_EMBEDDINGS_PATH),
-                    os.path.getmtime(self.DOC_ABOUT_EMBEDDINGS_PATH),
-                ]
-                stored_times = [
-                    self.doc_embeddings_timestamp,
-                    self.doc_about_embeddings_timestamp,
-                ]
-
-                # update cache if timestamps are different from out last load
-                if current_times != stored_times:
-                    self._reload_cache()
-
-            except (OSError, FileNotFoundError, PermissionError):
-                logging.warning("Cache files inaccessible, rebuilding...")
-                self.rebuild_embeddings()
+        Compares the shared index generation with the one last loaded; this is
+        a memory read, so the hot path does no filesystem I/O.
+        """
 
+        def wrapper(self, *args, **kwargs):
+            if self.index_generation.value != self._checked_generation:
+                self._reload_cache()
             return func(self, *args, **kwargs)
 
         return wrapper
 
     def _reload_cache(self):
-        self.doc_embeddings = np.load(self.DOC_EMBEDDINGS_PATH)
-        self.doc_about_embeddings = np.load(self.DOC_ABOUT_EMBEDDINGS_PATH)
+        with self._update_lock:
+            generation = self.index_generation.value
+            if generation == self._checked_generation:
+                return  # another thread already reloaded
+            # Don't retry this generation on every request if it can't be loaded
+            self._checked_generation = generation
 
-        # update our timestamps of the cached files
-        self.doc_embeddings_timestamp = os.path.getmtime(self.DOC_EMBEDDINGS_PATH)
-        self.doc_about_embeddings_timestamp = os.path.getmtime(
-            self.DOC_ABOUT_EMBEDDINGS_PATH
-        )
+            try:
+                # Remapping the store is O(1); pages are faulted in lazily on first use
+                store = EmbeddingStore(self.EMBEDDINGS_INDEX_PATH)
+                knowledge_base = self._snapshot.knowledge_base
+                if store.kb_hash != knowledge_base_hash(knowledge_base):
+                    # The embeddings were rebuilt for an updated knowledge base
+                    knowledge_base = self.load_knowledge_base()
+                ann_index = self._load_ann_index(store)
+                bm25_index = self._load_bm25_index(knowledge_base, store.kb_hash)
+                sample_index = self._load_sample_index()
+                if store.kb_hash != knowledge_base_hash(knowledge_base):
+                    logging.warning(
+                        "Embedding store does not match the knowledge base on disk; keeping current index"
+                    )
+                    return
+                snapshot = self._new_snapshot(
+                    knowledge_base,
+                    store,
+                    generation,
+                    ann_index,
+                    bm25_index,
+                    sample_index,
+                )
+            except (OSError, ValueError, KeyError, EmbeddingStoreError) as e:
+                logging.warning(
+                    f"Failed to reload index generation {generation}, keeping current index: {e}"
+                )
+                return
+            self._swap_snapshot(snapshot)
+        logging.info(f"Reloaded index generation {generation}")
 
     @cache_check
     def retrieve(
         self, query, similarity_threshold=0.4, high_match_threshold=0.8, max_docs=5
     ):
         query_embedding = self.get_query_embedding(query)
-        doc_embeddings = self.get_doc_embeddings()
-        doc_about_embeddings = self.get_doc_about_embeddings()
+        snapshot = self._snapshot
 
-        doc_scores = self.compute_document_scores(
-            query_embedding, doc_embeddings, doc_about_embeddings, high_match_threshold
+        hybrid = snapshot.bm25_index is not None and self.fusion_bm25_weight
+        # None from the exact backend means every document is a candidate
+        candidates = snapshot.ann_index.candidates(normalize_rows(query_embedding)[0])
+        top_docs = snapshot.scoring_engine.search(
+            query_embedding,
+            similarity_threshold,
+            high_match_threshold,
+            max(max_docs, self.fusion_depth) if hybrid else max_docs,
+            candidates,
         )
-        retrieved_docs = self.get_top_docs(doc_scores, similarity_threshold, max_docs)
+        if hybrid:
+            top_docs = [
+                column[:max_docs]
+                for column in self._fuse(
+                    snapshot,
+                    query,
+                    query_embedding,
+                    top_docs[0],
+                    similarity_threshold,
+                    high_match_threshold,
+                )
+            ]
+        # Only the returned documents are materialized as dicts
+        retrieved_docs = [
+            self._build_doc_result(snapshot.knowledge_base, *scores)
+            for scores in zip(*top_docs)
+        ]
 
         if not retrieved_docs:
             retrieved_docs = self.get_fallback_doc()
         return retrieved_docs
 
-    def compute_relevance_scores(
-        self, text_similarities, about_similarities, high_match_threshold
+    def _fuse(
+        self,
+        snapshot,
+        query,
+        query_embedding,
+        dense_ids,
+        similarity_threshold,
+        high_match_threshold,
     ):
-        relevance_scores = []
+        """Rerank the dense results together with the BM25 results of the query.
 
-        for i, _ in enumerate(self.knowledge_base):
-            about_similarity = about_similarities[i]
-            text_similarity = text_similarities[i]
-            # If either about or text similarity is above the high match threshold, prioritize it
-            if (
-                about_similarity >= high_match_threshold
-                or text_similarity >= high_match_threshold
-            ):
-                combined_score = max(about_similarity, text_similarity)
-            else:
-                combined_score = (0.3 * about_similarity) + (0.7 * text_similarity)
-            relevance_scores.append(combined_score)
+        Returns the same (indices, text, about, relevance) columns as
+        ScoringEngine.search, in fused order. BM25 only adds candidates: a
+        lexical match below similarity_threshold is dropped like a dense one.
+        """
+        lexical_ids, _ = snapshot.bm25_index.search(query, self.fusion_depth)
+        fused_ids, _ = reciprocal_rank_fusion(
+            [dense_ids, lexical_ids],
+            [self.fusion_dense_weight, self.fusion_bm25_weight],
+            k=self.fusion_k,
+        )
+        # Lexical-only matches were not dense-scored yet
+        text_similarities, about_similarities = snapshot.scoring_engine.similarities(
+            query_embedding, fused_ids
+        )
+        relevance_scores = self.compute_relevance_scores(
+            text_similarities, about_similarities, high_match_threshold
+        )
+        relevant = np.asarray(relevance_scores) >= similarity_threshold
+        return (
+            fused_ids[relevant],
+            np.asarray(text_similarities)[relevant],
+            np.asarray(about_similarities)[relevant],
+            np.asarray(relevance_scores)[relevant],
+        )
 
-        return relevance_scores
+    def compute_relevance_scores(
+        self, text_similarities, about_similarities, high_match_threshold
+    ):
+        return ScoringEngine.relevance_scores(
+            text_similarities, about_similarities, high_match_threshold
+        )
 
     def get_top_docs(self, doc_scores, similarity_threshold, max_docs):
-        sorted_docs = sorted(
-            doc_scores, key=lambda x: x["relevance_score"], reverse=True
+        relevance_scores = np.fromiter(
+            (score["relevance_score"] for score in doc_scores),
+            dtype=np.float64,
+            count=len(doc_scores),
         )
-        # Filter and keep up to max_docs with relevance scores above the similarity threshold
-        top_docs = [
-            score
-            for score in sorted_docs[:max_docs]
-            if score["relevance_score"] >= similarity_threshold
-        ]
-        return top_docs
+        # Keep up to max_docs with relevance scores above the similarity threshold
+        top_indices = ScoringEngine.top_k(
+            relevance_scores, similarity_threshold, max_docs
+        )
+        return [doc_scores[i] for i in top_indices]
 
     def get_fallback_doc(self):
         return [
@@ -252,13 +766,35 @@ class RAGSystem:
             }
         ]
 
-    def answer_query_stream(self, query):
+    def prepare_answer(self, query, conversation_id=None):
+        """Retrieval and prompt assembly shared by the sync and async answer streams."""
         normalized_query = self.normalize_query(query)
         retrieved_docs = self.retrieve(normalized_query)
-        context = self.get_context(retrieved_docs)
-        citations = self.get_citations(retrieved_docs)
+        samples = self.find_samples(normalized_query)
+        context = self.get_context(retrieved_docs, normalized_query, samples)
+        history = self.conversation_store.history(conversation_id)
+        answer = PreparedAnswer(
+            query,
+            conversation_id,
+            normalized_query,
+            self.get_citations(retrieved_docs, samples),
+        )
+
+        # A near-duplicate of an earlier first question, answered from the same
+        # documents, gets the earlier answer without an LLM call
+        answer.cache_key = (
+            None if history else self._answer_cache_key(retrieved_docs, samples)
+        )
+        if answer.cache_key is not None:
+            answer.query_embedding = self.get_query_embedding(normalized_query)
+            answer.cached_answer = self.answer_cache.get(
+                *answer.cache_key, answer.query_embedding
+            )
+            if answer.cached_answer is not None:
+                logging.debug(f"Answer cache hit: {normalized_query}")
+                return answer
 
-        messages = [
+        answer.messages = [
             {
                 "role": "system",
                 "content": (
@@ -273,30 +809,66 @@ class RAGSystem:
             }
         ]
 
-        self.conversation_history.append({"role": "user", "content": query})
-        messages.extend(self.conversation_history)
+        answer.messages.extend(history)
+        answer.messages.append({"role": "user", "content": query})
+        return answer
+
+    def completion_args(self, messages):
+        return {
+            "model": os.getenv("MODEL"),
+            "messages": messages,
+            "temperature": 0.25,
+            "max_tokens": 2048,
+            "top_p": 1,
+            "frequency_penalty": 0,
+            "presence_penalty": 0,
+        }
+
+    def record_answer(self, answer, response, finish_reason="stop"):
+        self.conversation_store.append(
+            answer.conversation_id,
+            {"role": "user", "content": answer.query},
+            {"role": "assistant", "content": response},
+        )
+        # Only complete, freshly generated answers are reused
+        if (
+            answer.cache_key is not None
+            and answer.cached_answer is None
+            and finish_reason == "stop"
+            and response
+        ):
+            self.answer_cache.put(
+                *answer.cache_key,
+                answer.normalized_query,
+                answer.query_embedding,
+                response,
+            )
+
+    def answer_query_stream(self, query, conversation_id=None):
+        answer = self.prepare_answer(query, conversation_id)
+        if answer.cached_answer is not None:
+            yield answer.cached_answer
+            if len(answer.citations) > 0:
+                yield answer.references()
+            self.record_answer(answer, answer.cached_answer)
+            return
 
         try:
-            logging.debug(f"Sending query to LLM: {normalized_query}")
-            stream = openai.ChatCompletion.create(
-                model=os.getenv("MODEL"),
-                messages=messages,
-                temperature=0.25,
-                max_tokens=2048,
-                top_p=1,
-                frequency_penalty=0,
-                presence_penalty=0,
-                stream=True,
+            logging.debug(f"Sending query to LLM: {answer.normalized_query}")
+            stream = self.llm_client.stream_chat(
+                **self.completion_args(answer.messages)
             )
 
             collected_messages = []
+            finish_reason = None
             for chunk in stream:
                 try:
                     logging.debug(f"Received chunk: {chunk}")
-                    content = chunk["choices"][0]["delta"].get("content", "")
+                    content = chunk["choices"][0]["delta"].get("content") or ""
                     collected_messages.append(content)
                     yield content
-                    if chunk["choices"][0].get("finish_reason") is not None:
+                    finish_reason = chunk["choices"][0].get("finish_reason")
+                    if finish_reason is not None:
                         break
                 except (BrokenPipeError, OSError) as e:
                     # Client disconnected, stop streaming
@@ -304,11 +876,11 @@ class RAGSystem:
                     traceback.print_exc(file=sys.stderr)
                     break
 
-            logging.debug(f"Finished receiving response: {normalized_query}")
+            logging.debug(f"Finished receiving response: {answer.normalized_query}")
 
-            if len(citations) > 0:
+            if len(answer.citations) > 0:
                 try:
-                    yield "\n\nReferences:\n" + "\n".join(citations)
+                    yield answer.references()
                 except (BrokenPipeError, OSError) as e:
                     # Client disconnected, stop streaming
                     logging.warning(
@@ -317,9 +889,7 @@ class RAGSystem:
                     traceback.print_exc(file=sys.stderr)
 
             full_response = "".join(collected_messages).strip()
-            self.conversation_history.append(
-                {"role": "assistant", "content": full_response}
-            )
+            self.record_answer(answer, full_response, finish_reason)
 
         except Exception as e:
             print(f"Error in answer_query_stream: {e}", file=sys.stderr)
@@ -332,8 +902,72 @@ class RAGSystem:
                     "Client disconnected before error message could be sent"
                 )
 
-    def clear_conversation_history(self):
-        self.conversation_history = []
+    async def answer_query_stream_async(self, query, conversation_id=None):
+        """answer_query_stream for the async server.
+
+        Retrieval and the Redis bookkeeping run in the event loop's default
+        executor, and the LLM response is streamed with the async LLM client,
+        so the event loop is never blocked for the length of a generation.
+        """
+        loop = asyncio.get_running_loop()
+        answer = await loop.run_in_executor(
+            None, self.prepare_answer, query, conversation_id
+        )
+        if answer.cached_answer is not None:
+            yield answer.cached_answer
+            if len(answer.citations) > 0:
+                yield answer.references()
+            await loop.run_in_executor(
+                None, self.record_answer, answer, answer.cached_answer
+            )
+            return
+
+        try:
+            logging.debug(f"Sending query to LLM: {answer.normalized_query}")
+            stream = self.llm_client.astream_chat(
+                **self.completion_args(answer.messages)
+            )
+
+            collected_messages = []
+            finish_reason = None
+            async for chunk in stream:
+                logging.debug(f"Received chunk: {chunk}")
+                content = chunk["choices"][0]["delta"].get("content") or ""
+                collected_messages.append(content)
+                yield content
+                finish_reason = chunk["choices"][0].get("finish_reason")
+                if finish_reason is not None:
+                    break
+
+            logging.debug(f"Finished receiving response: {answer.normalized_query}")
+
+            if len(answer.citations) > 0:
+                yield answer.references()
+
+            full_response = "".join(collected_messages).strip()
+            await loop.run_in_executor(
+                None, self.record_answer, answer, full_response, finish_reason
+            )
+
+        except Exception as e:
+            print(f"Error in answer_query_stream_async: {e}", file=sys.stderr)
+            traceback.print_exc(file=sys.stderr)
+            yield "An error occurred while generating the response."
+
+    def _answer_cache_key(self, retrieved_docs, samples=()):
+        if not self.answer_cache.enabled:
+            return None
+        doc_ids = [doc.get("index") for doc in retrieved_docs]
+        if None in doc_ids:
+            return None  # the fallback doc is not worth caching an answer for
+        # Answers depend on the knowledge base and on the LLM that wrote them
+        namespace = f"{self._snapshot.store.kb_hash}:{os.getenv('MODEL')}"
+        if samples:
+            namespace += ":" + ",".join(sample["projectName"] for sample in samples)
+        return namespace, doc_ids
+
+    def clear_conversation_history(self, conversation_id):
+        self.conversation_store.clear(conversation_id)
         print("Conversation history cleared.")
 
     def rebuild(self):
@@ -345,20 +979,61 @@ class RAGSystem:
         self.rebuild_embeddings(knowledge_base)  # Rebuild the embeddings
         print("Embeddings have been rebuilt.")
 
-    def get_citations(self, retrieved_docs):
+    def get_stats(self):
+        return {
+            "startup_seconds": self.startup_seconds,
+            "model_loaded": self._model is not None,
+            "encoder_backend": self.encoder_backend,
+            "index_generation": self._snapshot.generation,
+            "knowledge_base_size": len(self._snapshot.knowledge_base),
+            "ann_index": self._snapshot.ann_index.stats(),
+            "bm25_index": self._snapshot.bm25_index.stats()
+            if self._snapshot.bm25_index is not None
+            else None,
+            "sample_index": self._snapshot.sample_index.stats()
+            if self._snapshot.sample_index is not None
+            else None,
+            "embedding_quantization": self.embedding_quantization,
+            "query_embedding_cache": self.query_cache.stats(),
+            "query_encoder": self.query_encoder.stats(),
+            "conversations": self.conversation_store.stats(),
+            "answer_cache": self.answer_cache.stats(),
+            "llm_client": self.llm_client.stats(),
+        }
+
+    def find_samples(self, query):
+        """Samples using the technologies named in query, best first."""
+        sample_index = self._snapshot.sample_index
+        if sample_index is None:
+            return []
+        return sample_index.search(
+            query, self.get_query_embedding(query), k=self.max_samples
+        )
+
+    def get_citations(self, retrieved_docs, samples=()):
         citations = []
         for doc in retrieved_docs:
             if "path" not in doc:
                 continue
             citation = f" * [{doc['about']}](https://docs.defang.io{doc['path']})"
-            citations.append(citation)
+            # Passages of the same section cite it once
+            if citation not in citations:
+                citations.append(citation)
+        for sample in samples:
+            name = sample["projectName"]
+            citations.append(f" * [Sample {name}]({SAMPLES_URL}{name})")
         return citations
 
-    def get_context(self, retrieved_docs):
-        retrieved_text = []
-        for doc in retrieved_docs:
-            retrieved_text.append(f"{doc['about']}. {doc['text']}")
-        return "\n\n".join(retrieved_text)
+    def get_context(self, retrieved_docs, query=None, samples=()):
+        context = build_context(
+            retrieved_docs,
+            query,
+            max_tokens=self.context_max_tokens,
+            doc_max_tokens=self.context_doc_max_tokens,
+        )
+        if samples:
+            context += "\n\n" + format_samples(samples, self.context_samples_max_tokens)
+        return context
 
 
 if __name__ == "__main__":
@@ -367,4 +1042,8 @@ if __name__ == "__main__":
         format="%(asctime)s %(levelname)s %(message)s",
         datefmt="%Y-%m-%d %H:%M:%S",
     )
-    RAGSystem()
+    # Run at image build time: downloads the model and writes the checksummed
+    # embedding store and the search indexes that workers then load at startup
+    rag_system = RAGSystem()
+    rag_system.model
+    rag_system.build_indexes()
@@ -0,0 +1,196 @@
+import json
+import logging
+import re
+import time
+from functools import reduce
+from operator import and_, or_
+
+import numpy as np
+
+from embedding_store import EmbeddingStore, write_embedding_store
+from scoring import normalize_rows, stack_embeddings
+from utils import estimate_tokens
+
+logger = logging.getLogger(__name__)
+
+SAMPLES_URL = "https://github.com/DefangLabs/samples/tree/main/samples/"
+
+# Technology facets and the words that name them in questions and sample names.
+# A bare "go" is left out: in a question it is almost always the verb.
+TECHNOLOGY_ALIASES = {
+    "Python": ("python",),
+    "Node.js": ("node", "node.js", "nodejs"),
+    "Go": ("golang",),
+    "PHP": ("php",),
+    "Ruby": ("ruby",),
+    "Rust": ("rust",),
+    "Java": ("java",),
+    "Flask": ("flask",),
+    "Django": ("django",),
+    "FastAPI": ("fastapi",),
+    "Rails": ("rails",),
+    "Laravel": ("laravel",),
+    "Spring": ("spring",),
+    "React": ("react",),
+    "Vue": ("vue", "vuejs"),
+    "Angular": ("angular",),
+    "Svelte": ("svelte", "sveltekit"),
+    "Express.js": ("express", "express.js", "expressjs"),
+    "Next.js": ("next.js", "nextjs"),
+    "PostgreSQL": ("postgres", "postgresql"),
+    "MySQL": ("mysql",),
+    "Redis": ("redis",),
+    "MongoDB": ("mongo", "mongodb"),
+}
+ALIAS_TECHNOLOGIES = {
+    alias: technology
+    for technology, aliases in TECHNOLOGY_ALIASES.items()
+    for alias in aliases
+}
+WORD = re.compile(r"[a-z0-9]+(?:\.js)?")
+
+
+def technologies_in(text):
+    """The technology facets named in text."""
+    return {
+        ALIAS_TECHNOLOGIES[word]
+        for word in WORD.findall(text.lower())
+        if word in ALIAS_TECHNOLOGIES
+    }
+
+
+def sample_technologies(sample):
+    """A sample's facets: those detected from its files, plus those in its name."""
+    return set(sample.get("technologies", [])) | technologies_in(sample["projectName"])
+
+
+def load_samples(path):
+    with open(path, "r") as samples_file:
+        return json.load(samples_file)
+
+
+class SampleIndex:
+    """Faceted index over the Defang samples in samples_examples.json.
+
+    Each technology maps to a bitmap of the samples using it (bit i for sample
+    i), so the samples matching every technology named in a question are one
+    AND of small integers. Only those candidates are ranked, by the cosine
+    similarity of the question to their description or compose file, whichever
+    is closer. When no sample has all the technologies, candidates matching
+    more of them rank first.
+    """
+
+    name = "samples"
+
+    def __init__(self, samples, embeddings, samples_hash=None, model=None):
+        self.samples = samples
+        # Rows [0, N) embed the descriptions and rows [N, 2N) the compose files
+        self.embeddings = embeddings
+        self.samples_hash = samples_hash
+        self.model = model
+        self.bitmaps = {}
+        for i, sample in enumerate(samples):
+            for technology in sample_technologies(sample):
+                self.bitmaps[technology] = self.bitmaps.get(technology, 0) | 1 << i
+
+    @staticmethod
+    def texts(samples):
+        descriptions = [
+            f"{sample['projectName']}: {sample['description']}" for sample in samples
+        ]
+        # Samples without a compose file are described by their Dockerfile
+        files = [sample["compose"] or sample["dockerfile"] for sample in samples]
+        return descriptions, files
+
+    @classmethod
+    def build(cls, samples, encode, samples_hash=None, model=None):
+        """Index samples, embedding their texts with encode(list_of_texts)."""
+        start_time = time.monotonic()
+        descriptions, files = cls.texts(samples)
+        embeddings = stack_embeddings(encode(descriptions), encode(files))
+        index = cls(samples, embeddings, samples_hash=samples_hash, model=model)
+        logger.info(
+            f"Built sample index of {len(samples)} samples and {len(index.bitmaps)} technologies in {time.monotonic() - start_time:.2f}s"
+        )
+        return index
+
+    def save(self, path):
+        write_embedding_store(
+            path,
+            {"sample_matrix": self.embeddings},
+            self.samples_hash,
+            meta={"type": self.name, "model": self.model},
+        )
+
+    @classmethod
+    def load(cls, path, samples):
+        store = EmbeddingStore(path)
+        return cls(
+            samples,
+            store["sample_matrix"],
+            samples_hash=store.kb_hash,
+            model=store.meta.get("model"),
+        )
+
+    def candidates(self, query):
+        """(sample ids, number of the query's technologies each one has)."""
+        bitmaps = [self.bitmaps.get(t, 0) for t in technologies_in(query)]
+        if not bitmaps:
+            return np.empty(0, dtype=np.intp), np.empty(0, dtype=np.intp)
+        matches = reduce(and_, bitmaps) or reduce(or_, bitmaps)
+        ids = np.array(
+            [i for i, bit in enumerate(reversed(bin(matches)[2:])) if bit == "1"],
+            dtype=np.intp,
+        )
+        counts = np.array(
+            [sum(bitmap >> i & 1 for bitmap in bitmaps) for i in ids], dtype=np.intp
+        )
+        return ids, counts
+
+    def search(self, query, query_embedding, k=2):
+        """The k samples best matching the technologies and meaning of query."""
+        ids, counts = self.candidates(query)
+        if not len(ids):
+            return []
+        query_embedding = normalize_rows(query_embedding)[0]
+        n = len(self.samples)
+        similarities = np.maximum(
+            self.embeddings[ids] @ query_embedding,
+            self.embeddings[n + ids] @ query_embedding,
+        )
+        order = np.lexsort((-similarities, -counts))[:k]
+        return [
+            {**self.samples[ids[i]], "score": float(similarities[i])} for i in order
+        ]
+
+    def stats(self):
+        return {"samples": len(self.samples), "technologies": len(self.bitmaps)}
+
+
+def format_samples(samples, max_tokens):
+    """Context section with the compose files of samples, within max_tokens."""
+    sections = []
+    remaining = max_tokens
+    for sample in samples:
+        name = sample["projectName"]
+        header = f"Sample {name} ({SAMPLES_URL}{name}): {sample['description']}"
+        if sample["compose"]:
+            header += " Its compose.yaml:"
+        used = estimate_tokens(header) + 10  # the code fence and separators
+        if used > remaining:
+            break
+        # Whole lines only, so the YAML stays readable when it is cut short
+        lines = []
+        for line in sample["compose"].splitlines():
+            line_tokens = estimate_tokens(line + "\n")
+            if used + line_tokens > remaining:
+                lines.append("# ...")
+                break
+            lines.append(line)
+            used += line_tokens
+        section = header
+        if lines:
+            section += "\n```yaml\n" + "\n".join(lines) + "\n```"
+        sections.append(section)
+        remaining -= used
+    return "\n\n".join(sections)
@@ -0,0 +1,251 @@
+import numpy as np
+
+
+def to_numpy(embeddings):
+    """Convert a torch tensor or array-like of embeddings to a float32 NumPy array."""
+    if hasattr(embeddings, "cpu"):
+        embeddings = embeddings.cpu().numpy()
+    return np.asarray(embeddings, dtype=np.float32)
+
+
+def normalize_rows(matrix):
+    """L2-normalize each row so that a dot product equals cosine similarity."""
+    matrix = to_numpy(matrix)
+    if matrix.ndim == 1:
+        matrix = matrix.reshape(1, -1)
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0  # leave all-zero rows as they are
+    return matrix / norms
+
+
+class QuantizedMatrix:
+    """Compact copy of a normalized embedding matrix for approximate scoring.
+
+    "float16" halves the size; "int8" stores each row as int8 codes with a
+    per-row float32 scale, a quarter of the size. The copies are written into
+    the embedding store next to the float32 matrix (see quantized_arrays), so
+    every worker maps the same pages instead of building its own.
+
+    matvec widens CHUNK_ROWS rows at a time into a float32 block that stays in
+    cache, so the product reads only the compact codes from memory. int8 rows
+    are scaled after the product, once per row.
+    """
+
+    MODES = ("float16", "int8")
+    CHUNK_ROWS = 256
+
+    def __init__(self, mode, codes, scales=None):
+        if mode not in self.MODES:
+            raise ValueError(
+                f"Unknown quantization {mode!r}, expected one of {self.MODES}"
+            )
+        self.mode = mode
+        self.codes = codes
+        self.scales = scales
+
+    @classmethod
+    def quantize(cls, matrix, mode):
+        if mode == "int8":
+            max_abs = np.abs(matrix).max(axis=1)
+            scales = np.where(max_abs > 0, max_abs / 127, 1.0).astype(np.float32)
+            codes = np.round(matrix / scales[:, None]).astype(np.int8)
+            return cls(mode, codes, scales)
+        return cls(mode, matrix.astype(np.float16))
+
+    @classmethod
+    def from_store(cls, store, name, mode):
+        """The copy of array name for mode in an embedding store; KeyError if it has none."""
+        scales = store[f"{name}_{mode}_scales"] if mode == "int8" else None
+        return cls(mode, store[f"{name}_{mode}"], scales)
+
+    @property
+    def nbytes(self):
+        return self.codes.nbytes + (
+            self.scales.nbytes if self.scales is not None else 0
+        )
+
+    def matvec(self, query, rows=None):
+        query = np.asarray(query, dtype=np.float32)
+        codes = self.codes if rows is None else self.codes[rows]
+        result = np.empty(len(codes), dtype=np.float32)
+        block = np.empty((self.CHUNK_ROWS, codes.shape[1]), dtype=np.float32)
+        for start in range(0, len(codes), self.CHUNK_ROWS):
+            chunk = codes[start : start + self.CHUNK_ROWS]
+            widened = block[: len(chunk)]
+            np.copyto(widened, chunk)
+            np.dot(widened, query, out=result[start : start + len(chunk)])
+        if self.scales is not None:
+            result *= self.scales if rows is None else self.scales[rows]
+        return result
+
+
+def quantized_arrays(name, matrix):
+    """Embedding store arrays: matrix under name, then its copy in every mode."""
+    arrays = {name: matrix}
+    for mode in QuantizedMatrix.MODES:
+        quantized = QuantizedMatrix.quantize(matrix, mode)
+        arrays[f"{name}_{mode}"] = quantized.codes
+        if quantized.scales is not None:
+            arrays[f"{name}_{mode}_scales"] = quantized.scales
+    return arrays
+
+
+def stack_embeddings(doc_embeddings, doc_about_embeddings):
+    """L2-normalize both matrices and stack them into one contiguous (2N, d) array.
+
+    Rows [0, N) hold the text embeddings and rows [N, 2N) the about embeddings.
+    """
+    doc_embeddings = normalize_rows(doc_embeddings)
+    doc_about_embeddings = normalize_rows(doc_about_embeddings)
+    if doc_embeddings.shape != doc_about_embeddings.shape:
+        raise ValueError(
+            f"Embedding matrix shape mismatch: doc_embeddings={doc_embeddings.shape}, doc_about_embeddings={doc_about_embeddings.shape}"
+        )
+    return np.concatenate([doc_embeddings, doc_about_embeddings])
+
+
+class ScoringEngine:
+    """Scores every document against a query with NumPy array operations.
+
+    The engine works on the stacked, L2-normalized (2N, d) matrix built by
+    stack_embeddings, so a query costs a single matrix-vector product that
+    yields the text and about similarities together. The matrix is used as-is,
+    which lets it be a read-only view mapped from an embedding store.
+
+    With quantization ("float16" or "int8") the first pass runs over a compact
+    copy of the matrix and only the best rerank_factor * max_docs documents
+    are re-scored exactly in float32, so the full-precision rows are touched
+    only for that shortlist. Documents outside the shortlist are missed, so the
+    ranking is approximate. Pass the store's copy as quantized_matrix to share
+    it; otherwise the engine quantizes the matrix itself.
+    """
+
+    ABOUT_WEIGHT = 0.3
+    TEXT_WEIGHT = 0.7
+    MIN_RERANK = 32
+
+    def __init__(
+        self, matrix, quantization=None, rerank_factor=4, quantized_matrix=None
+    ):
+        self.matrix = to_numpy(matrix)
+        if self.matrix.ndim != 2 or self.matrix.shape[0] % 2:
+            raise ValueError(
+                f"Expected a stacked (2N, d) embedding matrix, got shape {self.matrix.shape}"
+            )
+        self.size = self.matrix.shape[0] // 2
+        self.doc_embeddings = self.matrix[: self.size]
+        self.doc_about_embeddings = self.matrix[self.size :]
+
+        self.quantization = quantization
+        self.rerank_factor = rerank_factor
+        if quantization:
+            self.quantized_matrix = quantized_matrix or QuantizedMatrix.quantize(
+                self.matrix, quantization
+            )
+
+    @classmethod
+    def from_embeddings(cls, doc_embeddings, doc_about_embeddings, **kwargs):
+        return cls(stack_embeddings(doc_embeddings, doc_about_embeddings), **kwargs)
+
+    def __len__(self):
+        return self.size
+
+    def _stacked_rows(self, rows):
+        # Both rows of each document: its text row and its about row
+        return np.concatenate([rows, rows + self.size])
+
+    def _split(self, similarities):
+        half = len(similarities) // 2
+        return similarities[:half], similarities[half:]
+
+    def similarities(self, query_embedding, rows=None):
+        query = normalize_rows(query_embedding)[0]
+        if rows is None:
+            return self._split(self.matrix @ query)
+        return self._split(self.matrix[self._stacked_rows(rows)] @ query)
+
+    @classmethod
+    def relevance_scores(
+        cls, text_similarities, about_similarities, high_match_threshold
+    ):
+        text_similarities = np.asarray(text_similarities)
+        about_similarities = np.asarray(about_similarities)
+        # If either about or text similarity is above the high match threshold, prioritize it
+        high_match = (about_similarities >= high_match_threshold) | (
+            text_similarities >= high_match_threshold
+        )
+        return np.where(
+            high_match,
+            np.maximum(about_similarities, text_similarities),
+            cls.ABOUT_WEIGHT * about_similarities + cls.TEXT_WEIGHT * text_similarities,
+        )
+
+    def score(self, query_embedding, high_match_threshold):
+        text_similarities, about_similarities = self.similarities(query_embedding)
+        relevance_scores = self.relevance_scores(
+            text_similarities, about_similarities, high_match_threshold
+        )
+        return text_similarities, about_similarities, relevance_scores
+
+    def search(
+        self,
+        query_embedding,
+        similarity_threshold,
+        high_match_threshold,
+        max_docs,
+        candidates=None,
+    ):
+        """Best documents as (indices, text_sims, about_sims, relevance_scores).
+
+        When candidates (document indices from an ANN index) are given, only
+        those rows are scored.
+        """
+        rows = candidates
+        if self.quantization:
+            rows = self._shortlist(
+                query_embedding, high_match_threshold, max_docs, rows
+            )
+
+        text_similarities, about_similarities = self.similarities(query_embedding, rows)
+        relevance_scores = self.relevance_scores(
+            text_similarities, about_similarities, high_match_threshold
+        )
+
+        top = self.top_k(relevance_scores, similarity_threshold, max_docs)
+        return (
+            top if rows is None else rows[top],
+            text_similarities[top],
+            about_similarities[top],
+            relevance_scores[top],
+        )
+
+    def _shortlist(self, query_embedding, high_match_threshold, max_docs, rows):
+        """Documents worth an exact re-rank, by approximate relevance."""
+        query = normalize_rows(query_embedding)[0]
+        stacked_rows = None if rows is None else self._stacked_rows(rows)
+        approximate_scores = self.relevance_scores(
+            *self._split(self.quantized_matrix.matvec(query, stacked_rows)),
+            high_match_threshold,
+        )
+        # The threshold is applied after the exact re-rank, not on approximate scores
+        size = max(max_docs * self.rerank_factor, self.MIN_RERANK)
+        shortlist = self.top_k(approximate_scores, -np.inf, size)
+        return shortlist if rows is None else rows[shortlist]
+
+    @staticmethod
+    def top_k(relevance_scores, similarity_threshold, max_docs):
+        """Indices of the best max_docs scores at or above the threshold, best first."""
+        relevance_scores = np.asarray(relevance_scores)
+        k = min(max_docs, len(relevance_scores))
+        if k <= 0:
+            return np.empty(0, dtype=np.intp)
+
+        # argpartition only orders the k winners, not the whole score vector
+        if k < len(relevance_scores):
+            candidates = np.argpartition(-relevance_scores, k - 1)[:k]
+        else:
+            candidates = np.arange(len(relevance_scores))
+        candidates = candidates[
+            np.argsort(-relevance_scores[candidates], kind="stable")
+        ]
+        return candidates[relevance_scores[candidates] >= similarity_threshold]
@@ -0,0 +1,99 @@
+import os
+import tempfile
+import unittest
+
+import numpy as np
+
+from ann_index import ExactIndex, IVFIndex
+from scoring import ScoringEngine, normalize_rows
+
+
+class TestIVFIndex(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        # Clustered synthetic corpus, like topic groups in the docs
+        rng = np.random.default_rng(7)
+        centers = rng.normal(size=(20, 32))
+        labels = rng.integers(0, 20, size=2000)
+        cls.doc_embeddings = normalize_rows(
+            centers[labels] + 0.3 * rng.normal(size=(2000, 32))
+        )
+        cls.doc_about_embeddings = normalize_rows(
+            centers[labels] + 0.3 * rng.normal(size=(2000, 32))
+        )
+        cls.queries = normalize_rows(
+            centers[rng.integers(0, 20, size=50)] + 0.3 * rng.normal(size=(50, 32))
+        )
+        cls.index = IVFIndex.build(
+            [cls.doc_embeddings, cls.doc_about_embeddings], n_lists=32, nprobe=4
+        )
+        cls.engine = ScoringEngine.from_embeddings(
+            cls.doc_embeddings, cls.doc_about_embeddings
+        )
+        print("Successfully set up IVFIndex class for testing!")
+
+    def test_exact_index_has_no_candidates(self):
+        self.assertIsNone(ExactIndex().candidates(self.queries[0]))
+        print("Test for exact_index_has_no_candidates passed successfully!")
+
+    def test_cluster_sums(self):
+        rng = np.random.default_rng(1)
+        vectors = rng.normal(size=(500, 16)).astype(np.float32)
+        # Cluster 3 is left empty
+        assignments = rng.choice([0, 1, 2, 4], size=500)
+        expected = np.zeros((5, 16), dtype=np.float32)
+        np.add.at(expected, assignments, vectors)
+        np.testing.assert_allclose(
+            IVFIndex._cluster_sums(vectors, assignments, 5), expected, atol=1e-4
+        )
+        print("Test for cluster_sums passed successfully!")
+
+    def test_lists_cover_every_document(self):
+        self.assertEqual(self.index.n_lists, 32)
+        self.assertEqual(self.index.list_offsets[-1], len(self.index.list_ids))
+        self.assertEqual(len(np.unique(self.index.list_ids)), 2000)
+        print("Test for lists_cover_every_document passed successfully!")
+
+    def test_full_probe_is_exact(self):
+        candidates = self.index.candidates(self.queries[0], nprobe=32)
+        np.testing.assert_array_equal(candidates, np.arange(2000))
+        print("Test for full_probe_is_exact passed successfully!")
+
+    def test_recall_grows_with_nprobe(self):
+        def recall(nprobe):
+            found = 0
+            for query in self.queries:
+                exact = self.engine.search(query, -1.0, 0.8, 5)[0]
+                candidates = self.index.candidates(query, nprobe=nprobe)
+                approx = self.engine.search(query, -1.0, 0.8, 5, candidates)[0]
+                found += len(set(exact) & set(approx))
+            return found / (5 * len(self.queries))
+
+        low, high = recall(1), recall(8)
+        self.assertGreaterEqual(high, low)
+        self.assertGreater(high, 0.9)
+        print(
+            f"Test for recall_grows_with_nprobe passed successfully! ({low:.2f} -> {high:.2f})"
+        )
+
+    def test_candidates_prune_the_scan(self):
+        candidates = self.index.candidates(self.queries[0], nprobe=2)
+        self.assertLess(len(candidates), 2000)
+        print("Test for candidates_prune_the_scan passed successfully!")
+
+    def test_save_and_load(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, "ann.index")
+            self.index.kb_hash = "abc"
+            self.index.save(path)
+            loaded = IVFIndex.load(path, nprobe=4)
+            self.assertEqual(loaded.kb_hash, "abc")
+            np.testing.assert_array_equal(
+                loaded.candidates(self.queries[1]),
+                self.index.candidates(self.queries[1]),
+            )
+        print("Test for save_and_load passed successfully!")
+
+
+if __name__ == "__main__":
+    unittest.main()
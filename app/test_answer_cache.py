@@ -0,0 +1,68 @@
+import unittest
+from unittest.mock import patch
+
+import fakeredis
+import numpy as np
+import redis
+
+from answer_cache import AnswerCache
+
+
+class TestAnswerCache(unittest.TestCase):
+    def setUp(self):
+        self.redis_client = fakeredis.FakeStrictRedis(decode_responses=True)
+        self.cache = AnswerCache(self.redis_client, threshold=0.9, ttl=300)
+        self.install = np.array([[1.0, 0.0, 0.0]], dtype=np.float32)
+        # cos = 0.95 to the install question
+        self.install_cli = np.array([[0.95, np.sqrt(1 - 0.95**2), 0.0]])
+        self.cache.put(
+            "kb1", [3, 1], "how do i install defang", self.install, "Use brew."
+        )
+
+    def test_near_duplicate_hits(self):
+        self.assertEqual(self.cache.get("kb1", [1, 3], self.install_cli), "Use brew.")
+        self.assertEqual(self.cache.get("kb1", [1, 3], self.install * 5), "Use brew.")
+        self.assertEqual(self.cache.stats()["hits"], 2)
+        print("Test for near_duplicate_hits passed successfully!")
+
+    def test_dissimilar_question_misses(self):
+        other = np.array([[0.0, 1.0, 0.0]])
+        self.assertIsNone(self.cache.get("kb1", [1, 3], other))
+        self.assertEqual(self.cache.stats()["misses"], 1)
+        print("Test for dissimilar_question_misses passed successfully!")
+
+    def test_different_docs_or_knowledge_base_miss(self):
+        self.assertIsNone(self.cache.get("kb1", [1, 4], self.install))
+        # A rebuilt knowledge base has a new hash
+        self.assertIsNone(self.cache.get("kb2", [1, 3], self.install))
+        print("Test for different_docs_or_knowledge_base_miss passed successfully!")
+
+    def test_shared_between_workers_with_ttl(self):
+        other_worker = AnswerCache(self.redis_client, threshold=0.9)
+        self.assertEqual(other_worker.get("kb1", [3, 1], self.install), "Use brew.")
+        key = self.cache._key("kb1", [1, 3])
+        self.assertTrue(0 < self.redis_client.ttl(key) <= 300)
+        print("Test for shared_between_workers_with_ttl passed successfully!")
+
+    def test_bucket_is_bounded(self):
+        cache = AnswerCache(self.redis_client, max_per_key=2)
+        for i in range(5):
+            cache.put("kb1", [7], f"q{i}", self.install, f"a{i}")
+        self.assertEqual(self.redis_client.llen(cache._key("kb1", [7])), 2)
+        # The newest answer wins among equally similar questions
+        self.assertEqual(cache.get("kb1", [7], self.install), "a4")
+        print("Test for bucket_is_bounded passed successfully!")
+
+    def test_disabled_and_redis_errors(self):
+        disabled = AnswerCache()
+        disabled.put("kb1", [1], "q", self.install, "a")
+        self.assertIsNone(disabled.get("kb1", [1], self.install))
+        with patch.object(
+            self.redis_client, "lrange", side_effect=redis.ConnectionError("down")
+        ):
+            self.assertIsNone(self.cache.get("kb1", [1, 3], self.install))
+        print("Test for disabled_and_redis_errors passed successfully!")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,126 @@
+import asyncio
+import unittest
+
+from aiohttp.test_utils import AioHTTPTestCase
+from flask import Flask, Response, jsonify, request, session
+from flask_wtf.csrf import CSRFProtect
+
+from async_app import create_app
+
+DEFERRED_ASK_KEY = "ask.deferred"
+
+
+class FakeLLMClient:
+    def __init__(self):
+        self.closed = False
+
+    async def aclose(self):
+        self.closed = True
+
+
+class FakeRAGSystem:
+    def __init__(self):
+        self.calls = []
+        self.llm_client = FakeLLMClient()
+
+    async def answer_query_stream_async(self, query, conversation_id=None):
+        self.calls.append((query, conversation_id))
+        for token in ("Deploy ", "with ", "defang compose up."):
+            await asyncio.sleep(0)
+            yield token
+
+
+def create_flask_app():
+    flask_app = Flask(__name__)
+    flask_app.config["SECRET_KEY"] = "test"
+    csrf = CSRFProtect(flask_app)
+
+    @flask_app.route("/")
+    def index():
+        return "home"
+
+    @flask_app.route("/v1/ask", methods=["POST"])
+    @csrf.exempt
+    def v1_ask():
+        if request.headers.get("Authorization") != "Bearer token":
+            return jsonify({"error": "Invalid or missing Ask Token"}), 401
+        session["anonymous_id"] = "anon-1"
+        if request.environ.get(DEFERRED_ASK_KEY):
+            request.environ[DEFERRED_ASK_KEY] = (
+                request.get_json()["query"],
+                "test",
+                session["anonymous_id"],
+            )
+            return Response(content_type="text/markdown")
+        return "sync answer"
+
+    @flask_app.route("/ask", methods=["POST"])
+    def ask():
+        return "unreachable without a CSRF token"
+
+    return flask_app
+
+
+class TestAsyncApp(AioHTTPTestCase):
+    async def get_application(self):
+        self.rag_system = FakeRAGSystem()
+        return create_app(create_flask_app(), self.rag_system, DEFERRED_ASK_KEY)
+
+    async def test_plain_routes_are_served_by_flask(self):
+        response = await self.client.get("/")
+        self.assertEqual(response.status, 200)
+        self.assertEqual(await response.text(), "home")
+        response = await self.client.get("/missing")
+        self.assertEqual(response.status, 404)
+        print("Test for plain_routes_are_served_by_flask passed successfully!")
+
+    async def test_ask_is_streamed_after_flask_checks(self):
+        response = await self.client.post(
+            "/v1/ask",
+            json={"query": "How do I deploy?"},
+            headers={"Authorization": "Bearer token"},
+        )
+        self.assertEqual(response.status, 200)
+        self.assertEqual(response.headers["Content-Type"], "text/markdown")
+        self.assertIn("session=", response.headers["Set-Cookie"])
+        self.assertEqual(await response.text(), "Deploy with defang compose up.")
+        self.assertEqual(self.rag_system.calls, [("How do I deploy?", "anon-1")])
+        print("Test for ask_is_streamed_after_flask_checks passed successfully!")
+
+    async def test_failed_checks_are_returned_as_is(self):
+        response = await self.client.post("/v1/ask", json={"query": "q"})
+        self.assertEqual(response.status, 401)
+        self.assertEqual(
+            (await response.json())["error"], "Invalid or missing Ask Token"
+        )
+        # CSRF protection still applies to /ask
+        response = await self.client.post("/ask", json={"query": "q"})
+        self.assertEqual(response.status, 400)
+        self.assertEqual(self.rag_system.calls, [])
+        print("Test for failed_checks_are_returned_as_is passed successfully!")
+
+    async def test_concurrent_streams(self):
+        responses = await asyncio.gather(
+            *[
+                self.client.post(
+                    "/v1/ask",
+                    json={"query": f"q{i}"},
+                    headers={"Authorization": "Bearer token"},
+                )
+                for i in range(50)
+            ]
+        )
+        texts = await asyncio.gather(*[response.text() for response in responses])
+        self.assertEqual(set(texts), {"Deploy with defang compose up."})
+        self.assertEqual(len(self.rag_system.calls), 50)
+        print("Test for concurrent_streams passed successfully!")
+
+    async def test_cleanup_closes_llm_client(self):
+        self.assertFalse(self.rag_system.llm_client.closed)
+        await self.app.cleanup()
+        self.assertTrue(self.rag_system.llm_client.closed)
+        print("Test for cleanup_closes_llm_client passed successfully!")
+
+
+if __name__ == "__main__":
+    unittest.main()
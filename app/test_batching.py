@@ -0,0 +1,78 @@
+import threading
+import time
+import unittest
+
+import numpy as np
+
+from batching import BatchingEncoder
+
+
+class TestBatchingEncoder(unittest.TestCase):
+    def setUp(self):
+        self.calls = []
+
+    def encode(self, texts):
+        self.calls.append(list(texts))
+        time.sleep(0.01)  # simulate a forward pass
+        return np.array([[len(text), 1.0] for text in texts], dtype=np.float32)
+
+    def encode_concurrently(self, encoder, texts):
+        results = {}
+
+        def worker(text):
+            results[text] = encoder.encode(text)
+
+        threads = [threading.Thread(target=worker, args=(text,)) for text in texts]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return results
+
+    def test_single_encode(self):
+        encoder = BatchingEncoder(self.encode, max_wait=0.001)
+        vector = encoder.encode("defang")
+        np.testing.assert_array_equal(vector, [6, 1])
+        self.assertEqual(self.calls, [["defang"]])
+        print("Test for single_encode passed successfully!")
+
+    def test_concurrent_requests_are_batched(self):
+        encoder = BatchingEncoder(self.encode, max_batch_size=32, max_wait=0.05)
+        texts = ["x" * n for n in range(1, 11)]
+        results = self.encode_concurrently(encoder, texts)
+        # every caller gets its own row back
+        for text in texts:
+            self.assertEqual(results[text][0], len(text))
+        self.assertLess(len(self.calls), len(texts))
+        self.assertEqual(sum(len(call) for call in self.calls), len(texts))
+        self.assertGreater(encoder.stats()["largest_batch"], 1)
+        print("Test for concurrent_requests_are_batched passed successfully!")
+
+    def test_max_batch_size(self):
+        encoder = BatchingEncoder(self.encode, max_batch_size=3, max_wait=0.05)
+        self.encode_concurrently(encoder, [str(n) for n in range(10)])
+        self.assertTrue(all(len(call) <= 3 for call in self.calls))
+        print("Test for max_batch_size passed successfully!")
+
+    def test_batching_disabled(self):
+        encoder = BatchingEncoder(self.encode, max_batch_size=1)
+        encoder.encode("a")
+        self.assertIsNone(encoder._thread)
+        self.assertEqual(encoder.stats()["batches"], 1)
+        print("Test for batching_disabled passed successfully!")
+
+    def test_errors_reach_every_caller(self):
+        def failing_encode(texts):
+            raise RuntimeError("model failure")
+
+        encoder = BatchingEncoder(failing_encode, max_wait=0.001)
+        with self.assertRaises(RuntimeError):
+            encoder.encode("a")
+        # the worker thread survives and keeps serving
+        encoder._encode = self.encode
+        np.testing.assert_array_equal(encoder.encode("ab"), [2, 1])
+        print("Test for errors_reach_every_caller passed successfully!")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,108 @@
+import os
+import tempfile
+import unittest
+from unittest.mock import patch
+
+import numpy as np
+
+from benchmark import (
+    benchmark_encoders,
+    load_queries,
+    parse_args,
+    percentiles,
+    replicate,
+    run_in,
+)
+from test_encoders import FakeEncoder
+
+
+class TestBenchmark(unittest.TestCase):
+    def test_percentiles(self):
+        summary = percentiles([i / 1000 for i in range(1, 101)])
+        self.assertEqual(summary["count"], 100)
+        self.assertAlmostEqual(summary["p50_ms"], 50.5)
+        self.assertAlmostEqual(summary["p99_ms"], 99.01)
+        self.assertEqual(percentiles([]), {"count": 0})
+        print("Test for percentiles passed successfully!")
+
+    def test_replicate(self):
+        knowledge_base = [{"about": "a", "text": "x"}, {"about": "b", "text": "y"}]
+        rng = np.random.default_rng(0)
+        doc_embeddings = rng.normal(size=(2, 8)).astype(np.float32)
+        doc_about_embeddings = rng.normal(size=(2, 8)).astype(np.float32)
+
+        replicated_kb, matrix = replicate(
+            knowledge_base, doc_embeddings, doc_about_embeddings, 5
+        )
+        self.assertEqual(len(replicated_kb), 5)
+        self.assertIs(replicated_kb[4], knowledge_base[0])
+        self.assertEqual(matrix.shape, (10, 8))
+        np.testing.assert_allclose(np.linalg.norm(matrix, axis=1), 1.0, atol=1e-6)
+        # Original entries are exact, replicas are close but not identical
+        np.testing.assert_allclose(
+            matrix[0], doc_embeddings[0] / np.linalg.norm(doc_embeddings[0]), atol=1e-6
+        )
+        self.assertFalse(np.array_equal(matrix[2], matrix[0]))
+        self.assertGreater(matrix[2] @ matrix[0], 0.99)
+        print("Test for replicate passed successfully!")
+
+    def test_load_queries_samples_titles(self):
+        knowledge_base = [{"about": f"topic {i % 4}"} for i in range(10)]
+        queries = load_queries(None, knowledge_base, 3)
+        self.assertEqual(len(queries), 3)
+        self.assertEqual(len(set(queries)), 3)
+        self.assertEqual(queries, load_queries(None, knowledge_base, 3))
+        print("Test for load_queries_samples_titles passed successfully!")
+
+    def test_benchmark_encoders(self):
+        encoders = {"torch": FakeEncoder(), "onnx": FakeEncoder(0.5)}
+        with patch(
+            "benchmark.create_encoder",
+            side_effect=lambda backend, *args: encoders[backend],
+        ):
+            results = benchmark_encoders(
+                ["torch", "onnx"], "model", None, ["a", "bb", "ccc"], 2, batch_size=2
+            )
+        self.assertEqual(results["torch"]["single"]["count"], 6)
+        self.assertEqual(results["onnx"]["batch"]["count"], 4)
+        self.assertAlmostEqual(
+            results["torch"]["min_cosine_similarity_to_torch"], 1.0, places=5
+        )
+        self.assertLess(results["onnx"]["min_cosine_similarity_to_torch"], 1.0)
+        print("Test for benchmark_encoders passed successfully!")
+
+    def test_run_in_leaves_data_untouched(self):
+        def data_files():
+            return {
+                entry.name: (entry.stat().st_mtime_ns, entry.stat().st_size)
+                for entry in os.scandir("./data")
+            }
+
+        before = data_files()
+        args = parse_args(
+            [
+                "--knowledge-base",
+                "test_knowledge_base.json",
+                "--query-count",
+                "2",
+                "--iterations",
+                "1",
+                "--sizes",
+                "20",
+                "--skip-full-scoring",
+            ]
+        )
+        with tempfile.TemporaryDirectory() as work_dir:
+            report = run_in(args, work_dir)
+            self.assertIn("samples.index", os.listdir(work_dir))
+        self.assertEqual(report["results"][0]["size"], 20)
+        search = report["results"][0]["search"]
+        self.assertEqual(set(search), {"float32", "float16", "int8"})
+        self.assertEqual(search["float32"]["recall"], 1.0)
+        self.assertLess(search["int8"]["scanned_mb"], search["float32"]["scanned_mb"])
+        self.assertEqual(data_files(), before)
+        print("Test for run_in_leaves_data_untouched passed successfully!")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,78 @@
+import os
+import tempfile
+import unittest
+
+import numpy as np
+
+from bm25 import BM25Index, reciprocal_rank_fusion, tokenize
+
+
+class TestBM25(unittest.TestCase):
+    def setUp(self):
+        self.knowledge_base = [
+            {"about": "Deploy to AWS", "text": "Run defang compose up --provider=aws."},
+            {"about": "Configuration", "text": "Set DEFANG_PROVIDER in compose.yaml."},
+            {"about": "Errors", "text": "The stack is in UPDATE_ROLLBACK state."},
+            {"about": "Pricing", "text": "The free tier covers hobby projects."},
+        ]
+        self.index = BM25Index.build(self.knowledge_base, kb_hash="kb1")
+
+    def test_tokenize_keeps_identifiers(self):
+        tokens = tokenize("Set DEFANG_PROVIDER=aws in compose.yaml with --provider")
+        for token in ("defang_provider", "defang", "provider", "compose.yaml", "yaml"):
+            self.assertIn(token, tokens)
+        self.assertNotIn("in", tokens)
+        print("Test for tokenize_keeps_identifiers passed successfully!")
+
+    def test_search_ranks_exact_matches(self):
+        ids, scores = self.index.search("DEFANG_PROVIDER", 5)
+        self.assertEqual(ids[0], 1)
+        self.assertTrue(np.all(np.diff(scores) <= 0))
+        ids, _ = self.index.search("update_rollback", 5)
+        self.assertEqual(list(ids), [2])
+        print("Test for search_ranks_exact_matches passed successfully!")
+
+    def test_only_matching_documents_are_scored(self):
+        ids, scores = self.index.scores("provider")
+        self.assertEqual(sorted(ids), [0, 1])
+        self.assertTrue(np.all(scores > 0))
+        ids, _ = self.index.search("the weather", 5)
+        self.assertEqual(len(ids), 0)
+        print("Test for only_matching_documents_are_scored passed successfully!")
+
+    def test_title_matches_weigh_more(self):
+        index = BM25Index.build(
+            [
+                {"about": "Secrets", "text": "Manage values."},
+                {"about": "Values", "text": "Manage secrets."},
+            ]
+        )
+        ids, _ = index.search("secrets", 2)
+        self.assertEqual(list(ids), [0, 1])
+        print("Test for title_matches_weigh_more passed successfully!")
+
+    def test_save_and_load(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, "bm25.index")
+            self.index.save(path)
+            loaded = BM25Index.load(path)
+        self.assertEqual(loaded.kb_hash, "kb1")
+        self.assertEqual(loaded.terms, self.index.terms)
+        for query in ("compose up aws", "DEFANG_PROVIDER", "free tier"):
+            np.testing.assert_array_equal(
+                loaded.search(query, 3)[0], self.index.search(query, 3)[0]
+            )
+        print("Test for save_and_load passed successfully!")
+
+    def test_reciprocal_rank_fusion(self):
+        ids, scores = reciprocal_rank_fusion([[3, 1, 2], [2, 5]], [1.0, 1.0], k=60)
+        # 2 is in both rankings, and ties keep the dense order
+        self.assertEqual(list(ids), [2, 3, 1, 5])
+        self.assertAlmostEqual(scores[0], 1 / 63 + 1 / 61)
+        ids, _ = reciprocal_rank_fusion([[3, 1, 2], [2, 5]], [1.0, 0.0], k=60)
+        self.assertEqual(list(ids[:3]), [3, 1, 2])
+        print("Test for reciprocal_rank_fusion passed successfully!")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,84 @@
+import unittest
+
+from context_builder import build_context, split_passages, window
+from utils import estimate_tokens
+
+
+def doc(about, text, path="/docs/page"):
+    return {"about": about, "text": text, "path": path}
+
+
+class TestContextBuilder(unittest.TestCase):
+    def test_split_passages(self):
+        text = "First sentence. Second one! " + " ".join(["word"] * 40)
+        passages = split_passages(text, max_tokens=20)
+        self.assertEqual(passages[:2], ["First sentence.", "Second one!"])
+        self.assertGreater(len(passages), 3)
+        self.assertTrue(all(estimate_tokens(p) <= 20 for p in passages))
+        self.assertEqual(" ".join(passages[2:]), " ".join(["word"] * 40))
+        print("Test for split_passages passed successfully!")
+
+    def test_window(self):
+        self.assertEqual(window([5, 5, 5, 5, 5], 2, 15), (1, 4))
+        self.assertEqual(window([5, 5, 5, 5, 5], 4, 12), (3, 5))
+        self.assertEqual(window([5, 5], 0, 100), (0, 2))
+        print("Test for window passed successfully!")
+
+    def test_short_docs_are_kept_whole(self):
+        docs = [
+            doc("Install", "Run the installer."),
+            doc("Login", "Run defang login.", "/docs/login"),
+        ]
+        context = build_context(docs, "install", max_tokens=1000)
+        self.assertEqual(
+            context, "Install. Run the installer.\n\nLogin. Run defang login."
+        )
+        print("Test for short_docs_are_kept_whole passed successfully!")
+
+    def test_long_doc_is_windowed_around_best_passage(self):
+        filler = " ".join(f"Filler sentence number {i}." for i in range(200))
+        text = filler + " To set a secret run defang config set NAME. " + filler
+        context = build_context(
+            [doc("CLI", text)],
+            "how to set a config secret",
+            max_tokens=100,
+            doc_max_tokens=100,
+        )
+        self.assertLessEqual(estimate_tokens(context), 100)
+        self.assertIn("defang config set NAME", context)
+        self.assertTrue(context.startswith("CLI. ... "))
+        self.assertTrue(context.endswith(" ..."))
+        print("Test for long_doc_is_windowed_around_best_passage passed successfully!")
+
+    def test_budget_is_filled_in_order(self):
+        docs = [
+            doc(f"Doc {i}", "Some words here. " * 20, f"/docs/{i}") for i in range(10)
+        ]
+        context = build_context(docs, "words", max_tokens=300, doc_max_tokens=100)
+        self.assertLessEqual(estimate_tokens(context), 300)
+        self.assertTrue(context.startswith("Doc 0."))
+        self.assertNotIn("Doc 9.", context)
+        print("Test for budget_is_filled_in_order passed successfully!")
+
+    def test_overlapping_sections_of_same_page_are_deduped(self):
+        shared = "Defang deploys Compose projects."
+        docs = [
+            doc("Overview", shared + " It supports AWS."),
+            doc("Overview, Providers", shared + " It supports GCP."),
+            doc("Elsewhere", shared, "/docs/other"),
+        ]
+        context = build_context(docs, "defang", max_tokens=1000)
+        sections = context.split("\n\n")
+        self.assertEqual(
+            sections[0], "Overview. Defang deploys Compose projects. It supports AWS."
+        )
+        self.assertEqual(sections[1], "Overview, Providers. It supports GCP.")
+        # Only sections of the same page are deduplicated
+        self.assertEqual(sections[2], "Elsewhere. Defang deploys Compose projects.")
+        print(
+            "Test for overlapping_sections_of_same_page_are_deduped passed successfully!"
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,121 @@
+import unittest
+from unittest.mock import patch
+
+import fakeredis
+import redis
+
+from conversation_store import ConversationStore
+
+
+def turn(question, answer):
+    return (
+        {"role": "user", "content": question},
+        {"role": "assistant", "content": answer},
+    )
+
+
+class TestConversationStore(unittest.TestCase):
+    def test_conversations_are_separate(self):
+        store = ConversationStore()
+        store.append("alice", *turn("What is Defang?", "A deployment tool."))
+        store.append("bob", *turn("Hi", "Hello!"))
+        self.assertEqual(
+            store.history("alice"), list(turn("What is Defang?", "A deployment tool."))
+        )
+        self.assertEqual(store.history("bob"), list(turn("Hi", "Hello!")))
+        self.assertEqual(store.history("carol"), [])
+        self.assertEqual(store.history(None), [])
+        print("Test for conversations_are_separate passed successfully!")
+
+    def test_turn_limit(self):
+        store = ConversationStore(max_turns=2)
+        for i in range(5):
+            store.append("alice", *turn(f"q{i}", f"a{i}"))
+        self.assertEqual(
+            [message["content"] for message in store.history("alice")],
+            ["q3", "a3", "q4", "a4"],
+        )
+        print("Test for turn_limit passed successfully!")
+
+    def test_token_budget_keeps_latest_messages(self):
+        store = ConversationStore(max_tokens=10)
+        store.append("alice", *turn("x" * 40, "y" * 24))
+        store.append("alice", *turn("z" * 12, "w" * 8))
+        # 3 + 2 tokens fit, the older 6-token answer does not
+        self.assertEqual(
+            [message["content"] for message in store.history("alice")],
+            ["z" * 12, "w" * 8],
+        )
+        print("Test for token_budget_keeps_latest_messages passed successfully!")
+
+    def test_token_budget_keeps_whole_turns(self):
+        store = ConversationStore(max_tokens=10)
+        store.append("alice", *turn("x" * 40, "y" * 8))
+        store.append("alice", *turn("z" * 12, "w" * 8))
+        # The older 2-token answer fits, but not without its 10-token question
+        self.assertEqual(
+            [message["content"] for message in store.history("alice")],
+            ["z" * 12, "w" * 8],
+        )
+        print("Test for token_budget_keeps_whole_turns passed successfully!")
+
+    def test_ttl_and_clear(self):
+        store = ConversationStore(ttl=60)
+        with patch("conversation_store.time.monotonic", return_value=1000.0):
+            store.append("alice", *turn("q", "a"))
+            store.append("bob", *turn("q", "a"))
+        with patch("conversation_store.time.monotonic", return_value=1059.0):
+            self.assertEqual(len(store.history("alice")), 2)
+        with patch("conversation_store.time.monotonic", return_value=1061.0):
+            self.assertEqual(store.history("alice"), [])
+        store.clear("bob")
+        self.assertEqual(store.history("bob"), [])
+        print("Test for ttl_and_clear passed successfully!")
+
+    def test_max_conversations(self):
+        store = ConversationStore(max_conversations=2)
+        for name in ("alice", "bob", "carol"):
+            store.append(name, *turn("q", "a"))
+        self.assertEqual(store.history("alice"), [])
+        self.assertEqual(store.stats()["conversations"], 2)
+        print("Test for max_conversations passed successfully!")
+
+    def test_redis_backend_is_shared(self):
+        redis_client = fakeredis.FakeStrictRedis(decode_responses=True)
+        worker_a = ConversationStore(max_turns=2, ttl=300, redis_client=redis_client)
+        worker_b = ConversationStore(max_turns=2, ttl=300, redis_client=redis_client)
+        for i in range(3):
+            worker_a.append("alice", *turn(f"q{i}", f"a{i}"))
+        self.assertEqual(
+            [message["content"] for message in worker_b.history("alice")],
+            ["q1", "a1", "q2", "a2"],
+        )
+        self.assertLessEqual(redis_client.ttl("conversation:alice"), 300)
+        worker_b.append("bob", *turn("q", "a"))
+        redis_client.set("answer_cache:x", "not a conversation")
+        self.assertEqual(worker_a.stats()["conversations"], 2)
+        worker_b.clear("alice")
+        self.assertEqual(worker_a.history("alice"), [])
+        self.assertEqual(worker_a.stats()["conversations"], 1)
+        print("Test for redis_backend_is_shared passed successfully!")
+
+    def test_redis_errors_are_not_fatal(self):
+        redis_client = fakeredis.FakeStrictRedis(decode_responses=True)
+        store = ConversationStore(redis_client=redis_client)
+        with patch.object(
+            redis_client, "lrange", side_effect=redis.ConnectionError("down")
+        ):
+            self.assertEqual(store.history("alice"), [])
+        with patch.object(
+            redis_client, "pipeline", side_effect=redis.ConnectionError("down")
+        ):
+            store.append("alice", *turn("q", "a"))
+        with patch.object(
+            redis_client, "scan_iter", side_effect=redis.ConnectionError("down")
+        ):
+            self.assertIsNone(store.stats()["conversations"])
+        print("Test for redis_errors_are_not_fatal passed successfully!")
+
+
+if __name__ == "__main__":
+    unittest.main()
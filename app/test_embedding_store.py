@@ -0,0 +1,197 @@
+import os
+import tempfile
+import unittest
+
+import numpy as np
+
+from embedding_store import (
+    FORMAT_VERSION,
+    EmbeddingCache,
+    EmbeddingStore,
+    EmbeddingStoreError,
+    IndexGeneration,
+    knowledge_base_hash,
+    write_embedding_store,
+)
+
+
+class TestEmbeddingStore(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp_dir.name, "embeddings.index")
+        rng = np.random.default_rng(0)
+        self.doc_embeddings = rng.normal(size=(7, 16)).astype(np.float32)
+        self.doc_about_embeddings = rng.normal(size=(7, 16)).astype(np.float32)
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def write(self, kb_hash="abc"):
+        write_embedding_store(
+            self.path,
+            {
+                "doc_embeddings": self.doc_embeddings,
+                "doc_about_embeddings": self.doc_about_embeddings,
+            },
+            kb_hash,
+        )
+
+    def test_round_trip(self):
+        self.write()
+        store = EmbeddingStore(self.path)
+        self.assertEqual(store.kb_hash, "abc")
+        self.assertEqual(store.dim, 16)
+        self.assertEqual(store.dtype, np.float32)
+        np.testing.assert_array_equal(store["doc_embeddings"], self.doc_embeddings)
+        np.testing.assert_array_equal(
+            store["doc_about_embeddings"], self.doc_about_embeddings
+        )
+        print("Test for round_trip passed successfully!")
+
+    def test_arrays_are_read_only_views(self):
+        self.write()
+        store = EmbeddingStore(self.path)
+        array = store["doc_embeddings"]
+        self.assertFalse(array.flags.writeable)
+        self.assertFalse(array.flags.owndata)
+        self.assertEqual(array.ctypes.data % 64, 0)  # aligned inside the mapping
+        print("Test for arrays_are_read_only_views passed successfully!")
+
+    def test_mapping_survives_atomic_replace(self):
+        self.write(kb_hash="old")
+        old_store = EmbeddingStore(self.path)
+        self.doc_embeddings = self.doc_embeddings * 2
+        self.write(kb_hash="new")
+        new_store = EmbeddingStore(self.path)
+        self.assertEqual(old_store.kb_hash, "old")
+        self.assertEqual(new_store.kb_hash, "new")
+        np.testing.assert_array_equal(
+            old_store["doc_embeddings"] * 2, new_store["doc_embeddings"]
+        )
+        print("Test for mapping_survives_atomic_replace passed successfully!")
+
+    def test_verify_detects_corruption(self):
+        self.write()
+        EmbeddingStore(self.path).verify()
+        with open(self.path, "r+b") as f:
+            f.seek(-1, os.SEEK_END)
+            last = f.read(1)
+            f.seek(-1, os.SEEK_END)
+            f.write(bytes([last[0] ^ 0xFF]))
+        with self.assertRaises(EmbeddingStoreError):
+            EmbeddingStore(self.path).verify()
+        print("Test for verify_detects_corruption passed successfully!")
+
+    def test_rejects_other_files(self):
+        with open(self.path, "wb") as f:
+            f.write(b"not an embedding store at all")
+        with self.assertRaises(EmbeddingStoreError):
+            EmbeddingStore(self.path)
+        print("Test for rejects_other_files passed successfully!")
+
+    def test_rejects_other_versions(self):
+        self.write()
+        with open(self.path, "r+b") as f:
+            f.seek(8)
+            f.write((FORMAT_VERSION + 1).to_bytes(4, "little"))
+        with self.assertRaises(EmbeddingStoreError):
+            EmbeddingStore(self.path)
+        print("Test for rejects_other_versions passed successfully!")
+
+    def test_rejects_non_matrix_embeddings(self):
+        with self.assertRaises(EmbeddingStoreError):
+            write_embedding_store(
+                self.path, {"doc_embeddings": self.doc_embeddings[0]}, "abc"
+            )
+        print("Test for rejects_non_matrix_embeddings passed successfully!")
+
+    def test_knowledge_base_hash(self):
+        kb = [{"id": 1, "about": "a", "text": "b", "path": "/c"}]
+        self.assertEqual(knowledge_base_hash(kb), knowledge_base_hash(list(kb)))
+        self.assertNotEqual(
+            knowledge_base_hash(kb),
+            knowledge_base_hash([{"id": 1, "about": "a", "text": "x", "path": "/c"}]),
+        )
+        print("Test for knowledge_base_hash passed successfully!")
+
+
+class TestEmbeddingCache(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp_dir.name, "embedding_cache.index")
+        self.encoded = []
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def encode(self, texts):
+        self.encoded.extend(texts)
+        return np.array([[len(text), 1.0, 0.5] for text in texts], dtype=np.float32)
+
+    def test_only_misses_are_encoded(self):
+        cache = EmbeddingCache(self.path, "model-a")
+        vectors = cache.embed(["one", "three", "one"], self.encode)
+        self.assertEqual(self.encoded, ["one", "three"])
+        self.assertEqual((cache.hits, cache.misses), (1, 2))
+        np.testing.assert_array_equal(vectors[:, 0], [3, 5, 3])
+        print("Test for only_misses_are_encoded passed successfully!")
+
+    def test_persisted_vectors_are_reused(self):
+        cache = EmbeddingCache(self.path, "model-a")
+        cache.embed(["one", "three"], self.encode)
+        cache.save()
+
+        self.encoded = []
+        cache = EmbeddingCache(self.path, "model-a")
+        vectors = cache.embed(["three", "seven"], self.encode)
+        self.assertEqual(self.encoded, ["seven"])
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+        np.testing.assert_array_equal(vectors[:, 0], [5, 5])
+        print("Test for persisted_vectors_are_reused passed successfully!")
+
+    def test_save_drops_unused_entries(self):
+        cache = EmbeddingCache(self.path, "model-a")
+        cache.embed(["one", "three"], self.encode)
+        cache.save()
+        cache = EmbeddingCache(self.path, "model-a")
+        cache.embed(["three"], self.encode)
+        cache.save()
+        self.assertEqual(len(EmbeddingCache(self.path, "model-a")), 1)
+        print("Test for save_drops_unused_entries passed successfully!")
+
+    def test_model_change_invalidates(self):
+        cache = EmbeddingCache(self.path, "model-a")
+        cache.embed(["one"], self.encode)
+        cache.save()
+        cache = EmbeddingCache(self.path, "model-b")
+        self.assertEqual(len(cache), 0)
+        self.assertNotEqual(
+            cache.key("one"), EmbeddingCache(self.path, "model-a").key("one")
+        )
+        print("Test for model_change_invalidates passed successfully!")
+
+
+class TestIndexGeneration(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp_dir.name, "embeddings.generation")
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_starts_at_zero(self):
+        self.assertEqual(IndexGeneration(self.path).value, 0)
+        print("Test for starts_at_zero passed successfully!")
+
+    def test_bump_is_visible_to_other_mappings(self):
+        writer = IndexGeneration(self.path)
+        reader = IndexGeneration(self.path)
+        self.assertEqual(writer.bump(), 1)
+        self.assertEqual(writer.bump(), 2)
+        self.assertEqual(reader.value, 2)
+        self.assertEqual(IndexGeneration(self.path).value, 2)
+        print("Test for bump_is_visible_to_other_mappings passed successfully!")
+
+
+if __name__ == "__main__":
+    unittest.main()
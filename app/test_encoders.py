@@ -0,0 +1,60 @@
+import unittest
+
+import numpy as np
+
+from encoders import (
+    EncoderMismatchError,
+    check_encoder,
+    create_encoder,
+    embedding_agreement,
+    mean_pooling,
+)
+
+
+class FakeEncoder:
+    def __init__(self, noise=0.0):
+        self.noise = noise
+
+    def encode(self, texts):
+        vectors = np.array([[len(text), 1.0, 2.0] for text in texts], dtype=np.float32)
+        return vectors + self.noise * np.array([0.0, 1.0, -1.0], dtype=np.float32)
+
+
+class TestEncoders(unittest.TestCase):
+    def test_mean_pooling_ignores_padding(self):
+        token_embeddings = np.array(
+            [[[1.0, 2.0], [3.0, 4.0], [100.0, 100.0]]], dtype=np.float32
+        )
+        attention_mask = np.array([[1, 1, 0]])
+        np.testing.assert_allclose(
+            mean_pooling(token_embeddings, attention_mask), [[2.0, 3.0]]
+        )
+        # A fully masked row does not divide by zero
+        self.assertTrue(
+            np.isfinite(mean_pooling(token_embeddings, np.zeros((1, 3)))).all()
+        )
+        print("Test for mean_pooling_ignores_padding passed successfully!")
+
+    def test_check_encoder(self):
+        texts = ["a", "defang compose up", "how do I deploy to AWS?"]
+        reference = FakeEncoder()
+        np.testing.assert_allclose(
+            embedding_agreement(reference, FakeEncoder(), texts), 1.0, rtol=1e-6
+        )
+        self.assertGreater(
+            check_encoder(reference, FakeEncoder(0.01), texts, 1e-3), 0.999
+        )
+        with self.assertRaises(EncoderMismatchError):
+            check_encoder(reference, FakeEncoder(1.0), texts, 1e-3)
+        print("Test for check_encoder passed successfully!")
+
+    def test_create_encoder_rejects_bad_config(self):
+        with self.assertRaises(ValueError):
+            create_encoder("tensorrt", "all-MiniLM-L6-v2")
+        with self.assertRaises(ValueError):
+            create_encoder("onnx", "all-MiniLM-L6-v2")
+        print("Test for create_encoder_rejects_bad_config passed successfully!")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,5 +1,24 @@
+import json
+import os
+import tempfile
 import unittest
-from get_knowledge_base import adjust_knowledge_base_entry_path
+from unittest.mock import patch
+
+from git import Actor, Repo
+
+import get_knowledge_base
+from get_knowledge_base import (
+    adjust_knowledge_base_entry_path,
+    build_knowledge_base,
+    chunk_knowledge_base,
+    chunk_text,
+    clone_repository,
+    ingest,
+    knowledge_base_from_state,
+    recursive_parse_directory,
+    write_knowledge_base,
+)
+from utils import estimate_tokens
 
 
 class TestGetKnowledgeBase(unittest.TestCase):
@@ -45,6 +64,232 @@ class TestGetKnowledgeBase(unittest.TestCase):
             "Test for adjust_knowledgebase_entry_path_date_at_middle passed successfully!"
         )
 
+    def test_chunk_text(self):
+        sentences = [f"Sentence number {i} has a few words in it." for i in range(20)]
+        chunks = chunk_text(" ".join(sentences), max_tokens=40, overlap_tokens=12)
+        self.assertGreater(len(chunks), 1)
+        for chunk in chunks:
+            self.assertLessEqual(estimate_tokens(chunk), 40)
+        # Each chunk starts with the last sentence of the one before it
+        for previous, chunk in zip(chunks, chunks[1:]):
+            self.assertTrue(previous.endswith(chunk.split(". ")[0] + "."))
+        self.assertTrue(chunks[-1].endswith(sentences[-1]))
+        self.assertEqual(chunk_text("Short text.", 40, 12), ["Short text."])
+        print("Test for chunk_text passed successfully!")
+
+    def test_chunk_knowledge_base(self):
+        entries = [
+            {"id": 1, "about": "Short", "text": "Fits in one passage.", "path": "/a"},
+            {
+                "id": 2,
+                "about": "Long",
+                "text": " ".join(f"Line {i} of the long section." for i in range(60)),
+                "path": "/b",
+            },
+        ]
+        passages = chunk_knowledge_base(entries, max_tokens=50, overlap_tokens=10)
+        self.assertEqual(
+            passages[0],
+            {**entries[0], "id": "1:0", "parent_id": 1, "section": 0, "chunk": 0},
+        )
+        long_passages = passages[1:]
+        self.assertGreater(len(long_passages), 1)
+        for chunk, passage in enumerate(long_passages):
+            self.assertEqual(passage["section"], 1)
+            self.assertEqual(passage["chunk"], chunk)
+            self.assertEqual((passage["id"], passage["parent_id"]), (f"2:{chunk}", 2))
+            self.assertEqual((passage["about"], passage["path"]), ("Long", "/b"))
+            self.assertLessEqual(estimate_tokens("Long. " + passage["text"]), 50)
+
+        # Already chunked entries are kept, and new sections are numbered after them
+        self.assertEqual(chunk_knowledge_base(passages, 50, 10), passages)
+        added = chunk_knowledge_base(passages + entries[:1], 50, 10)
+        self.assertEqual(added[-1]["section"], 2)
+        print("Test for chunk_knowledge_base passed successfully!")
+
+    def write_docs(self, root_dir):
+        front_matter = "---\ntitle: Page\nsidebar_position: 1\n---\n\n"
+        files = {
+            "docs/intro.md": "# Intro\nDefang deploys apps.\n## Install\nRun the installer.\n",
+            "docs/2024-01-02-post.mdx": "## Release\nNew providers.\n",
+            "docs/cli/defang_up.md": "---\ntitle: up\n---\n\ndefang up\nDeploys the project.\n",
+        }
+        for name, content in files.items():
+            path = os.path.join(root_dir, name)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, "w", encoding="utf-8") as f:
+                f.write(content if "cli" in name else front_matter + content)
+
+    def test_build_knowledge_base(self):
+        with tempfile.TemporaryDirectory() as root_dir:
+            self.write_docs(root_dir)
+            kb_data = build_knowledge_base(root_dir, workers=2)
+            self.assertEqual(build_knowledge_base(root_dir, workers=1), kb_data)
+
+            by_about = {entry["about"]: entry for entry in kb_data}
+            self.assertEqual(set(by_about), {"Intro, Install", "Release", "defang up"})
+            self.assertEqual(by_about["defang up"]["text"], "Deploys the project.")
+            self.assertTrue(by_about["Release"]["path"].endswith("/2024/01/02/post"))
+            self.assertEqual(len({entry["id"] for entry in kb_data}), 3)
+            self.assertEqual(len({entry["parent_id"] for entry in kb_data}), 3)
+
+            # Rebuilding after an edit replaces the file's sections and keeps the others
+            with open(os.path.join(root_dir, "docs/2024-01-02-post.mdx"), "a") as f:
+                f.write("And more regions.\n")
+            rebuilt = build_knowledge_base(root_dir, workers=2)
+            self.assertEqual(len(rebuilt), 3)
+            rebuilt_ids = {entry["about"]: entry["parent_id"] for entry in rebuilt}
+            self.assertEqual(
+                rebuilt_ids["Intro, Install"], by_about["Intro, Install"]["parent_id"]
+            )
+            self.assertNotEqual(
+                rebuilt_ids["Release"], by_about["Release"]["parent_id"]
+            )
+        print("Test for build_knowledge_base passed successfully!")
+
+    def test_write_knowledge_base(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, "knowledge_base.json")
+            write_knowledge_base([{"about": "Défaut"}], path)
+            write_knowledge_base([{"about": "Défaut", "text": "x"}], path)
+            with open(path, encoding="utf-8") as f:
+                self.assertEqual(json.load(f), [{"about": "Défaut", "text": "x"}])
+            self.assertEqual(os.listdir(tmp_dir), ["knowledge_base.json"])
+        print("Test for write_knowledge_base passed successfully!")
+
+
+AUTHOR = Actor("Docs Bot", "docs@example.com")
+FRONT_MATTER = "---\ntitle: Page\nsidebar_position: 1\n---\n\n"
+
+
+class TestIncrementalIngest(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        root = self.tmp_dir.name
+        # An upstream docs repo, the bare repo it pushes to, and our checkout of it
+        self.upstream = Repo.init(os.path.join(root, "upstream"))
+        for i in range(10):
+            self.write(f"docs/page{i}.md", f"# Page {i}\nAbout topic {i}.\n")
+        self.write(
+            "docs/cli/defang_up.md", "---\ntitle: up\n---\n\ndefang up\nDeploys.\n"
+        )
+        self.commit("Add docs")
+        self.bare_dir = os.path.join(root, "docs.git")
+        self.upstream.clone(self.bare_dir, bare=True)
+        self.upstream.create_remote("origin", self.bare_dir)
+        self.checkout_dir = os.path.join(root, "defang-docs")
+        clone_repository(self.bare_dir, self.checkout_dir)
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def write(self, path, content, root=None):
+        path = os.path.join(root or self.upstream.working_tree_dir, path)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(content if "cli" in path else FRONT_MATTER + content)
+
+    def commit(self, message):
+        self.upstream.git.add("-A")
+        self.upstream.index.commit(message, author=AUTHOR, committer=AUTHOR)
+
+    def push_and_pull(self):
+        self.upstream.git.push("origin", "HEAD")
+        clone_repository(self.bare_dir, self.checkout_dir)
+
+    def ingest_tracking_parses(self, state):
+        with patch.object(
+            get_knowledge_base, "parse_files", wraps=get_knowledge_base.parse_files
+        ) as parse_files:
+            new_state = ingest(self.checkout_dir, state)
+        return new_state, sorted(parse_files.call_args.args[0])
+
+    def test_only_changed_files_are_parsed(self):
+        state = ingest(self.checkout_dir)
+        self.assertEqual(len(state["files"]), 11)
+        self.assertEqual(state["commit"], Repo(self.checkout_dir).head.commit.hexsha)
+
+        self.write("docs/page1.md", "# Page 1\nRewritten.\n")
+        self.write("docs/new.md", "# New\nA new page.\n")
+        os.remove(os.path.join(self.upstream.working_tree_dir, "docs/page2.md"))
+        self.commit("Update docs")
+        self.push_and_pull()
+
+        state, parsed = self.ingest_tracking_parses(state)
+        self.assertEqual(parsed, ["docs/new.md", "docs/page1.md"])
+        self.assertEqual(state["tombstones"], {"docs/page2.md": state["commit"]})
+        self.assertEqual(state["files"]["docs/page1.md"][0]["text"], "Rewritten.")
+        # Same knowledge base as parsing everything again
+        self.assertEqual(
+            knowledge_base_from_state(state),
+            knowledge_base_from_state(ingest(self.checkout_dir)),
+        )
+
+        state, parsed = self.ingest_tracking_parses(state)
+        self.assertEqual(parsed, [])
+        print("Test for only_changed_files_are_parsed passed successfully!")
+
+    def test_working_tree_changes(self):
+        state = ingest(self.checkout_dir)
+        # Files generated or edited in the checkout, like the prebuild script's output
+        self.write("docs/page3.md", "# Page 3\nEdited locally.\n", self.checkout_dir)
+        self.write(
+            "docs/generated.md", "# Generated\nBy prebuild.\n", self.checkout_dir
+        )
+        state, parsed = self.ingest_tracking_parses(state)
+        self.assertEqual(parsed, ["docs/generated.md", "docs/page3.md"])
+        self.assertEqual(state["dirty"], ["docs/generated.md", "docs/page3.md"])
+
+        # Reverting them is picked up too, although git no longer reports them
+        Repo(self.checkout_dir).git.checkout("--", "docs/page3.md")
+        os.remove(os.path.join(self.checkout_dir, "docs/generated.md"))
+        state, parsed = self.ingest_tracking_parses(state)
+        self.assertEqual(parsed, ["docs/page3.md"])
+        self.assertNotIn("docs/generated.md", state["files"])
+        self.assertEqual(state["files"]["docs/page3.md"][0]["text"], "About topic 3.")
+        self.assertEqual(state["dirty"], [])
+        print("Test for working_tree_changes passed successfully!")
+
+    def test_gitignored_files_are_indexed(self):
+        # Prebuild output is often gitignored, but still part of the docs
+        with open(os.path.join(self.checkout_dir, ".gitignore"), "w") as f:
+            f.write("build/\n")
+        self.write("build/page.md", "# Build\nGenerated copy.\n", self.checkout_dir)
+        state = ingest(self.checkout_dir)
+        self.assertIn("build/page.md", state["files"])
+        self.assertEqual(len(state["files"]), 12)
+
+        # Git cannot report changes to them, so incremental runs parse them again
+        self.write("build/page.md", "# Build\nRegenerated.\n", self.checkout_dir)
+        self.write("build/other.md", "# Other\nGenerated.\n", self.checkout_dir)
+        state, parsed = self.ingest_tracking_parses(state)
+        self.assertEqual(parsed, ["build/other.md", "build/page.md"])
+        self.assertEqual(state["files"]["build/page.md"][0]["text"], "Regenerated.")
+        self.assertEqual(state["files"], ingest(self.checkout_dir)["files"])
+
+        os.remove(os.path.join(self.checkout_dir, "build/other.md"))
+        state, parsed = self.ingest_tracking_parses(state)
+        self.assertNotIn("build/other.md", state["files"])
+        self.assertEqual(state["files"], ingest(self.checkout_dir)["files"])
+        print("Test for gitignored_files_are_indexed passed successfully!")
+
+    def test_unknown_commit_parses_everything(self):
+        state = ingest(self.checkout_dir)
+        state["commit"] = "0" * 40
+        state, parsed = self.ingest_tracking_parses(state)
+        self.assertEqual(len(parsed), 11)
+        print("Test for unknown_commit_parses_everything passed successfully!")
+
+    def test_recursive_parse_directory_records_state(self):
+        kb_path = os.path.join(self.tmp_dir.name, "knowledge_base.json")
+        state_path = os.path.join(self.tmp_dir.name, "ingest_state.json")
+        with patch.object(get_knowledge_base, "kb_file_path", kb_path):
+            recursive_parse_directory(self.checkout_dir, state_path=state_path)
+        states = get_knowledge_base.load_ingest_state(state_path)
+        self.assertEqual(list(states), ["defang-docs"])
+        self.assertEqual(len(states["defang-docs"]["files"]), 11)
+        print("Test for recursive_parse_directory_records_state passed successfully!")
+
 
 if __name__ == "__main__":
     unittest.main()
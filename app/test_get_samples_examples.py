@@ -0,0 +1,109 @@
+import json
+import os
+import subprocess
+import tempfile
+import unittest
+
+from get_samples_examples import (
+    extract_samples,
+    get_technologies,
+    main,
+    sparse_clone,
+)
+
+DJANGO_DOCKERFILE = """FROM --platform=linux/amd64 python:3.12-slim AS build
+RUN pip install --no-cache-dir -r requirements.txt
+CMD ["gunicorn", "django_app.wsgi"]
+"""
+DJANGO_COMPOSE = """services:
+  app:
+    build: ./app
+    environment:
+      - DATABASE_URL=postgres://django@db/django
+  cache:
+    image: bitnami/redis:7
+"""
+
+
+def write_files(root_dir, files):
+    for name, content in files.items():
+        path = os.path.join(root_dir, name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "w") as f:
+            f.write(content)
+
+
+SAMPLE_FILES = {
+    "samples/django-postgres/compose.yaml": DJANGO_COMPOSE,
+    "samples/django-postgres/app/Dockerfile": DJANGO_DOCKERFILE,
+    "samples/golang-http/Dockerfile": "FROM golang:1.22\nRUN go build\n",
+    "samples/empty/README.md": "Nothing to deploy\n",
+    "README.md": "Samples\n",
+    "templates/starter/compose.yaml": "services: {}\n",
+}
+
+
+class TestGetSamplesExamples(unittest.TestCase):
+    def test_get_technologies(self):
+        self.assertEqual(
+            get_technologies(DJANGO_DOCKERFILE, DJANGO_COMPOSE),
+            ["Django", "PostgreSQL", "Python", "Redis"],
+        )
+        # Frameworks count only where their package manager runs
+        self.assertEqual(
+            get_technologies("FROM node:20-alpine\nRUN npm ci\nCMD next start", ""),
+            ["Next.js", "Node.js"],
+        )
+        self.assertEqual(get_technologies("FROM nginx\n# next: react", ""), [])
+        self.assertEqual(
+            get_technologies("", "services:\n  db:\n    image: 'mongo:7'\n"),
+            ["MongoDB"],
+        )
+        print("Test for get_technologies passed successfully!")
+
+    def test_extract_samples(self):
+        with tempfile.TemporaryDirectory() as repo_dir:
+            write_files(repo_dir, SAMPLE_FILES)
+            results = extract_samples(repo_dir, workers=2)
+        self.assertEqual(
+            [result["projectName"] for result in results],
+            ["django-postgres", "golang-http"],
+        )
+        django, golang = results
+        self.assertEqual(django["dockerfile"], DJANGO_DOCKERFILE)
+        self.assertEqual(django["compose"], DJANGO_COMPOSE)
+        self.assertEqual(golang["compose"], "")
+        self.assertEqual(golang["technologies"], ["Go"])
+        self.assertEqual(
+            golang["description"],
+            "A Go application that demonstrates how to deploy a golang-http project with Defang.",
+        )
+        print("Test for extract_samples passed successfully!")
+
+    def test_sparse_clone(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            upstream = os.path.join(tmp_dir, "upstream")
+            write_files(upstream, SAMPLE_FILES)
+            git = ["git", "-c", "user.name=Bot", "-c", "user.email=bot@example.com"]
+            subprocess.run(["git", "init", "-q", upstream], check=True)
+            subprocess.run(git + ["-C", upstream, "add", "-A"], check=True)
+            subprocess.run(
+                git + ["-C", upstream, "commit", "-q", "-m", "Samples"], check=True
+            )
+
+            checkout = os.path.join(tmp_dir, "checkout")
+            sparse_clone(f"file://{upstream}", checkout)
+            self.assertTrue(
+                os.path.isdir(os.path.join(checkout, "samples/golang-http"))
+            )
+            self.assertFalse(os.path.exists(os.path.join(checkout, "templates")))
+
+            output = os.path.join(tmp_dir, "samples_examples.json")
+            main(["--repo-dir", checkout, "--output", output, "--workers", "1"])
+            with open(output) as f:
+                self.assertEqual(len(json.load(f)), 2)
+        print("Test for sparse_clone passed successfully!")
+
+
+if __name__ == "__main__":
+    unittest.main()
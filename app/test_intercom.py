@@ -2,6 +2,7 @@ import time
 import unittest
 from unittest.mock import patch, Mock
 import fakeredis
+from flask import Flask
 import intercom
 
 # Apply patch to use a fake redis for testing before importing app
@@ -165,6 +166,33 @@ class TestIntercom(unittest.TestCase):
         self.assertEqual(result, "User message 3")
         print("test_extract_latest_user_messages_after_admin passed successfully.")
 
+    def test_answer_intercom_job_raises_on_failure(self):
+        payload = {"conversation_id": "123", "topic": "conversation.user.replied"}
+        with patch.object(
+            intercom, "answer_intercom_conversation", return_value=({}, 502)
+        ):
+            with self.assertRaises(intercom.IntercomError):
+                self.app.answer_intercom_job(None, payload)
+        with patch.object(
+            intercom, "answer_intercom_conversation", return_value=({}, 200)
+        ) as answer:
+            self.app.answer_intercom_job(None, payload)
+        answer.assert_called_once_with(None, "123", "conversation.user.replied")
+        print("test_answer_intercom_job_raises_on_failure passed successfully.")
+
+    def test_post_intercom_reply_unreachable(self):
+        client = Mock()
+        client.reply.side_effect = intercom.IntercomError("refused")
+        with (
+            Flask(__name__).app_context(),
+            patch.dict("os.environ", {"INTERCOM_TOKEN": "t", "INTERCOM_ADMIN_ID": "1"}),
+            patch.object(intercom, "get_intercom_client", return_value=client),
+        ):
+            response, status_code = self.app.post_intercom_reply("123", "Hi")
+            self.assertEqual(status_code, 502)
+            self.assertEqual(response.get_json(), {"error": "Failed to reach Intercom"})
+        print("test_post_intercom_reply_unreachable passed successfully.")
+
     def test_is_conversation_human_replied_check_false(self):
         conversation_id = "test_convo_id_1234"
         self.app.r.delete(conversation_id)
@@ -0,0 +1,158 @@
+import json
+import socket
+import threading
+import time
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from intercom_client import (
+    IntercomClient,
+    IntercomError,
+    RateLimiter,
+    retry_after_seconds,
+)
+
+
+class StubIntercom(BaseHTTPRequestHandler):
+    """Answers with the queued (status, headers) responses, then with 200."""
+
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def respond(self, body):
+        server = self.server
+        with server.lock:
+            server.requests.append((self.command, self.path, self.headers))
+            server.ports.add(self.client_address[1])
+            status, headers = server.responses.pop(0) if server.responses else (200, {})
+        time.sleep(server.delay)
+        body = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        for name, value in {"Content-Type": "application/json", **headers}.items():
+            self.send_header(name, value)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        self.respond({"type": "conversation", "id": self.path.rsplit("/", 1)[-1]})
+
+    def do_POST(self):
+        payload = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        self.respond({"type": "conversation", "body": payload["body"]})
+
+
+class TestIntercomClient(unittest.TestCase):
+    def setUp(self):
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), StubIntercom)
+        self.server.daemon_threads = True
+        self.server.lock = threading.Lock()
+        self.server.requests = []
+        self.server.ports = set()
+        self.server.responses = []
+        self.server.delay = 0
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.client = IntercomClient(
+            "test-token",
+            base_url=f"http://127.0.0.1:{self.server.server_port}",
+            read_timeout=0.5,
+            backoff=0.01,
+            rate_limit=1000,
+        )
+
+    def tearDown(self):
+        self.client.session.close()
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_pooled_session(self):
+        for conversation_id in ("1", "2", "3"):
+            response = self.client.get_conversation(conversation_id)
+            self.assertEqual(response.json()["id"], conversation_id)
+        self.assertEqual(len(self.server.ports), 1)
+        method, path, headers = self.server.requests[0]
+        self.assertEqual((method, path), ("GET", "/conversations/1"))
+        self.assertEqual(headers["Authorization"], "Bearer test-token")
+        self.assertEqual(headers["Intercom-Version"], "2.13")
+        print("Test for pooled_session passed successfully!")
+
+    def test_retries_honor_retry_after(self):
+        self.server.responses = [(429, {"Retry-After": "0.2"}), (502, {})]
+        start = time.monotonic()
+        response = self.client.get_conversation("7")
+        self.assertGreaterEqual(time.monotonic() - start, 0.2)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.client.stats()["retries"], 2)
+        print("Test for retries_honor_retry_after passed successfully!")
+
+    def test_gives_up_with_last_response(self):
+        self.server.responses = [(500, {})] * 5
+        response = self.client.get_conversation("7")
+        self.assertEqual(response.status_code, 500)
+        self.assertEqual(len(self.server.requests), self.client.max_retries + 1)
+
+        # A Retry-After beyond the limit is not waited for
+        self.server.responses = [(429, {"Retry-After": "3600"})]
+        self.assertEqual(self.client.get_conversation("7").status_code, 429)
+        print("Test for gives_up_with_last_response passed successfully!")
+
+    def test_reply_is_not_retried_after_processing(self):
+        self.server.responses = [(500, {})]
+        response = self.client.reply("7", 1, "Hello 🤖")
+        self.assertEqual(response.status_code, 500)
+        self.assertEqual(len(self.server.requests), 1)
+
+        # Rate limited replies were never processed, so they are retried
+        self.server.responses = [(429, {"Retry-After": "0"})]
+        response = self.client.reply("7", 1, "Hello 🤖")
+        self.assertEqual(response.json()["body"], "Hello 🤖")
+        print("Test for reply_is_not_retried_after_processing passed successfully!")
+
+    def test_refused_connection_is_retried_for_reply(self):
+        # A port nothing listens on: the request is never sent, so a reply is safe to retry
+        with socket.socket() as sock:
+            sock.bind(("127.0.0.1", 0))
+            port = sock.getsockname()[1]
+        client = IntercomClient(
+            "test-token",
+            base_url=f"http://127.0.0.1:{port}",
+            max_retries=2,
+            backoff=0.01,
+            rate_limit=1000,
+        )
+        with self.assertRaises(IntercomError):
+            client.reply("7", 1, "Hello")
+        self.assertEqual(client.stats()["requests"], 3)
+        self.assertEqual(client.stats()["retries"], 2)
+        client.session.close()
+        print("Test for refused_connection_is_retried_for_reply passed successfully!")
+
+    def test_read_timeout(self):
+        self.server.delay = 1
+        with self.assertRaises(IntercomError):
+            self.client.reply("7", 1, "Hello")
+        self.assertEqual(len(self.server.requests), 1)
+        self.assertEqual(self.client.stats()["errors"], 1)
+        print("Test for read_timeout passed successfully!")
+
+    def test_rate_limiter(self):
+        limiter = RateLimiter(rate=20, burst=2)
+        start = time.monotonic()
+        for _ in range(4):
+            limiter.acquire()
+        # Two tokens in the burst, then one every 50 ms
+        self.assertGreaterEqual(time.monotonic() - start, 0.09)
+        print("Test for rate_limiter passed successfully!")
+
+    def test_retry_after_seconds(self):
+        self.assertEqual(retry_after_seconds("3"), 3.0)
+        self.assertEqual(retry_after_seconds("Wed, 21 Oct 2015 07:28:00 GMT"), 0.0)
+        self.assertIsNone(retry_after_seconds(None))
+        self.assertIsNone(retry_after_seconds("soon"))
+        print("Test for retry_after_seconds passed successfully!")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,86 @@
+import threading
+import unittest
+from unittest.mock import patch
+
+import fakeredis
+import redis
+
+from job_queue import JobQueue
+
+
+class TestJobQueue(unittest.TestCase):
+    def setUp(self):
+        self.redis_client = fakeredis.FakeStrictRedis(decode_responses=True)
+        self.handled = []
+        self.queue = JobQueue(
+            self.redis_client, "test", self.handled.append, poll_timeout=0.05
+        )
+
+    def test_enqueue_and_process(self):
+        self.assertTrue(self.queue.enqueue("notif_1", {"conversation_id": "42"}))
+        self.assertEqual(self.queue.stats()["depth"], 1)
+        self.assertTrue(self.queue.process_next(timeout=0.05))
+        self.assertFalse(self.queue.process_next(timeout=0.05))
+        self.assertEqual(self.handled, [{"conversation_id": "42"}])
+
+        stats = self.queue.stats()
+        self.assertEqual(stats["depth"], 0)
+        self.assertEqual(stats["processed"], 1)
+        self.assertGreaterEqual(stats["latency_ms_p95"], stats["wait_ms_p50"])
+        print("Test for enqueue_and_process passed successfully!")
+
+    def test_duplicate_deliveries_run_once(self):
+        # Another worker process sharing the same Redis
+        other_worker = JobQueue(self.redis_client, "test", self.handled.append)
+        self.assertTrue(self.queue.enqueue("notif_1", {"n": 1}))
+        self.assertFalse(other_worker.enqueue("notif_1", {"n": 1}))
+        self.assertFalse(self.queue.enqueue("notif_1", {"n": 1}))
+        while self.queue.process_next(timeout=0.05):
+            pass
+        self.assertEqual(self.handled, [{"n": 1}])
+        self.assertEqual(self.queue.stats()["duplicates"], 1)
+        self.assertEqual(other_worker.stats()["duplicates"], 1)
+        print("Test for duplicate_deliveries_run_once passed successfully!")
+
+    def test_failed_job_is_not_retried(self):
+        def fail(payload):
+            raise RuntimeError("Intercom is down")
+
+        queue = JobQueue(self.redis_client, "failing", fail)
+        queue.enqueue("notif_2", {})
+        self.assertTrue(queue.process_next(timeout=0.05))
+        self.assertFalse(queue.process_next(timeout=0.05))
+        self.assertEqual(queue.stats()["failed"], 1)
+        print("Test for failed_job_is_not_retried passed successfully!")
+
+    def test_enqueue_error_allows_redelivery(self):
+        with patch.object(
+            self.redis_client, "lpush", side_effect=redis.ConnectionError("down")
+        ):
+            with self.assertRaises(redis.RedisError):
+                self.queue.enqueue("notif_3", {})
+        self.assertTrue(self.queue.enqueue("notif_3", {}))
+        print("Test for enqueue_error_allows_redelivery passed successfully!")
+
+    def test_background_workers(self):
+        done = threading.Event()
+        queue = JobQueue(
+            self.redis_client,
+            "background",
+            lambda payload: done.set(),
+            workers=2,
+            poll_timeout=0.05,
+        )
+        queue.start()
+        try:
+            self.assertEqual(queue.stats()["workers"], 2)
+            queue.enqueue("notif_4", {})
+            self.assertTrue(done.wait(2))
+        finally:
+            queue.stop()
+        self.assertEqual(queue.stats()["workers"], 0)
+        print("Test for background_workers passed successfully!")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,178 @@
+import asyncio
+import json
+import threading
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from llm_client import DONE, LLMClient, LLMError, parse_sse_line
+
+
+class FakeGateway(BaseHTTPRequestHandler):
+    """Streams "Hello world" after the queued failure statuses are used up."""
+
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_POST(self):
+        server = self.server
+        payload = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        with server.lock:
+            server.payloads.append(payload)
+            server.ports.add(self.client_address[1])
+            status = server.failures.pop(0) if server.failures else 200
+
+        if status != 200:
+            body = b'{"error": "unavailable"}'
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+            return
+
+        events = [
+            {"choices": [{"delta": {"role": "assistant"}}]},
+            {"choices": [{"delta": {"content": "Hello"}}]},
+            {"choices": [{"delta": {"content": " world"}}]},
+            {"choices": [{"delta": {}, "finish_reason": "stop"}]},
+        ]
+        body = b"".join(
+            f"data: {json.dumps(event)}\n\n".encode("utf-8") for event in events
+        )
+        body += b": keep-alive comment\n\ndata: [DONE]\n\n"
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def content(chunks):
+    return "".join(
+        chunk["choices"][0]["delta"].get("content") or "" for chunk in chunks
+    )
+
+
+class TestLLMClient(unittest.TestCase):
+    def setUp(self):
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), FakeGateway)
+        self.server.daemon_threads = True
+        self.server.lock = threading.Lock()
+        self.server.payloads = []
+        self.server.ports = set()
+        self.server.failures = []
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.client = LLMClient(
+            f"http://127.0.0.1:{self.server.server_port}/v1/",
+            api_key="test-key",
+            backoff=0.01,
+        )
+
+    def tearDown(self):
+        self.client.session.close()
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_parse_sse_line(self):
+        self.assertEqual(parse_sse_line(b'data: {"a": 1}'), {"a": 1})
+        self.assertIsNone(parse_sse_line(b""))
+        self.assertIsNone(parse_sse_line(": comment"))
+        self.assertIs(parse_sse_line("data: [DONE]"), DONE)
+        print("Test for parse_sse_line passed successfully!")
+
+    def test_stream_chat_reuses_connection(self):
+        for _ in range(3):
+            chunks = list(self.client.stream_chat(model="m", messages=[]))
+            self.assertEqual(content(chunks), "Hello world")
+        # Every request went over the same keep-alive connection
+        self.assertEqual(len(self.server.ports), 1)
+        self.assertTrue(all(payload["stream"] for payload in self.server.payloads))
+        self.assertEqual(self.client.stats()["requests"], 3)
+        self.assertEqual(self.client.stats()["active"], 0)
+        print("Test for stream_chat_reuses_connection passed successfully!")
+
+    def test_retries_retryable_statuses(self):
+        self.server.failures = [503, 429]
+        chunks = list(self.client.stream_chat(model="m", messages=[]))
+        self.assertEqual(content(chunks), "Hello world")
+        self.assertEqual(self.client.stats()["retries"], 2)
+        self.assertEqual(self.client.stats()["errors"], 0)
+        print("Test for retries_retryable_statuses passed successfully!")
+
+    def test_does_not_retry_client_errors(self):
+        self.server.failures = [400]
+        with self.assertRaises(LLMError):
+            list(self.client.stream_chat(model="m", messages=[]))
+        self.assertEqual(len(self.server.payloads), 1)
+        self.assertEqual(self.client.stats()["errors"], 1)
+        # The slot was released
+        self.assertEqual(content(self.client.stream_chat(model="m")), "Hello world")
+        print("Test for does_not_retry_client_errors passed successfully!")
+
+    def test_gives_up_after_max_retries(self):
+        self.server.failures = [502, 502, 502, 502]
+        with self.assertRaises(LLMError):
+            list(self.client.stream_chat(model="m", messages=[]))
+        self.assertEqual(len(self.server.payloads), self.client.max_retries + 1)
+        print("Test for gives_up_after_max_retries passed successfully!")
+
+    def test_concurrency_limit(self):
+        client = LLMClient(
+            f"http://127.0.0.1:{self.server.server_port}/v1",
+            max_concurrency=1,
+            queue_timeout=0.05,
+        )
+        stream = client.stream_chat(model="m")
+        next(stream)
+        with self.assertRaises(LLMError):
+            next(client.stream_chat(model="m"))
+        stream.close()
+        self.assertEqual(content(client.stream_chat(model="m")), "Hello world")
+        client.session.close()
+        print("Test for concurrency_limit passed successfully!")
+
+    def test_astream_chat(self):
+        self.server.failures = [503]
+
+        async def collect():
+            try:
+                return [
+                    [chunk async for chunk in self.client.astream_chat(model="m")]
+                    for _ in range(2)
+                ]
+            finally:
+                await self.client.aclose()
+
+        for chunks in asyncio.run(collect()):
+            self.assertEqual(content(chunks), "Hello world")
+        self.assertEqual(self.client.stats()["retries"], 1)
+        self.assertEqual(self.server.payloads[-1], {"model": "m", "stream": True})
+        self.assertIsNone(self.client._async_session)
+        print("Test for astream_chat passed successfully!")
+
+    def test_async_session_is_closed_when_the_loop_changes(self):
+        client = LLMClient(
+            f"http://127.0.0.1:{self.server.server_port}/v1", pool_size=3
+        )
+
+        async def stream():
+            chunks = [chunk async for chunk in client.astream_chat(model="m")]
+            return content(chunks), client._async_session
+
+        first_content, first_session = asyncio.run(stream())
+        second_content, second_session = asyncio.run(stream())
+        self.assertEqual(first_content, second_content)
+        self.assertTrue(first_session.closed)
+        self.assertEqual(second_session.connector.limit, 3)
+        asyncio.run(client.aclose())
+        self.assertTrue(second_session.closed)
+        client.session.close()
+        print(
+            "Test for async_session_is_closed_when_the_loop_changes passed successfully!"
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
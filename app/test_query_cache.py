@@ -0,0 +1,87 @@
+import threading
+import time
+import unittest
+
+import fakeredis
+import numpy as np
+
+from query_cache import QueryEmbeddingCache
+
+
+class TestQueryEmbeddingCache(unittest.TestCase):
+    def setUp(self):
+        self.vector = np.arange(4, dtype=np.float32)
+
+    def test_hit_and_miss_counters(self):
+        cache = QueryEmbeddingCache("model", maxsize=4)
+        self.assertIsNone(cache.get("what is defang"))
+        cache.put("what is defang", self.vector)
+        np.testing.assert_array_equal(cache.get("what is defang"), self.vector)
+        stats = cache.stats()
+        self.assertEqual((stats["hits"], stats["misses"]), (1, 1))
+        self.assertEqual(stats["hit_rate"], 0.5)
+        print("Test for hit_and_miss_counters passed successfully!")
+
+    def test_lru_eviction(self):
+        cache = QueryEmbeddingCache("model", maxsize=2)
+        cache.put("a", self.vector)
+        cache.put("b", self.vector)
+        cache.get("a")  # "b" is now least recently used
+        cache.put("c", self.vector)
+        self.assertIsNotNone(cache.get("a"))
+        self.assertIsNone(cache.get("b"))
+        self.assertIsNotNone(cache.get("c"))
+        print("Test for lru_eviction passed successfully!")
+
+    def test_ttl_expiry(self):
+        cache = QueryEmbeddingCache("model", ttl=0.05)
+        cache.put("a", self.vector)
+        time.sleep(0.1)
+        self.assertIsNone(cache.get("a"))
+        self.assertEqual(cache.stats()["size"], 0)
+        print("Test for ttl_expiry passed successfully!")
+
+    def test_cached_vectors_are_read_only(self):
+        cache = QueryEmbeddingCache("model")
+        cache.put("a", self.vector)
+        with self.assertRaises(ValueError):
+            cache.get("a")[0] = 1.0
+        print("Test for cached_vectors_are_read_only passed successfully!")
+
+    def test_shared_through_redis(self):
+        redis_client = fakeredis.FakeStrictRedis(decode_responses=True)
+        writer = QueryEmbeddingCache("model", redis_client=redis_client)
+        reader = QueryEmbeddingCache("model", redis_client=redis_client)
+        writer.put("what is defang", self.vector)
+        np.testing.assert_array_equal(reader.get("what is defang"), self.vector)
+        self.assertEqual(reader.stats()["redis_hits"], 1)
+        # the second lookup is served from the in-process LRU
+        reader.get("what is defang")
+        self.assertEqual(reader.stats()["redis_hits"], 1)
+        # a different model must not see the entry
+        other = QueryEmbeddingCache("other-model", redis_client=redis_client)
+        self.assertIsNone(other.get("what is defang"))
+        print("Test for shared_through_redis passed successfully!")
+
+    def test_thread_safety(self):
+        cache = QueryEmbeddingCache("model", maxsize=16)
+
+        def worker(offset):
+            for i in range(200):
+                key = str((i + offset) % 32)
+                if cache.get(key) is None:
+                    cache.put(key, self.vector)
+
+        threads = [threading.Thread(target=worker, args=(n,)) for n in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        stats = cache.stats()
+        self.assertLessEqual(stats["size"], 16)
+        self.assertEqual(stats["hits"] + stats["misses"], 8 * 200)
+        print("Test for thread_safety passed successfully!")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,20 +1,117 @@
+import asyncio
 import unittest
+from unittest.mock import patch
 
+import fakeredis
+
+from ann_index import ExactIndex
+from answer_cache import AnswerCache
+from embedding_store import EmbeddingStoreError
 from rag_system import RAGSystem
-import os
+from sample_index import SampleIndex
+from scoring import QuantizedMatrix, ScoringEngine
 
 
 class TestRAGSystem(unittest.TestCase):
     @classmethod
     def setUpClass(cls):
         cls.rag_system = RAGSystem(knowledge_base_path="test_knowledge_base.json")
-        cls.rag_system.rebuild_embeddings()
-        cls.initial_embeddings = cls.rag_system.doc_embeddings.clone()
+        cls.rag_system.rebuild_embeddings(cls.rag_system.knowledge_base)
+        cls.initial_embeddings = cls.rag_system.doc_embeddings.copy()
         assert cls.initial_embeddings is not None, (
             "Embeddings were not rebuilt properly."
         )
         print("Successfully set up RAG System class for testing!")
 
+    def test_warm_start_from_prebuilt_store(self):
+        with (
+            patch.dict("os.environ", {"RAG_MODEL_LOAD": "lazy"}),
+            patch.object(RAGSystem, "rebuild_embeddings") as rebuild,
+        ):
+            rag_system = RAGSystem(knowledge_base_path="test_knowledge_base.json")
+        rebuild.assert_not_called()
+        self.assertFalse(rag_system.get_stats()["model_loaded"])
+        self.assertGreater(len(rag_system.retrieve("What is Defang?")), 0)
+        self.assertTrue(rag_system.get_stats()["model_loaded"])
+        print("Test for warm_start_from_prebuilt_store passed successfully!")
+
+    def test_corrupt_store_is_rebuilt(self):
+        with (
+            patch(
+                "rag_system.EmbeddingStore.verify",
+                side_effect=EmbeddingStoreError("checksum mismatch"),
+            ),
+            patch.object(RAGSystem, "rebuild_embeddings") as rebuild,
+        ):
+            RAGSystem(knowledge_base_path="test_knowledge_base.json")
+        rebuild.assert_called_once()
+        print("Test for corrupt_store_is_rebuilt passed successfully!")
+
+    def test_encoder_backend_change_invalidates_stores(self):
+        rag_system = self.rag_system
+        store = rag_system._snapshot.store
+        self.assertTrue(rag_system._store_matches(store, rag_system.knowledge_base))
+        with patch.object(rag_system, "model_key", f"{RAGSystem.MODEL_NAME}:onnx-int8"):
+            self.assertFalse(
+                rag_system._store_matches(store, rag_system.knowledge_base)
+            )
+            with patch(
+                "rag_system.SampleIndex.build", wraps=SampleIndex.build
+            ) as build:
+                sample_index = rag_system._load_sample_index(rebuild=True)
+            build.assert_called_once()
+            self.assertEqual(sample_index.model, rag_system.model_key)
+        # Back to the files of the torch backend for the other tests
+        self.assertEqual(
+            rag_system._load_sample_index(rebuild=True).model, RAGSystem.MODEL_NAME
+        )
+        print("Test for encoder_backend_change_invalidates_stores passed successfully!")
+
+    def test_workers_do_not_build_stale_indexes(self):
+        rag_system = self.rag_system
+        with (
+            patch.object(rag_system, "SAMPLES_PATH", "test_knowledge_base.json"),
+            patch.object(rag_system, "index_backend", "ivf"),
+            patch.object(rag_system, "ANN_INDEX_PATH", "./data/missing.index"),
+            patch("rag_system.SampleIndex.build") as build_samples,
+            patch("rag_system.IVFIndex.build") as build_ivf,
+            patch("rag_system.BM25Index.build") as build_bm25,
+        ):
+            # Not the samples the index was built from, and no IVF index on disk
+            self.assertIsNone(rag_system._load_sample_index())
+            self.assertIsInstance(
+                rag_system._load_ann_index(rag_system._snapshot.store), ExactIndex
+            )
+            # Another knowledge base than the BM25 index was built from
+            self.assertIsNone(
+                rag_system._load_bm25_index(rag_system.knowledge_base, "other")
+            )
+        build_samples.assert_not_called()
+        build_ivf.assert_not_called()
+        build_bm25.assert_not_called()
+        print("Test for workers_do_not_build_stale_indexes passed successfully!")
+
+    def test_build_indexes_fills_in_missing_indexes(self):
+        rag_system = RAGSystem(knowledge_base_path="test_knowledge_base.json")
+        snapshot = rag_system._snapshot
+        rag_system._swap_snapshot(
+            rag_system._new_snapshot(
+                snapshot.knowledge_base,
+                snapshot.store,
+                snapshot.generation,
+                snapshot.ann_index,
+            )
+        )
+        generation = rag_system.index_generation.value
+        rag_system.build_indexes()
+        self.assertIsNotNone(rag_system._snapshot.bm25_index)
+        self.assertIsNotNone(rag_system._snapshot.sample_index)
+        self.assertEqual(rag_system.index_generation.value, generation + 1)
+        # Nothing left to build
+        rag_system.build_indexes()
+        self.assertEqual(rag_system.index_generation.value, generation + 1)
+        print("Test for build_indexes_fills_in_missing_indexes passed successfully!")
+
     def test_normalize_query(self):
         query = "  Hello World  "
         normalized_query = self.rag_system.normalize_query(query)
@@ -51,6 +148,101 @@ class TestRAGSystem(unittest.TestCase):
         )  # should have exactly one embedding
         print("Test for get_query_embedding passed successfully!")
 
+    def test_get_query_embedding_cached(self):
+        first = self.rag_system.get_query_embedding("How do I install Defang?")
+        hits = self.rag_system.query_cache.stats()["hits"]
+        second = self.rag_system.get_query_embedding("  how do I   install defang? ")
+        self.assertEqual(self.rag_system.query_cache.stats()["hits"], hits + 1)
+        self.assertEqual(second.shape, first.shape)
+        self.assertTrue((second == first).all())
+        print("Test for get_query_embedding_cached passed successfully!")
+
+    def test_answer_query_stream_history_per_conversation(self):
+        def fake_stream(**kwargs):
+            question = kwargs["messages"][-1]["content"]
+            yield {"choices": [{"delta": {"content": f"Answer to {question}"}}]}
+            yield {"choices": [{"delta": {}, "finish_reason": "stop"}]}
+
+        with patch.object(
+            self.rag_system.llm_client, "stream_chat", side_effect=fake_stream
+        ) as create:
+            list(self.rag_system.answer_query_stream("What is Defang?", "session-a"))
+            list(self.rag_system.answer_query_stream("How do I deploy?", "session-b"))
+            list(self.rag_system.answer_query_stream("And to AWS?", "session-a"))
+
+        # The system prompt, then only this conversation's earlier turn
+        messages = create.call_args.kwargs["messages"]
+        self.assertEqual(
+            [message["content"] for message in messages[1:]],
+            ["What is Defang?", "Answer to What is Defang?", "And to AWS?"],
+        )
+        self.assertEqual(
+            len(self.rag_system.conversation_store.history("session-b")), 2
+        )
+        self.rag_system.clear_conversation_history("session-a")
+        self.assertEqual(self.rag_system.conversation_store.history("session-a"), [])
+        print(
+            "Test for answer_query_stream_history_per_conversation passed successfully!"
+        )
+
+    def test_answer_query_stream_uses_answer_cache(self):
+        def fake_stream(**kwargs):
+            yield {"choices": [{"delta": {"content": "Install it with brew."}}]}
+            yield {"choices": [{"delta": {}, "finish_reason": "stop"}]}
+
+        # A knowledge base title, so that retrieval finds documents with any encoder
+        question = self.rag_system.knowledge_base[0]["about"]
+        answer_cache = self.rag_system.answer_cache
+        self.rag_system.answer_cache = AnswerCache(
+            fakeredis.FakeStrictRedis(decode_responses=True)
+        )
+        try:
+            with patch.object(
+                self.rag_system.llm_client, "stream_chat", side_effect=fake_stream
+            ) as create:
+                first = "".join(
+                    self.rag_system.answer_query_stream(question, "cache-a")
+                )
+                second = "".join(
+                    self.rag_system.answer_query_stream(
+                        f"  {question.upper()}  ", "cache-b"
+                    )
+                )
+                self.assertEqual(create.call_count, 1)
+                self.assertEqual(second, first)
+
+                # Follow-up questions depend on the conversation, so they skip the cache
+                list(self.rag_system.answer_query_stream(question, "cache-a"))
+                self.assertEqual(create.call_count, 2)
+        finally:
+            self.rag_system.answer_cache = answer_cache
+        print("Test for answer_query_stream_uses_answer_cache passed successfully!")
+
+    def test_answer_query_stream_async(self):
+        async def fake_stream(**kwargs):
+            for content in ("Use ", "defang compose up."):
+                yield {"choices": [{"delta": {"content": content}}]}
+            yield {"choices": [{"delta": {"content": None}, "finish_reason": "stop"}]}
+
+        async def collect():
+            return [
+                token
+                async for token in self.rag_system.answer_query_stream_async(
+                    "How do I deploy?", "async-a"
+                )
+            ]
+
+        with patch.object(
+            self.rag_system.llm_client, "astream_chat", side_effect=fake_stream
+        ):
+            tokens = asyncio.run(collect())
+        self.assertEqual("".join(tokens[:2]), "Use defang compose up.")
+        self.assertEqual(
+            self.rag_system.conversation_store.history("async-a")[-1]["content"],
+            "Use defang compose up.",
+        )
+        print("Test for answer_query_stream_async passed successfully!")
+
     def test_get_doc_embeddings(self):
         doc_embeddings = self.rag_system.get_doc_embeddings()
         self.assertIsNotNone(doc_embeddings)
@@ -90,7 +282,7 @@ class TestRAGSystem(unittest.TestCase):
         query = "Does Defang have an MCP sample?"
         query_embedding = self.rag_system.get_query_embedding(query)
         doc_embeddings = self.rag_system.get_doc_embeddings()
-        doc_about_embeddings = self.rag_system.doc_about_embeddings()
+        doc_about_embeddings = self.rag_system.get_doc_about_embeddings()
 
         # call function and get results
         result = self.rag_system.compute_document_scores(
@@ -124,78 +316,162 @@ class TestRAGSystem(unittest.TestCase):
 
         print("Test for compute_document_scores passed successfully!")
 
-    def test_cache_check_reload_cache(self):
-        # Simulate cache file timestamp change to trigger _reload_cache
-        original_doc_embeddings_timestamp = self.rag_system.doc_embeddings_timestamp
-        original_doc_about_embeddings_timestamp = (
-            self.rag_system.doc_about_embeddings_timestamp
+    def test_retrieve_matches_full_scoring(self):
+        # the top-k fast path in retrieve should agree with scoring every document
+        query = "How do I deploy to AWS?"
+        query_embedding = self.rag_system.get_query_embedding(query)
+        doc_scores = self.rag_system.compute_document_scores(
+            query_embedding,
+            self.rag_system.get_doc_embeddings(),
+            self.rag_system.get_doc_about_embeddings(),
+            high_match_threshold=0.8,
+        )
+        expected = self.rag_system.get_top_docs(
+            doc_scores, similarity_threshold=0.4, max_docs=5
+        )
+        # Dense retrieval alone, without the BM25 fusion
+        with patch.object(self.rag_system, "fusion_bm25_weight", 0):
+            result = self.rag_system.retrieve(query)
+        if expected:
+            self.assertEqual(
+                [doc["index"] for doc in result], [doc["index"] for doc in expected]
+            )
+        print("Test for retrieve_matches_full_scoring passed successfully!")
+
+    def test_retrieve_hybrid_finds_exact_identifiers(self):
+        identifier = "UPDATE_COMPLETE_CLEANUP_IN_PROGRESS"
+        expected = [
+            i
+            for i, doc in enumerate(self.rag_system.knowledge_base)
+            if identifier in doc["about"] + doc["text"]
+        ]
+        # Any threshold, so this does not depend on how well the encoder scores it
+        result = self.rag_system.retrieve(
+            f"stack is in {identifier} state", similarity_threshold=-1
+        )
+        self.assertIn(result[0]["index"], expected)
+        self.assertIsNotNone(self.rag_system.get_stats()["bm25_index"])
+        print("Test for retrieve_hybrid_finds_exact_identifiers passed successfully!")
+
+    def test_retrieve_hybrid_applies_similarity_threshold(self):
+        query = "hello world defang"
+        lexical_ids, _ = self.rag_system._snapshot.bm25_index.search(query, 20)
+        self.assertGreater(len(lexical_ids), 0)
+
+        # BM25 matches below the threshold do not get into the context
+        result = self.rag_system.retrieve(query, similarity_threshold=0.99)
+        self.assertEqual(result, self.rag_system.get_fallback_doc())
+        result = self.rag_system.retrieve(query)
+        if result != self.rag_system.get_fallback_doc():
+            for doc in result:
+                self.assertGreaterEqual(doc["relevance_score"], 0.4)
+        print(
+            "Test for retrieve_hybrid_applies_similarity_threshold passed successfully!"
+        )
+
+    def test_prepare_answer_includes_sample_compose_files(self):
+        answer = self.rag_system.prepare_answer(
+            "Show me a Django + Postgres compose file"
+        )
+        context = answer.messages[0]["content"]
+        self.assertIn("Sample django-postgres (", context)
+        self.assertIn("```yaml\nservices:", context)
+        self.assertIn(
+            " * [Sample django-postgres](https://github.com/DefangLabs/samples/tree/main/samples/django-postgres)",
+            answer.citations,
+        )
+        self.assertGreater(self.rag_system.get_stats()["sample_index"]["samples"], 0)
+
+        # Questions that name no technology get no samples
+        self.assertEqual(self.rag_system.find_samples("what is defang?"), [])
+        print(
+            "Test for prepare_answer_includes_sample_compose_files passed successfully!"
         )
 
-        # Patch os.path.getmtime to return different timestamps
-        def fake_getmtime(path):
-            if path == self.rag_system.DOC_EMBEDDINGS_PATH:
-                return original_doc_embeddings_timestamp + 1
-            if path == self.rag_system.DOC_ABOUT_EMBEDDINGS_PATH:
-                return original_doc_about_embeddings_timestamp + 1
-            return 0
+    def test_quantized_ranking_unchanged(self):
+        exact = ScoringEngine.from_embeddings(
+            self.rag_system.doc_embeddings, self.rag_system.doc_about_embeddings
+        )
+        queries = [
+            "How do I deploy to AWS?",
+            "What is Docker?",
+            "How do I reset my password?",
+        ]
+        for mode in QuantizedMatrix.MODES:
+            quantized = ScoringEngine.from_embeddings(
+                self.rag_system.doc_embeddings,
+                self.rag_system.doc_about_embeddings,
+                quantization=mode,
+            )
+            for query in queries:
+                query_embedding = self.rag_system.get_query_embedding(query)
+                self.assertEqual(
+                    list(quantized.search(query_embedding, 0.0, 0.8, 5)[0]),
+                    list(exact.search(query_embedding, 0.0, 0.8, 5)[0]),
+                )
+        print("Test for quantized_ranking_unchanged passed successfully!")
+
+    def test_snapshot_maps_quantized_copy_from_store(self):
+        snapshot = self.rag_system._snapshot
+        with patch.object(self.rag_system, "embedding_quantization", "int8"):
+            quantized = self.rag_system._new_snapshot(
+                snapshot.knowledge_base,
+                snapshot.store,
+                snapshot.generation,
+                snapshot.ann_index,
+            ).scoring_engine.quantized_matrix
+        # Read-only views of the mapped store, shared by all workers
+        self.assertFalse(quantized.codes.flags.writeable)
+        self.assertFalse(quantized.scales.flags.writeable)
+        print("Test for snapshot_maps_quantized_copy_from_store passed successfully!")
 
+    def test_cache_check_reload_cache(self):
+        # Simulate another worker swapping in a new index by bumping the generation
         self.rag_system._reload_cache_called = False
 
         def fake_reload_cache():
             self.rag_system._reload_cache_called = True
             real_reload_cache()
 
-        real_getmtime = os.path.getmtime
-        os.path.getmtime = fake_getmtime
-
         # Patch _reload_cache to set a flag
         real_reload_cache = self.rag_system._reload_cache
         self.rag_system._reload_cache = fake_reload_cache
 
+        generation = self.rag_system.index_generation.bump()
+
         # Call a cache_check-decorated method
         self.rag_system.retrieve("test query")
 
         self.assertTrue(
             self.rag_system._reload_cache_called,
-            "Cache reload was not triggered when timestamps changed.",
+            "Cache reload was not triggered when the index generation changed.",
         )
+        self.assertEqual(self.rag_system._snapshot.generation, generation)
+
+        # A second call must not reload again
+        self.rag_system._reload_cache_called = False
+        self.rag_system.retrieve("test query")
+        self.assertFalse(self.rag_system._reload_cache_called)
 
         # Restore patched methods
-        os.path.getmtime = real_getmtime
         self.rag_system._reload_cache = real_reload_cache
         print("Test for cache_check reload_cache passed successfully!")
 
-    def test_cache_check_rebuild_embeddings_on_error(self):
-        # Patch os.path.getmtime to raise OSError
-        real_getmtime = os.path.getmtime
-
-        def raise_oserror(path):
-            raise OSError("Simulated error")
-
-        os.path.getmtime = raise_oserror
-
-        self.rag_system._rebuild_embeddings_called = False
-
-        def fake_rebuild_embeddings():
-            self.rag_system._rebuild_embeddings_called = True
-            return real_rebuild_embeddings()
-
-        self.rag_system.rebuild_embeddings = fake_rebuild_embeddings
-        # Patch rebuild_embeddings to set a flag
-        real_rebuild_embeddings = self.rag_system.rebuild_embeddings
-
-        # Call a cache_check-decorated method
-        self.rag_system.retrieve("test query")
-
-        self.assertTrue(
-            self.rag_system._rebuild_embeddings_called,
-            "rebuild_embeddings was not triggered on cache access error.",
-        )
-
-        # Restore patched methods
-        os.path.getmtime = real_getmtime
-        self.rag_system.rebuild_embeddings = real_rebuild_embeddings
-        print("Test for cache_check rebuild_embeddings on error passed successfully!")
+    def test_cache_check_keeps_index_on_error(self):
+        # Simulate an unreadable embedding store after a generation bump
+        snapshot = self.rag_system._snapshot
+        real_index_path = self.rag_system.EMBEDDINGS_INDEX_PATH
+        self.rag_system.EMBEDDINGS_INDEX_PATH = "./data/does-not-exist.index"
+        try:
+            generation = self.rag_system.index_generation.bump()
+            result = self.rag_system.retrieve("What is Defang?")
+        finally:
+            self.rag_system.EMBEDDINGS_INDEX_PATH = real_index_path
+
+        self.assertIs(self.rag_system._snapshot, snapshot)
+        self.assertEqual(self.rag_system._checked_generation, generation)
+        self.assertGreater(len(result), 0)
+        print("Test for cache_check keeps index on error passed successfully!")
 
 
 if __name__ == "__main__":
@@ -0,0 +1,100 @@
+import os
+import tempfile
+import unittest
+
+import numpy as np
+
+from sample_index import SampleIndex, format_samples, technologies_in
+
+VOCABULARY = ["django", "postgres", "redis", "celery", "flask", "chat", "blog"]
+
+
+def encode(texts):
+    """Bag of words over a tiny vocabulary."""
+    return np.array(
+        [[text.lower().count(word) for word in VOCABULARY] for text in texts],
+        dtype=np.float32,
+    ) + np.float32(0.01)
+
+
+def sample(name, technologies, description, compose=""):
+    return {
+        "projectName": name,
+        "technologies": technologies,
+        "description": description,
+        "compose": compose,
+        "dockerfile": "FROM python:3.12",
+    }
+
+
+SAMPLES = [
+    sample("django-postgres", ["Python", "PostgreSQL"], "A blog", "image: postgres"),
+    sample("django-celery", ["Python", "PostgreSQL", "Redis"], "Celery chat"),
+    sample("flask-redis", ["Python", "Redis"], "A flask app", "image: redis"),
+    sample("nextjs-blog", ["Node.js"], "A Next.js blog"),
+]
+
+
+class TestSampleIndex(unittest.TestCase):
+    def setUp(self):
+        self.index = SampleIndex.build(SAMPLES, encode, samples_hash="h", model="m")
+
+    def names(self, query, k=2):
+        results = self.index.search(query, encode([query]), k=k)
+        return [result["projectName"] for result in results]
+
+    def test_technologies_in(self):
+        self.assertEqual(
+            technologies_in("Django + Postgres with NextJS and Node.js"),
+            {"Django", "PostgreSQL", "Next.js", "Node.js"},
+        )
+        self.assertEqual(technologies_in("How do I go to the dashboard?"), set())
+        print("Test for technologies_in passed successfully!")
+
+    def test_bitmap_intersection(self):
+        # Names count as facets: Django is only in the sample names
+        ids, counts = self.index.candidates("a django + postgres compose file")
+        self.assertEqual(ids.tolist(), [0, 1])
+        self.assertEqual(counts.tolist(), [2, 2])
+        # Re-ranked by meaning within the candidates
+        self.assertEqual(
+            self.names("django postgres celery chat"),
+            ["django-celery", "django-postgres"],
+        )
+        self.assertEqual(self.names("unrelated question"), [])
+        print("Test for bitmap_intersection passed successfully!")
+
+    def test_no_sample_has_every_technology(self):
+        # Samples with more of the technologies rank first
+        self.assertEqual(
+            self.names("flask with redis and postgres", k=3),
+            ["flask-redis", "django-celery", "django-postgres"],
+        )
+        print("Test for no_sample_has_every_technology passed successfully!")
+
+    def test_save_and_load(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, "samples.index")
+            self.index.save(path)
+            loaded = SampleIndex.load(path, SAMPLES)
+            self.assertEqual((loaded.samples_hash, loaded.model), ("h", "m"))
+            np.testing.assert_allclose(loaded.embeddings, self.index.embeddings)
+            self.assertEqual(loaded.bitmaps, self.index.bitmaps)
+        print("Test for save_and_load passed successfully!")
+
+    def test_format_samples(self):
+        compose = "\n".join(f"  line{i}: value" for i in range(100))
+        samples = [sample("big", [], "Big.", compose), sample("small", [], "Small.")]
+        context = format_samples(samples, max_tokens=120)
+        self.assertIn(
+            "Sample big (https://github.com/DefangLabs/samples/tree/main/samples/big)",
+            context,
+        )
+        self.assertIn("  line0: value\n", context)
+        self.assertIn("# ...\n```", context)
+        self.assertNotIn("line99", context)
+        print("Test for format_samples passed successfully!")
+
+
+if __name__ == "__main__":
+    unittest.main()
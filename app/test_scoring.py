@@ -0,0 +1,189 @@
+import os
+import tempfile
+import unittest
+
+import numpy as np
+
+from embedding_store import EmbeddingStore, write_embedding_store
+from scoring import (
+    QuantizedMatrix,
+    ScoringEngine,
+    normalize_rows,
+    quantized_arrays,
+    stack_embeddings,
+)
+
+
+class TestScoringEngine(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        rng = np.random.default_rng(42)
+        cls.doc_embeddings = rng.normal(size=(200, 32)).astype(np.float32)
+        cls.doc_about_embeddings = rng.normal(size=(200, 32)).astype(np.float32)
+        cls.query_embedding = rng.normal(size=(1, 32)).astype(np.float32)
+        cls.engine = ScoringEngine.from_embeddings(
+            cls.doc_embeddings, cls.doc_about_embeddings
+        )
+        print("Successfully set up ScoringEngine class for testing!")
+
+    def test_normalize_rows(self):
+        matrix = np.array([[3.0, 4.0], [0.0, 0.0]])
+        normalized = normalize_rows(matrix)
+        np.testing.assert_allclose(normalized, [[0.6, 0.8], [0.0, 0.0]])
+        self.assertEqual(normalized.dtype, np.float32)
+        print("Test for normalize_rows passed successfully!")
+
+    def test_similarities_match_cosine(self):
+        text_similarities, about_similarities = self.engine.similarities(
+            self.query_embedding
+        )
+        query = self.query_embedding[0] / np.linalg.norm(self.query_embedding[0])
+        expected_text = (
+            self.doc_embeddings @ query / np.linalg.norm(self.doc_embeddings, axis=1)
+        )
+        np.testing.assert_allclose(text_similarities, expected_text, atol=1e-5)
+        self.assertEqual(about_similarities.shape, (200,))
+        print("Test for similarities_match_cosine passed successfully!")
+
+    def test_relevance_scores_match_loop(self):
+        text_similarities = np.array([0.9, 0.5, 0.2, 0.7])
+        about_similarities = np.array([0.1, 0.85, 0.3, 0.6])
+        scores = ScoringEngine.relevance_scores(
+            text_similarities, about_similarities, high_match_threshold=0.8
+        )
+        expected = []
+        for text, about in zip(text_similarities, about_similarities):
+            if about >= 0.8 or text >= 0.8:
+                expected.append(max(about, text))
+            else:
+                expected.append(0.3 * about + 0.7 * text)
+        np.testing.assert_allclose(scores, expected)
+        print("Test for relevance_scores_match_loop passed successfully!")
+
+    def test_top_k_matches_full_sort(self):
+        _, _, scores = self.engine.score(self.query_embedding, high_match_threshold=0.8)
+        top = self.engine.top_k(scores, similarity_threshold=-1.0, max_docs=5)
+        expected = sorted(range(len(scores)), key=lambda i: scores[i], reverse=True)[:5]
+        self.assertEqual(list(top), expected)
+        print("Test for top_k_matches_full_sort passed successfully!")
+
+    def test_search_with_candidates(self):
+        full = self.engine.search(self.query_embedding, -1.0, 0.8, 5)
+        everything = self.engine.search(
+            self.query_embedding, -1.0, 0.8, 5, np.arange(200)
+        )
+        for expected, actual in zip(full, everything):
+            np.testing.assert_allclose(actual, expected)
+
+        subset = np.array([3, 17, 42])
+        indices, _, _, scores = self.engine.search(
+            self.query_embedding, -1.0, 0.8, 5, subset
+        )
+        self.assertEqual(sorted(indices), [3, 17, 42])
+        self.assertTrue((np.diff(scores) <= 0).all())
+        print("Test for search_with_candidates passed successfully!")
+
+    def test_top_k_threshold_and_small_input(self):
+        scores = np.array([0.9, 0.6, 0.7])
+        self.assertEqual(list(ScoringEngine.top_k(scores, 0.7, 2)), [0, 2])
+        self.assertEqual(list(ScoringEngine.top_k(scores, 0.0, 10)), [0, 2, 1])
+        self.assertEqual(list(ScoringEngine.top_k(scores, 0.95, 5)), [])
+        self.assertEqual(list(ScoringEngine.top_k(np.array([]), 0.0, 5)), [])
+        print("Test for top_k_threshold_and_small_input passed successfully!")
+
+    def test_quantized_search_matches_exact(self):
+        expected = self.engine.search(self.query_embedding, -1.0, 0.8, 5)
+        for mode in QuantizedMatrix.MODES:
+            engine = ScoringEngine.from_embeddings(
+                self.doc_embeddings, self.doc_about_embeddings, quantization=mode
+            )
+            actual = engine.search(self.query_embedding, -1.0, 0.8, 5)
+            self.assertEqual(list(actual[0]), list(expected[0]))
+            # Re-ranked scores are exact float32, not approximations
+            np.testing.assert_allclose(actual[3], expected[3], atol=1e-6)
+
+            candidates = np.arange(0, 200, 2)
+            self.assertEqual(
+                list(engine.search(self.query_embedding, -1.0, 0.8, 5, candidates)[0]),
+                list(
+                    self.engine.search(self.query_embedding, -1.0, 0.8, 5, candidates)[
+                        0
+                    ]
+                ),
+            )
+        print("Test for quantized_search_matches_exact passed successfully!")
+
+    def test_quantized_matrix(self):
+        matrix = normalize_rows(self.doc_embeddings)
+        query = normalize_rows(self.query_embedding)[0]
+        for mode, tolerance in (("float16", 1e-3), ("int8", 2e-2)):
+            quantized = QuantizedMatrix.quantize(matrix, mode)
+            self.assertLess(quantized.nbytes, matrix.nbytes)
+            np.testing.assert_allclose(
+                quantized.matvec(query), matrix @ query, atol=tolerance
+            )
+            rows = np.array([5, 1, 9])
+            np.testing.assert_allclose(
+                quantized.matvec(query, rows), matrix[rows] @ query, atol=tolerance
+            )
+        with self.assertRaises(ValueError):
+            QuantizedMatrix.quantize(matrix, "int4")
+        print("Test for quantized_matrix passed successfully!")
+
+    def test_quantized_arrays_are_mapped_from_store(self):
+        matrix = stack_embeddings(self.doc_embeddings, self.doc_about_embeddings)
+        query = normalize_rows(self.query_embedding)[0]
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, "embeddings.index")
+            write_embedding_store(path, quantized_arrays("doc_matrix", matrix), "kb")
+            store = EmbeddingStore(path)
+            store.verify()
+            np.testing.assert_array_equal(store["doc_matrix"], matrix)
+            for mode in QuantizedMatrix.MODES:
+                quantized = QuantizedMatrix.from_store(store, "doc_matrix", mode)
+                # Views of the shared mapping, not private copies
+                self.assertFalse(quantized.codes.flags.writeable)
+                np.testing.assert_array_equal(
+                    quantized.matvec(query),
+                    QuantizedMatrix.quantize(matrix, mode).matvec(query),
+                )
+                engine = ScoringEngine(
+                    store["doc_matrix"], quantization=mode, quantized_matrix=quantized
+                )
+                self.assertIs(engine.quantized_matrix, quantized)
+        print("Test for quantized_arrays_are_mapped_from_store passed successfully!")
+
+    def test_stacked_matrix(self):
+        matrix = stack_embeddings(self.doc_embeddings, self.doc_about_embeddings)
+        self.assertEqual(matrix.shape, (400, 32))
+        self.assertTrue(matrix.flags["C_CONTIGUOUS"])
+        np.testing.assert_allclose(np.linalg.norm(matrix, axis=1), 1.0, atol=1e-6)
+
+        # One product over the stack gives both similarity vectors
+        engine = ScoringEngine(matrix)
+        self.assertEqual(len(engine), 200)
+        self.assertTrue(np.shares_memory(engine.matrix, matrix))
+        query = normalize_rows(self.query_embedding)[0]
+        text_similarities, about_similarities = engine.similarities(query)
+        np.testing.assert_allclose(
+            text_similarities, normalize_rows(self.doc_embeddings) @ query, atol=1e-6
+        )
+        np.testing.assert_allclose(
+            about_similarities,
+            normalize_rows(self.doc_about_embeddings) @ query,
+            atol=1e-6,
+        )
+        print("Test for stacked_matrix passed successfully!")
+
+    def test_shape_mismatch(self):
+        with self.assertRaises(ValueError):
+            ScoringEngine.from_embeddings(
+                self.doc_embeddings, self.doc_about_embeddings[:10]
+            )
+        with self.assertRaises(ValueError):
+            ScoringEngine(self.doc_embeddings[:3])
+        print("Test for shape_mismatch passed successfully!")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -3,12 +3,18 @@ import traceback
 import segment.analytics as analytics
 
 
+# Rough token count for budgeting prompts (about 4 characters per token for English)
+def estimate_tokens(text):
+    return (len(text) + 3) // 4
+
+
 # Shared function to generate response stream from RAG system
 def generate(rag, query, source, anonymous_id):
     full_response = ""
     print(f"Received query: {str(query)}", file=sys.stderr)
     try:
-        for token in rag.answer_query_stream(query):
+        # The anonymous id doubles as the conversation id for chat history
+        for token in rag.answer_query_stream(query, anonymous_id):
             yield token
             full_response += token
     except Exception as e:
@@ -28,3 +34,28 @@ def generate(rag, query, source, anonymous_id):
         )
 
     return full_response
+
+
+# Async variant of generate, used by the async server
+async def generate_async(rag, query, source, anonymous_id):
+    full_response = ""
+    print(f"Received query: {str(query)}", file=sys.stderr)
+    try:
+        async for token in rag.answer_query_stream_async(query, anonymous_id):
+            yield token
+            full_response += token
+    except Exception as e:
+        print(f"Error in RAG system: {e}", file=sys.stderr)
+        traceback.print_exc()
+        yield "Internal Server Error"
+
+    if not full_response:
+        full_response = "No response generated"
+
+    if analytics.write_key:
+        # Queued and sent by the analytics client's own thread
+        analytics.track(
+            anonymous_id=anonymous_id,
+            event="Chatbot Question submitted",
+            properties={"query": query, "response": full_response, "source": source},
+        )